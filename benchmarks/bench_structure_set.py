@@ -0,0 +1,253 @@
+'''
+Benchmark of the structure set workflows against the stand-in connect
+module, see fake_connect/connect.
+
+For each patient, times CUHRTStructureSet construction from the
+latest approval, json_export without and with contours, binary_export
+with contours, loading each snapshot and reading its contours, matching
+the rows to the first approval, and restore_all_contours. Patients are
+synthetic, of the given sizes, or recorded from RayStation and replayed
+from fixtures (--fixture, see modules/session_fixture.py). Each step is
+repeated and the fastest time kept. Results are written as json, with
+the git commit, so they can be compared over time.
+
+Usage, from the repository root:
+    python -m benchmarks.bench_structure_set [small medium large ...]
+        [--fixture patient.cuhfx ...] [--latency S] [--point-latency S]
+        [--repeat N] [-o results.json]
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import sys
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from datetime import datetime as dt
+from io import StringIO
+from json import dump
+from os import makedirs, path
+from platform import platform, python_version
+from subprocess import CalledProcessError, check_output
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+# The stand-in is used even if a real connect module is installed
+sys.path.insert(0, path.join(ROOT, "fake_connect"))
+
+import connect
+from connect import synthetic_patient, set_patient
+
+from modules.roi_tolerance import CUHRTToleranceMatrix
+from modules.session_fixture import read_fixture
+from modules.structure_set_classes import SESSION, CUHRTStructureSet
+
+RESULTS_DIR = path.join(ROOT, "benchmarks", "results")
+
+# n_rois, n_contours, points_per_contour
+SIZES = {
+    'small': (20, 30, 64),
+    'medium': (60, 80, 128),
+    'large': (150, 150, 256),
+}
+
+
+def best_time(func, setup = None, repeat: int = 3) -> float:
+    '''
+        Fastest of repeat runs of func(setup()) [s], output suppressed.
+    '''
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        with redirect_stdout(StringIO()):
+            start = perf_counter()
+            func(arg)
+            times.append(perf_counter() - start)
+    return min(times)
+
+
+def _fresh_patient(patient: dict):
+    set_patient(patient)
+    SESSION.invalidate()
+
+
+def _load_all_contours(f_path: str):
+    structure_set = CUHRTStructureSet(f_path = f_path)
+    for roi in structure_set.rois:
+        roi.stored_contours()
+    return structure_set
+
+
+def _patient_size(patient: dict) -> dict:
+    '''
+        ROIs, contours and points of the structure set's ROI geometries.
+    '''
+    rois = patient.get('roi_geometries') \
+        or patient['sub_structure_sets'][-1]['rois']
+    contours = [
+        contour for roi in rois for contour in roi.get('contours') or []
+    ]
+    return {
+        'n_rois': len(rois),
+        'n_contours': len(contours),
+        'n_points': sum(len(contour) for contour in contours),
+    }
+
+
+def bench_patient(name: str, patient: dict, repeat: int = 3) -> dict:
+    _fresh_patient(patient)
+
+    def current():
+        return CUHRTStructureSet(
+            sub_structure_set = SESSION.ss.SubStructureSets[-1]
+        )
+
+    structure_set = current()
+    reference = CUHRTStructureSet(
+        sub_structure_set = SESSION.ss.SubStructureSets[0]
+    )
+    timings = {}
+    calls = {}
+
+    def record(step: str, func, setup = None):
+        connect.reset_call_count()
+        timings[step] = best_time(func, setup, repeat)
+        calls[step] = connect.call_count() // repeat
+
+    with TemporaryDirectory() as f_out:
+        record("construct", lambda _: current())
+        record(
+            "json_export",
+            lambda _: structure_set.json_export(f_out = f_out)
+        )
+        record(
+            "json_export_contours",
+            lambda _: structure_set.json_export(
+                f_out = f_out, include_contours = True, stream = True
+            )
+        )
+        json_path = structure_set.export_stats['f_path']
+        record(
+            "binary_export_contours",
+            lambda _: structure_set.binary_export(
+                f_out = f_out, include_contours = True,
+                dtype = "quantized", stream = True
+            )
+        )
+        binary_path = structure_set.export_stats['f_path']
+        record("load_json", lambda _: _load_all_contours(json_path))
+        record("load_binary", lambda _: _load_all_contours(binary_path))
+        record(
+            "matching",
+            lambda _: CUHRTToleranceMatrix(
+                structure_set.rois, reference.rois
+            ).matching_indices()
+        )
+
+        def restore_setup():
+            _fresh_patient(patient)
+            return CUHRTStructureSet(f_path = binary_path)
+
+        record(
+            "restore_all_contours",
+            lambda snapshot: snapshot.restore_all_contours(),
+            restore_setup
+        )
+        _fresh_patient(patient)
+
+    result = {'patient': name}
+    result.update(_patient_size(patient))
+    result.update({
+        'timings_s': timings,
+        'scripting_calls': calls,
+    })
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return check_output(
+            ["git", "rev-parse", "HEAD"], cwd = ROOT
+        ).decode().strip()
+    except (CalledProcessError, OSError):
+        return None
+
+
+def main(argv = None):
+    parser = ArgumentParser(
+        description = "Benchmark the structure set workflows offline."
+    )
+    parser.add_argument(
+        "sizes", nargs = "*",
+        help = "synthetic patient sizes to run, of "
+            f"{', '.join(SIZES)} (default: small medium)"
+    )
+    parser.add_argument(
+        "--fixture", action = "append", default = [],
+        help = "recorded patient fixture to run, may be repeated"
+    )
+    parser.add_argument(
+        "--latency", type = float, default = 0.0,
+        help = "simulated latency per scripting call [s]"
+    )
+    parser.add_argument(
+        "--point-latency", type = float, default = 0.0,
+        help = "simulated latency per contour point [s]"
+    )
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument(
+        "-o", "--output", default = None,
+        help = "results json (default: benchmarks/results/<time>.json)"
+    )
+    args = parser.parse_args(argv)
+    for name in args.sizes:
+        if name not in SIZES:
+            parser.error(f"unknown size: {name}")
+
+    connect.configure_latency(call = args.latency, point = args.point_latency)
+    results = {
+        'timestamp': dt.now().isoformat(timespec = "seconds"),
+        'git_commit': git_commit(),
+        'python': python_version(),
+        'platform': platform(),
+        'latency_s': {'call': args.latency, 'point': args.point_latency},
+        'repeat': args.repeat,
+        'results': [],
+    }
+    patients = [
+        (name, lambda name = name: synthetic_patient(
+            n_rois = SIZES[name][0], n_contours = SIZES[name][1],
+            points_per_contour = SIZES[name][2]
+        )) for name in args.sizes or (
+            [] if args.fixture else ["small", "medium"]
+        )
+    ] + [
+        (path.basename(f_path), lambda f_path = f_path: read_fixture(f_path))
+        for f_path in args.fixture
+    ]
+    for name, make_patient in patients:
+        result = bench_patient(name, make_patient(), args.repeat)
+        results['results'].append(result)
+        print(
+            f"{name}: {result['n_rois']} ROIs, {result['n_contours']} "
+            f"contours, {result['n_points']} points"
+        )
+        for step, seconds in result['timings_s'].items():
+            print(
+                f"    {step:<24}{seconds:9.3f}s"
+                f"{result['scripting_calls'][step]:>8} calls"
+            )
+
+    f_results = args.output or path.join(
+        RESULTS_DIR, f"bench_structure_set_{dt.now():%Y%m%d_%H%M%S}.json"
+    )
+    makedirs(path.dirname(path.abspath(f_results)), exist_ok = True)
+    with open(f_results, 'w', encoding = 'utf-8') as f:
+        dump(results, f, indent = 4)
+    print(f"Results written to {f_results}.")
+
+
+if __name__ == "__main__":
+    main()
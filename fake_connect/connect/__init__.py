@@ -0,0 +1,36 @@
+'''
+Stand-in for the RayStation connect module, so that the structure set
+classes can run, and be benchmarked, without RayStation.
+
+Put fake_connect on the path ahead of any real connect module:
+
+    PYTHONPATH=fake_connect python -m benchmarks.bench_structure_set
+
+get_current serves the current patient: a default synthetic patient, or
+one set with set_patient, e.g. set_patient(synthetic_patient(n_rois=100)).
+A patient recorded from RayStation, see modules/session_fixture.py, is
+replayed with replay_fixture or the CUH_FAKE_RAYSTATION_FIXTURE
+environment variable. Simulated latency is set with configure_latency, or
+the CUH_FAKE_RAYSTATION_LATENCY environment variable [s per call].
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from os import environ
+
+from connect._model import (
+    FakePatient, call_count, configure_latency, current_patient,
+    get_current, reset_call_count, set_patient
+)
+from connect.replay import replay_fixture
+from connect.synthetic import synthetic_patient
+
+LATENCY_ENV_VAR = "CUH_FAKE_RAYSTATION_LATENCY"
+FIXTURE_ENV_VAR = "CUH_FAKE_RAYSTATION_FIXTURE"
+
+if environ.get(LATENCY_ENV_VAR):
+    configure_latency(call = float(environ[LATENCY_ENV_VAR]))
+if environ.get(FIXTURE_ENV_VAR):
+    replay_fixture(environ[FIXTURE_ENV_VAR])
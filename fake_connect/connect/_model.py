@@ -0,0 +1,434 @@
+'''
+Stand-in RayStation scripting objects, built from a patient dict.
+
+Only the part of the scripting API used by this repository is provided:
+get_current, the patient model, structure sets, sub-structure sets and
+their reviews, ROI geometries and their contours. Each call, and each
+access to PrimaryShape.Contours, waits for the simulated latency.
+
+Patient dict:
+    {
+        'patient_id': str,
+        'case': str,
+        'exam': str,
+        'sub_structure_sets': [{
+            'reviewer': "Last^First" or None,
+            'review_time': [year, month, day, hour, minute, second] or None,
+            'rois': [{
+                'name': str, 'colour': [a, r, g, b],
+                'volume': float [cc], 'centroid': {'x','y','z'} [cm],
+                'contours': list of lists of {'x','y','z'} points [cm],
+                'has_contours': bool (optional),
+            }, ...],
+        }, ...],
+        'roi_geometries': [roi, ...] (optional),
+    }
+
+The ROI geometries of the structure set are roi_geometries, as recorded
+by modules/session_fixture.py, or else those of the last sub-structure
+set, i.e. the latest approval. has_contours, if given, is returned by
+HasContours even when the contours were not recorded.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from threading import Lock
+from time import sleep
+
+LATENCY = {
+    # [s] per scripting call
+    'call': 0.0,
+    # [s] per contour point read or written
+    'point': 0.0,
+}
+
+_CALLS = {'count': 0}
+_CALLS_LOCK = Lock()
+_CURRENT = {'patient': None}
+
+
+def configure_latency(call: float = None, point: float = None):
+    '''
+        Simulated latency per scripting call and per contour point [s].
+    '''
+    if call is not None:
+        LATENCY['call'] = call
+    if point is not None:
+        LATENCY['point'] = point
+
+
+def call_count() -> int:
+    '''
+        Scripting calls made since the last reset_call_count.
+    '''
+    return _CALLS['count']
+
+
+def reset_call_count():
+    _CALLS['count'] = 0
+
+
+def _call(n_points: int = 0):
+    with _CALLS_LOCK:
+        _CALLS['count'] += 1
+    seconds = LATENCY['call'] + LATENCY['point'] * n_points
+    if seconds > 0:
+        sleep(seconds)
+
+
+def _n_points(contours: list) -> int:
+    return sum(len(contour) for contour in contours or [])
+
+
+def _volume_and_centroid(contours: list) -> tuple:
+    '''
+        Sum of shoelace areas × slice spacing [cc] and the area weighted
+        centroid [cm]. Holes are not accounted for.
+    '''
+    z_values = sorted({contour[0]['z'] for contour in contours if contour})
+    spacing = min(
+        (b - a for a, b in zip(z_values, z_values[1:])), default = 0.3
+    ) or 0.3
+
+    total = 0.0
+    moments = [0.0, 0.0, 0.0]
+    for contour in contours:
+        if len(contour) < 3:
+            continue
+        area = 0.0
+        cx = cy = 0.0
+        for p, q in zip(contour, contour[1:] + contour[:1]):
+            cross = p['x'] * q['y'] - q['x'] * p['y']
+            area += cross
+            cx += (p['x'] + q['x']) * cross
+            cy += (p['y'] + q['y']) * cross
+        area /= 2
+        if not area:
+            continue
+        total += abs(area)
+        moments[0] += abs(area) * cx / (6 * area)
+        moments[1] += abs(area) * cy / (6 * area)
+        moments[2] += abs(area) * contour[0]['z']
+
+    if not total:
+        return 0.0, {'x': 0.0, 'y': 0.0, 'z': 0.0}
+    return total * spacing, {
+        k: m / total for k, m in zip(('x', 'y', 'z'), moments)
+    }
+
+
+class _Collection():
+    '''
+        RayStation style collection, indexed by name or position.
+    '''
+    def __init__(self, items: list = None, key: str = "Name"):
+        self._key = key
+        self._items = {}
+        for item in items or []:
+            self.add(item)
+
+    def add(self, item):
+        self._items[getattr(item, self._key)] = item
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self._items.values())[key]
+        try:
+            return self._items[key]
+        except KeyError:
+            raise KeyError(f"No item named {key}.") from None
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _remove(self, key):
+        self._items.pop(key, None)
+
+
+class FakeColor():
+    def __init__(self, argb):
+        self._argb = [int(v) for v in argb]
+
+    def get_A(self):
+        return self._argb[0]
+
+    def get_R(self):
+        return self._argb[1]
+
+    def get_G(self):
+        return self._argb[2]
+
+    def get_B(self):
+        return self._argb[3]
+
+    @classmethod
+    def parse(cls, colour):
+        '''
+            From "A, R, G, B", as per CUHRTROI, [a, r, g, b] or a FakeColor.
+            Named colours are treated as white.
+        '''
+        if isinstance(colour, cls):
+            return colour
+        if isinstance(colour, str):
+            parts = [part.strip() for part in colour.split(",")]
+            colour = parts if len(parts) == 4 else (255, 255, 255, 255)
+        return cls(colour)
+
+
+class FakeShape():
+    def __init__(self, contours: list = None):
+        self._contours = contours
+
+    @property
+    def Contours(self):
+        _call(_n_points(self._contours))
+        return self._contours
+
+    @Contours.setter
+    def Contours(self, contours):
+        _call(_n_points(contours))
+        self._contours = [list(contour) for contour in contours]
+
+
+class FakeRoi():
+    '''
+        Entry of PatientModel.RegionsOfInterest.
+    '''
+    def __init__(self, patient_model, name: str, colour, roi_type: str):
+        self._patient_model = patient_model
+        self.Name = name
+        self.Color = FakeColor.parse(colour)
+        self.Type = roi_type
+
+    def CreateBoxGeometry(self, Size, Examination, Center,
+        Representation = 'Voxels', VoxelSize = None):
+        _call()
+        x0, y0, z0 = (Center[k] - Size[k] / 2 for k in ('x', 'y', 'z'))
+        x1, y1 = x0 + Size['x'], y0 + Size['y']
+        contours = [
+            [
+                {'x': x0, 'y': y0, 'z': z}, {'x': x1, 'y': y0, 'z': z},
+                {'x': x1, 'y': y1, 'z': z}, {'x': x0, 'y': y1, 'z': z},
+            ] for z in (z0, z0 + Size['z'])
+        ]
+        geometry = self._patient_model._structure_set(Examination.Name) \
+            .RoiGeometries[self.Name]
+        geometry.PrimaryShape = FakeShape(contours)
+
+    def DeleteRoi(self):
+        _call()
+        self._patient_model.RegionsOfInterest._remove(self.Name)
+        for ss in self._patient_model.StructureSets:
+            ss.RoiGeometries._remove(self.Name)
+
+
+class FakeRoiGeometry():
+    '''
+        ROI geometry of a structure set, or ROI structure of an approved
+        sub-structure set.
+    '''
+    def __init__(self, of_roi: FakeRoi, contours: list = None,
+        volume: float = None, centroid: dict = None,
+        has_contours: bool = None):
+        self.OfRoi = of_roi
+        self.PrimaryShape = FakeShape(contours) if contours else None
+        self._volume = volume
+        self._centroid = centroid
+        self._has_contours = has_contours
+
+    @property
+    def Name(self):
+        return self.OfRoi.Name
+
+    def HasContours(self) -> bool:
+        _call()
+        if self._has_contours is not None:
+            return self._has_contours
+        return self.PrimaryShape is not None \
+            and bool(self.PrimaryShape._contours)
+
+    def _stored_contours(self) -> list:
+        return self.PrimaryShape._contours if self.PrimaryShape else []
+
+    def GetRoiVolume(self) -> float:
+        _call()
+        if self._volume is not None:
+            return self._volume
+        return _volume_and_centroid(self._stored_contours())[0]
+
+    def GetCenterOfRoi(self) -> dict:
+        _call()
+        if self._centroid is not None:
+            return dict(self._centroid)
+        return _volume_and_centroid(self._stored_contours())[1]
+
+    def SetRepresentation(self, Representation: str):
+        _call()
+        # Volume and centroid are recomputed from the new contours
+        self._volume = None
+        self._centroid = None
+        self._has_contours = None
+
+
+class FakeDateTime():
+    def __init__(self, year, month, day, hour, minute, second):
+        self.Year = year
+        self.Month = month
+        self.Day = day
+        self.Hour = hour
+        self.Minute = minute
+        self.Second = second
+
+
+class FakeReview():
+    def __init__(self, reviewer: str, review_time: list):
+        self.ReviewerFullName = reviewer
+        self.ReviewTime = FakeDateTime(*review_time)
+
+
+class FakeSubStructureSet():
+    def __init__(self, review, roi_structures: list):
+        # None if not approved, so that Review.ReviewTime raises
+        self.Review = review
+        self.RoiStructures = roi_structures
+
+
+class FakeStructureSet():
+    def __init__(self, roi_geometries: list, sub_structure_sets: list):
+        self.RoiGeometries = _Collection(roi_geometries)
+        self.SubStructureSets = sub_structure_sets
+
+    def ComparisonOfRoiGeometries(self, RoiA: str, RoiB: str,
+        ComputeDistanceToAgreementMeasures: bool = True) -> dict:
+        '''
+            Computed from the contours with modules/roi_overlap.py.
+        '''
+        _call()
+        # Imported here so that NumPy is only needed for comparisons
+        from modules.roi_overlap import compare_contours
+        return compare_contours(
+            self.RoiGeometries[RoiA]._stored_contours(),
+            self.RoiGeometries[RoiB]._stored_contours(),
+            distance_to_agreement = ComputeDistanceToAgreementMeasures
+        )
+
+
+class FakePatientModel():
+    def __init__(self):
+        self.RegionsOfInterest = _Collection()
+        self.StructureSets = _Collection(key = "_exam_name")
+
+    def _structure_set(self, exam_name: str) -> FakeStructureSet:
+        return self.StructureSets[exam_name]
+
+    def GetUniqueRoiName(self, DesiredName: str) -> str:
+        _call()
+        name = DesiredName
+        i = 0
+        while name in self.RegionsOfInterest:
+            i += 1
+            name = f"{DesiredName} ({i})"
+        return name
+
+    def CreateRoi(self, Name: str, Type: str = "Undefined", Color = None,
+        TissueName = None, RbeCellTypeName = None, RoiMaterial = None):
+        _call()
+        if Name in self.RegionsOfInterest:
+            raise ValueError(f"ROI {Name} already exists.")
+        roi = FakeRoi(self, Name, Color or "255, 255, 255, 255", Type)
+        self.RegionsOfInterest.add(roi)
+        for ss in self.StructureSets:
+            ss.RoiGeometries.add(FakeRoiGeometry(roi))
+
+
+class FakeNamed():
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class FakePatient():
+    '''
+        Scripting objects of one patient, built from a patient dict.
+    '''
+    def __init__(self, data: dict):
+        self.data = data
+        self.PatientID = data['patient_id']
+        self.patient_model = FakePatientModel()
+        self.examination = FakeNamed(Name = data.get('exam', "CT 1"))
+        self.case = FakeNamed(
+            CaseName = data.get('case', "CASE 1"),
+            PatientModel = self.patient_model
+        )
+
+        sub_structure_sets = []
+        roi_structures = []
+        for sub in data['sub_structure_sets']:
+            roi_structures = [self._geometry(roi) for roi in sub['rois']]
+            review = FakeReview(sub['reviewer'], sub['review_time']) \
+                if sub.get('review_time') else None
+            sub_structure_sets.append(
+                FakeSubStructureSet(review, roi_structures)
+            )
+        if 'roi_geometries' in data:
+            roi_structures = [
+                self._geometry(roi) for roi in data['roi_geometries']
+            ]
+
+        structure_set = FakeStructureSet(roi_structures, sub_structure_sets)
+        structure_set._exam_name = self.examination.Name
+        self.patient_model.StructureSets.add(structure_set)
+
+    def _geometry(self, roi: dict) -> FakeRoiGeometry:
+        if roi['name'] not in self.patient_model.RegionsOfInterest:
+            self.patient_model.RegionsOfInterest.add(FakeRoi(
+                self.patient_model, roi['name'], roi['colour'],
+                roi.get('type', "Organ")
+            ))
+        return FakeRoiGeometry(
+            self.patient_model.RegionsOfInterest[roi['name']],
+            roi.get('contours'), roi.get('volume'), roi.get('centroid'),
+            roi.get('has_contours'),
+        )
+
+
+def set_patient(patient) -> FakePatient:
+    '''
+        Make patient, a patient dict or FakePatient, the current patient.
+    '''
+    if not isinstance(patient, FakePatient):
+        patient = FakePatient(patient)
+    _CURRENT['patient'] = patient
+    return patient
+
+
+def current_patient() -> FakePatient:
+    '''
+        The current patient, a default synthetic patient if none is set.
+    '''
+    if _CURRENT['patient'] is None:
+        from connect.synthetic import synthetic_patient
+        set_patient(synthetic_patient())
+    return _CURRENT['patient']
+
+
+def get_current(object_type: str):
+    '''
+        "Patient", "Case" or "Examination" of the current patient.
+    '''
+    _call()
+    patient = current_patient()
+    if object_type == "Patient":
+        return patient
+    if object_type == "Case":
+        return patient.case
+    if object_type == "Examination":
+        return patient.examination
+    raise ValueError(f"No current {object_type}.")
@@ -0,0 +1,26 @@
+'''
+Replay of a recorded RayStation session, see modules/session_fixture.py.
+
+    from connect.replay import replay_fixture
+    replay_fixture("./patient.cuhfx")
+
+or set the CUH_FAKE_RAYSTATION_FIXTURE environment variable to the
+fixture path before connect is imported.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from connect._model import FakePatient, set_patient
+
+
+def replay_fixture(f_path: str) -> FakePatient:
+    '''
+        Make the patient recorded in the fixture f_path the current
+        patient.
+    '''
+    # Imported here so that the fixture reader, and the repository
+    # modules it uses, are only needed for replay
+    from modules.session_fixture import read_fixture
+    return set_patient(read_fixture(f_path))
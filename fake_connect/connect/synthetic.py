@@ -0,0 +1,100 @@
+'''
+Synthetic patient dicts for the stand-in connect module, see _model.py.
+
+Each ROI is an elliptic cylinder of n_contours slices, 3mm apart, each
+contour a regular sampling of points_per_contour points of the ellipse.
+Volumes and centroids are those of the sampled polygons, so they agree
+with the contours. Every approval after the first is a day later, by
+alternating reviewers, and moves changed_fraction of the ROIs by shift.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from math import cos, pi, sin
+from random import Random
+
+SLICE_THICKNESS = 0.3
+REVIEWERS = ("Doctor^Synthetic", "Planner^Synthetic")
+
+
+def _ellipse_roi(rng: Random, name: str, n_contours: int,
+    points_per_contour: int) -> dict:
+    a = rng.uniform(0.5, 5.0)
+    b = rng.uniform(0.5, 5.0)
+    cx = rng.uniform(-10.0, 10.0)
+    cy = rng.uniform(-10.0, 10.0)
+    z0 = round(rng.uniform(-20.0, 20.0) / SLICE_THICKNESS) * SLICE_THICKNESS
+
+    step = 2 * pi / points_per_contour
+    ring = [(a * cos(k * step), b * sin(k * step))
+        for k in range(points_per_contour)]
+    contours = [
+        [
+            {'x': cx + x, 'y': cy + y, 'z': round(z0 + i * SLICE_THICKNESS, 6)}
+            for x, y in ring
+        ] for i in range(n_contours)
+    ]
+    area = points_per_contour / 2 * a * b * sin(step)
+    return {
+        'name': name,
+        'colour': [255, rng.randrange(256), rng.randrange(256),
+            rng.randrange(256)],
+        'type': "Organ",
+        'volume': area * SLICE_THICKNESS * n_contours,
+        'centroid': {
+            'x': cx, 'y': cy,
+            'z': z0 + SLICE_THICKNESS * (n_contours - 1) / 2,
+        },
+        'contours': contours,
+    }
+
+
+def _shifted(roi: dict, shift: float) -> dict:
+    return dict(
+        roi,
+        centroid = dict(roi['centroid'], x = roi['centroid']['x'] + shift),
+        contours = [
+            [dict(point, x = point['x'] + shift) for point in contour]
+            for contour in roi['contours']
+        ],
+    )
+
+
+def synthetic_patient(n_rois: int = 20, n_contours: int = 50,
+    points_per_contour: int = 100, n_sub_structure_sets: int = 2,
+    changed_fraction: float = 0.1, shift: float = 0.2,
+    patient_id: str = "SYNTH001", seed: int = 0) -> dict:
+    '''
+        Patient dict of n_sub_structure_sets approvals of n_rois ROIs.
+        Unchanged ROIs share their contour lists between approvals.
+    '''
+    rng = Random(seed)
+    rois = [
+        _ellipse_roi(rng, f"ROI_{i:03d}", n_contours, points_per_contour)
+        for i in range(n_rois)
+    ]
+
+    sub_structure_sets = []
+    for k in range(n_sub_structure_sets):
+        if k:
+            changed = set(rng.sample(
+                range(n_rois), int(round(changed_fraction * n_rois))
+            ))
+            rois = [
+                _shifted(roi, shift) if i in changed else roi
+                for i, roi in enumerate(rois)
+            ]
+        sub_structure_sets.append({
+            'reviewer': REVIEWERS[k % len(REVIEWERS)],
+            'review_time': [2024, 1, 1 + k, 9, 0, 0],
+            'rois': rois,
+        })
+
+    return {
+        'patient_id': patient_id,
+        'case': "CASE 1",
+        'exam': "CT 1",
+        'sub_structure_sets': sub_structure_sets,
+    }
@@ -0,0 +1,460 @@
+'''
+Opt-in timing of the RayStation scripting calls made by
+modules/structure_set_classes.py, and of its exports.
+
+The scripting objects are reached through get_current, wrapped by
+TIMINGS.wrap_entry, so every object beneath it is a CUHTimedProxy. Each
+attribute read, attribute write, method call, collection lookup and
+iteration step crosses the scripting bridge and is timed, e.g. as
+RoiGeometries[].GetRoiVolume, OfRoi.Color or PrimaryShape.Contours, with
+the label of the ROI it was made for, if any. The report gives the count,
+cumulative and p95 latency per method and per ROI. It is printed at exit
+and, if a path is given, also written as json.
+
+Timing is off unless switched on by the CUH_RT_TIMING environment variable
+(1 to print the report, or the path of a json report), by enable, or by
+the Time scripting calls? checkbox of the ROILockTime GUI. When off,
+get_current returns the scripting objects themselves, so nothing is
+wrapped and the only cost is one flag check per get_current call.
+Scripting objects kept across a switch, e.g. a cached session, are either
+dropped by an on_toggle callback or read through wrap, which wraps or
+unwraps them to suit.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import atexit
+from collections import defaultdict
+from functools import wraps
+from json import dump
+from math import ceil
+from os import environ
+from threading import Lock
+from time import perf_counter
+
+TIMING_ENV_VAR = "CUH_RT_TIMING"
+# ROIs listed in the printed report, slowest first
+REPORT_ROIS = 20
+# Scripting collections whose items are ROIs, for the per ROI report
+ROI_COLLECTIONS = ("RoiGeometries", "RoiStructures", "RegionsOfInterest")
+# Attributes whose values are data, e.g. written to snapshots, rather
+# than scripting objects, so are returned as they are
+DATA_ATTRIBUTES = ("Contours",)
+_SCALARS = (type(None), bool, int, float, complex, str, bytes)
+
+
+def p95(samples: list) -> float:
+    '''
+        95th percentile of samples, by nearest rank.
+    '''
+    ordered = sorted(samples)
+    return ordered[max(ceil(0.95 * len(ordered)) - 1, 0)]
+
+
+def _summary(samples: list) -> dict:
+    return {
+        'count': len(samples),
+        'total_s': sum(samples),
+        'mean_ms': 1000 * sum(samples) / len(samples),
+        'p95_ms': 1000 * p95(samples),
+        'max_ms': 1000 * max(samples),
+    }
+
+
+class _NullTimer():
+    '''
+        Does nothing, shared by every call while timing is off.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Timer():
+    def __init__(self, timings, method: str, roi: str):
+        self.timings = timings
+        self.method = method
+        self.roi = roi
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.record(self.method, self.roi, perf_counter() - self.start)
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _RoiContext():
+    '''
+        The ROI that a proxy was reached through. The label is the key it
+        was looked up by or, for an item of an iterated ROI collection, the
+        first Name read beneath it, so that calls made before that read are
+        attributed to it too.
+    '''
+    __slots__ = ("label",)
+
+    def __init__(self, label: str = None):
+        self.label = label
+
+
+def _unwrap(value):
+    '''
+        The scripting object behind a proxy, to pass back to RayStation.
+    '''
+    if isinstance(value, (CUHTimedProxy, _TimedMethod)):
+        return value._target
+    return value
+
+
+class _TimedMethod():
+    '''
+        Method of a scripting object, timed on each call. Its result is
+        returned as it is, e.g. the dict of GetCenterOfRoi.
+    '''
+    __slots__ = ("_target", "_method", "_roi", "_timings")
+
+    def __init__(self, target, method: str, roi, timings):
+        self._target = target
+        self._method = method
+        self._roi = roi
+        self._timings = timings
+
+    def __call__(self, *args, **kwargs):
+        args = [_unwrap(arg) for arg in args]
+        kwargs = {key: _unwrap(value) for key, value in kwargs.items()}
+        return self._timings.call(
+            self._method, self._roi, self._target, *args, **kwargs
+        )
+
+
+class CUHTimedProxy():
+    '''
+        Stands in for a RayStation scripting object, timing every access
+        that crosses the scripting bridge, see the module docstring.
+        Scripting objects reached through it are wrapped in turn; scalars,
+        method results and DATA_ATTRIBUTES are not.
+
+        Args:
+            • target: the scripting object
+            • name: str, prefix of the method names recorded
+            • timings: CUHCallTimings
+
+        Kwargs:
+            • roi: _RoiContext the target was reached through
+    '''
+    # One slot, so that a proxy is built with a single assignment
+    __slots__ = ("_state",)
+
+    def __init__(self, target, name: str, timings, roi = None):
+        object.__setattr__(self, "_state", (target, name, timings, roi))
+
+    @property
+    def _target(self):
+        return self._state[0]
+
+    def _item_roi(self, key = None):
+        name, roi = self._state[1], self._state[3]
+        if name in ROI_COLLECTIONS:
+            return _RoiContext(key if isinstance(key, str) else None)
+        return roi
+
+    def __getattr__(self, attr: str):
+        target, name, timings, roi = self._state
+        if timings.enabled:
+            start = perf_counter()
+            value = getattr(target, attr)
+            seconds = perf_counter() - start
+        else:
+            value = getattr(target, attr)
+            seconds = None
+
+        if not isinstance(value, _SCALARS) and callable(value) \
+            and not isinstance(value, type):
+            # Only the call is timed, see _TimedMethod
+            return _TimedMethod(value, f"{name}.{attr}", roi, timings)
+        if seconds is not None:
+            timings.record(f"{name}.{attr}", roi, seconds)
+        if attr == "Name" and roi is not None and roi.label is None \
+            and isinstance(value, str):
+            roi.label = value
+        if isinstance(value, _SCALARS) or attr in DATA_ATTRIBUTES:
+            return value
+        return CUHTimedProxy(value, attr, timings, roi)
+
+    def __setattr__(self, attr: str, value):
+        target, name, timings, roi = self._state
+        with timings.timed(f"set {name}.{attr}", roi):
+            setattr(target, attr, _unwrap(value))
+
+    def __getitem__(self, key):
+        target, name, timings, roi = self._state
+        method = f"{name}[]"
+        with timings.timed(method, roi):
+            value = target[_unwrap(key)]
+        if isinstance(value, _SCALARS):
+            return value
+        return CUHTimedProxy(value, method, timings, self._item_roi(key))
+
+    def __iter__(self):
+        target, name, timings, roi = self._state
+        method = f"{name}[]"
+        iterator = iter(target)
+        while True:
+            with timings.timed(method, roi):
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+            if isinstance(value, _SCALARS):
+                yield value
+            else:
+                yield CUHTimedProxy(value, method, timings, self._item_roi())
+
+    def __len__(self) -> int:
+        target, name, timings, roi = self._state
+        with timings.timed(f"len {name}", roi):
+            return len(target)
+
+    def __contains__(self, key) -> bool:
+        target, name, timings, roi = self._state
+        with timings.timed(f"{name} contains", roi):
+            return _unwrap(key) in target
+
+    def __bool__(self) -> bool:
+        return bool(self._state[0])
+
+    def __repr__(self) -> str:
+        return f"<timed {self._state[1]}: {self._state[0]!r}>"
+
+
+class CUHCallTimings():
+    '''
+        Latency samples of scripting calls, per method and ROI.
+
+        Attributes:
+            • enabled: bool
+
+        Methods:
+            • enable(f_report = None)
+                start timing, and report at exit (to json at f_report)
+            • disable
+            • timed(method, roi = None)
+                context manager timing one call
+            • call(method, roi, func, *args, **kwargs)
+                time and return func(*args, **kwargs)
+            • timed_function(method)
+                decorator timing every call of a function
+            • wrap_entry(func, method)
+                entry point, e.g. get_current, returning timed proxies 
+                while timing is on
+            • wrap(target, method)
+                target as a timed proxy while timing is on, else itself
+            • on_toggle(callback)
+                call callback() whenever timing is switched on or off
+            • report
+                dict of by_method and by_roi summaries
+            • print_report, dump_report
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.f_report = None
+        self._samples = defaultdict(list)
+        self._lock = Lock()
+        self._reported = 0
+        self._atexit = False
+        self._toggle_callbacks = []
+
+    def enable(self, f_report: str = None):
+        '''
+            Start timing calls. The report is printed at exit, and written
+            to f_report (json) if given.
+        '''
+        self.f_report = f_report or self.f_report
+        if not self._atexit:
+            atexit.register(self.dump_report)
+            self._atexit = True
+        self._set_enabled(True)
+
+    def disable(self):
+        self._set_enabled(False)
+
+    def _set_enabled(self, enabled: bool):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        for callback in self._toggle_callbacks:
+            callback()
+
+    def on_toggle(self, callback):
+        '''
+            Call callback() whenever timing is switched on or off, e.g. to 
+            drop scripting objects cached while it was the other way. 
+        '''
+        self._toggle_callbacks.append(callback)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._reported = 0
+
+    def record(self, method: str, roi, seconds: float):
+        '''
+            One call of method, for roi: a label, a _RoiContext or None.
+        '''
+        with self._lock:
+            self._samples[(method, roi)].append(seconds)
+
+    def timed(self, method: str, roi: str = None):
+        '''
+            with TIMINGS.timed("GetRoiVolume", label): ...
+        '''
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, method, roi)
+
+    def call(self, method: str, roi: str, func, *args, **kwargs):
+        '''
+            func(*args, **kwargs), timed as method for roi.
+        '''
+        if not self.enabled:
+            return func(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(method, roi, perf_counter() - start)
+
+    def timed_function(self, method: str):
+        '''
+            Decorator timing every call of the function as method.
+        '''
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.call(method, None, func, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def wrap_entry(self, func, method: str):
+        '''
+            func, e.g. connect.get_current, timed as method. While timing
+            is on, the scripting object it returns is wrapped in a
+            CUHTimedProxy named by the first argument, e.g. Case, so that
+            every call made through it is timed too. While off, it is
+            returned as it is.
+        '''
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            value = self.call(method, None, func, *args, **kwargs)
+            name = args[0] if args and isinstance(args[0], str) else method
+            return CUHTimedProxy(value, name, self)
+        return wrapper
+
+    def wrap(self, target, method: str):
+        '''
+            A scripting object kept across calls, e.g. a SubStructureSet,
+            in a CUHTimedProxy named method while timing is on, else the
+            scripting object itself.
+        '''
+        target = _unwrap(target)
+        if not self.enabled:
+            return target
+        return CUHTimedProxy(target, method, self)
+
+    @property
+    def n_samples(self) -> int:
+        return sum(len(x) for x in self._samples.values())
+
+    def report(self) -> dict:
+        '''
+            by_method: {method: summary}, by_roi: {roi: summary plus the
+            total_s of each method}, where summary is count, total_s,
+            mean_ms, p95_ms and max_ms. Calls not made for a ROI are only
+            in by_method.
+        '''
+        with self._lock:
+            samples = {key: list(x) for key, x in self._samples.items()}
+
+        by_method = defaultdict(list)
+        by_roi = defaultdict(list)
+        roi_methods = defaultdict(lambda: defaultdict(float))
+        for (method, roi), x in samples.items():
+            if isinstance(roi, _RoiContext):
+                roi = roi.label
+            by_method[method].extend(x)
+            if roi is not None:
+                by_roi[roi].extend(x)
+                roi_methods[roi][method] += sum(x)
+
+        report = {
+            'by_method': {
+                method: _summary(x) for method, x in by_method.items()
+            },
+            'by_roi': {},
+        }
+        for roi, x in by_roi.items():
+            report['by_roi'][roi] = _summary(x)
+            report['by_roi'][roi]['methods'] = dict(roi_methods[roi])
+        return report
+
+    def print_report(self, report: dict = None):
+        report = report or self.report()
+        print("Scripting call timings:")
+        print(
+            f"{'method':<44}{'count':>8}{'total [s]':>12}"
+            f"{'mean [ms]':>12}{'p95 [ms]':>12}{'max [ms]':>12}"
+        )
+        for method, x in sorted(
+            report['by_method'].items(), key=lambda kv: -kv[1]['total_s']):
+            print(
+                f"{method:<44}{x['count']:>8}{x['total_s']:>12.3f}"
+                f"{x['mean_ms']:>12.2f}{x['p95_ms']:>12.2f}"
+                f"{x['max_ms']:>12.2f}"
+            )
+
+        slowest = sorted(
+            report['by_roi'].items(), key=lambda kv: -kv[1]['total_s']
+        )[:REPORT_ROIS]
+        if slowest:
+            print(f"Slowest ROIs (of {len(report['by_roi'])}):")
+        for roi, x in slowest:
+            method = max(x['methods'], key=x['methods'].get)
+            print(
+                f"{roi:<44}{x['count']:>8}{x['total_s']:>12.3f}"
+                f"{x['p95_ms']:>12.2f}  mostly {method}"
+            )
+
+    def dump_report(self):
+        '''
+            Print the report, and write it to f_report if set. Does
+            nothing if no calls have been timed since the last report.
+        '''
+        n_samples = self.n_samples
+        if not n_samples or n_samples == self._reported:
+            return
+        self._reported = n_samples
+        report = self.report()
+        self.print_report(report)
+        if self.f_report:
+            with open(self.f_report, 'w', encoding='utf-8') as f:
+                dump(report, f, indent=4, sort_keys=True)
+            print(f"Timing report written to {self.f_report}.")
+
+
+TIMINGS = CUHCallTimings()
+
+if environ.get(TIMING_ENV_VAR, "0") not in ("", "0"):
+    TIMINGS.enable(
+        None if environ[TIMING_ENV_VAR] == "1" else environ[TIMING_ENV_VAR]
+    )
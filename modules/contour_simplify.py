@@ -0,0 +1,182 @@
+'''
+Douglas-Peucker simplification of ROI contours with a bounded geometric
+error, for smaller snapshots.
+
+Every contour of a ROI is simplified at once: each pass finds, for every
+current segment of every contour, the vertex furthest from it and keeps
+it if it is further than the tolerance. Contours are closed polygons, so
+each is treated as a ring starting and ending at its first vertex. No
+removed vertex is further than the tolerance from the simplified outline,
+in the plane of its slice.
+
+simplify_roi_contours checks that the volume and centroid computed from
+the simplified contours pass the ROILockTime checks, ± 0.1cc and ± 1mm,
+against those computed from the originals, so that a simplified snapshot
+is never flagged by the app. The outline always moves slightly inwards,
+so if the checks fail the tolerance is halved, up to MAX_RETRIES times,
+and the originals are kept if they still fail. A ROI contoured on one
+slice has no volume, so its area is checked instead, as if 1cm thick.
+
+Requires NumPy.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import numpy as np
+
+from modules.roi_geometry import (
+    contours_to_arrays, roi_volume_and_centroid, slice_thickness_from_points
+)
+from modules.roi_matching import centroids_match, volumes_match
+
+# Contours with fewer vertices are never simplified
+MIN_POINTS = 3
+# Times the tolerance is halved before the original contours are kept
+MAX_RETRIES = 3
+
+
+def _segment_distances(xy: np.ndarray, start: np.ndarray,
+    end: np.ndarray) -> np.ndarray:
+    '''
+        Distance of every point of xy to the segment from xy[start] to
+        xy[end], or to xy[start] if the segment has no length.
+    '''
+    a = xy[start]
+    ab = xy[end] - a
+    ap = xy - a
+    length2 = (ab ** 2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length2 > 0, (ap * ab).sum(axis=1) / length2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.sqrt(((ap - t[:, None] * ab) ** 2).sum(axis=1))
+
+
+def douglas_peucker_mask(points: np.ndarray, offsets: np.ndarray,
+    tolerance: float) -> np.ndarray:
+    '''
+        Vertices to keep, as a bool mask of points, so that no removed
+        vertex is further than tolerance [cm] from the simplified contour.
+
+        Params:
+            points, offsets: as per roi_geometry.contours_to_arrays
+            tolerance: [cm]
+    '''
+    n_points = len(points)
+    lengths = np.diff(offsets)
+    if not n_points:
+        return np.zeros(0, dtype=bool)
+
+    # Close each ring by repeating its first vertex at the end
+    ring_lengths = lengths + 1
+    ring_offsets = np.zeros(len(ring_lengths) + 1, dtype=np.int64)
+    ring_offsets[1:] = np.cumsum(ring_lengths)
+    ring = np.arange(ring_offsets[-1]) \
+        - np.repeat(ring_offsets[:-1] - offsets[:-1], ring_lengths)
+    ring[ring_offsets[1:] - 1] = offsets[:-1]
+    ring = np.minimum(ring, n_points - 1)
+    xy = points[ring, :2]
+
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[ring_offsets[:-1]] = True
+    keep[ring_offsets[1:] - 1] = True
+
+    while True:
+        kept = np.flatnonzero(keep)
+        segment = np.searchsorted(kept, np.arange(len(ring)), side='right') - 1
+        start = kept[segment]
+        end = kept[np.minimum(segment + 1, len(kept) - 1)]
+        distances = _segment_distances(xy, start, end)
+        distances[keep] = 0.0
+
+        furthest = np.maximum.reduceat(distances, kept)
+        split = (distances > tolerance) & (distances == furthest[segment])
+        if not split.any():
+            break
+        candidates = np.flatnonzero(split)
+        _, first = np.unique(segment[candidates], return_index=True)
+        keep[candidates[first]] = True
+
+    mask = np.zeros(n_points, dtype=bool)
+    mask[ring[keep]] = True
+
+    # Never reduce a contour below MIN_POINTS vertices
+    contour_index = np.repeat(np.arange(len(lengths)), lengths)
+    kept_per_contour = np.bincount(
+        contour_index[mask], minlength=len(lengths)
+    )
+    too_few = np.flatnonzero(kept_per_contour < MIN_POINTS)
+    mask[np.isin(contour_index, too_few)] = True
+    return mask
+
+
+def simplify_contours(contours: list, tolerance_mm: float) -> list:
+    '''
+        Simplified copy of a RayStation contour list, tolerance in mm.
+    '''
+    points, offsets = contours_to_arrays(contours)
+    mask = douglas_peucker_mask(points, offsets, tolerance_mm / 10)
+
+    simplified = []
+    for contour, start, stop in zip(contours, offsets[:-1], offsets[1:]):
+        contour_mask = mask[start:stop]
+        simplified.append([
+            point for point, kept in zip(contour, contour_mask) if kept
+        ])
+    return simplified
+
+
+def simplify_roi_contours(contours: list, tolerance_mm: float) -> tuple:
+    '''
+        Simplify contours, if the volume of the result is within ± 0.1cc
+        of that of the original contours, or the area if they lie on one
+        slice, and the centroid within ± 1mm. If not, the tolerance is
+        halved and the contours simplified again, up to MAX_RETRIES times.
+
+        Returns:
+            contours: the simplified contours, or the originals
+            stats: dict of points_before, points_after, volume_change [cc],
+                or None if on one slice, centroid_shift [cm], tolerance_mm,
+                the tolerance used, simplified (bool) and reason, why the
+                originals were kept, or None
+    '''
+    points, _ = contours_to_arrays(contours)
+    slice_thickness = slice_thickness_from_points(points) if len(points) \
+        else None
+    # On one slice, unit thickness gives the area [cm^2] in place of volume
+    size, centroid = roi_volume_and_centroid(contours, slice_thickness or 1.0)
+
+    for retry in range(MAX_RETRIES + 1):
+        tolerance = tolerance_mm / 2 ** retry
+        simplified = simplify_contours(contours, tolerance)
+        new_size, new_centroid = roi_volume_and_centroid(
+            simplified, slice_thickness or 1.0
+        )
+        change = new_size - size
+        centroid_shift = max(
+            abs(centroid[k] - new_centroid[k]) for k in ('x', 'y', 'z')
+        )
+        if not volumes_match(size, new_size):
+            reason = (
+                f"{'volume' if slice_thickness else 'area'} changed by "
+                f"{change:.2f}{'cc' if slice_thickness else 'cm2'}"
+            )
+        elif not centroids_match(centroid, new_centroid):
+            reason = f"centroid moved by {centroid_shift:.2f}cm"
+        else:
+            reason = None
+            break
+    accepted = reason is None
+
+    stats = {
+        'points_before': len(points),
+        'points_after': sum(len(contour) for contour in simplified)
+            if accepted else len(points),
+        'volume_change': change if slice_thickness else None,
+        'centroid_shift': centroid_shift,
+        'tolerance_mm': tolerance if accepted else None,
+        'simplified': accepted,
+        'reason': reason,
+    }
+    return (simplified if accepted else contours), stats
@@ -0,0 +1,129 @@
+'''
+Memory probes used to report the cost of exports.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from os import sysconf
+from sys import platform
+from threading import Event, Lock, Thread
+
+# Interval between samples of the resident set size [s]
+SAMPLE_INTERVAL = 0.01
+
+
+def current_rss_bytes() -> int:
+    '''
+        Current resident set size (working set on Windows) of the process,
+        in bytes. Returns None if it cannot be determined on this platform.
+    '''
+    if platform.startswith("win"):
+        return _windows_working_set()
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _windows_working_set() -> int:
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS)
+        ok = ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters), counters.cb
+        )
+        return counters.WorkingSetSize if ok else None
+    except Exception:
+        return None
+
+
+class CUHPeakMemory():
+    '''
+        Peak growth of the resident set size within a with block. The RSS
+        is sampled every SAMPLE_INTERVAL on a daemon thread, so the block
+        runs at full speed. Unlike the process peak RSS (ru_maxrss), which
+        never falls, this is the peak of the block alone, so each export
+        reports its own cost. Peaks shorter than the interval may be missed.
+
+        Attributes:
+            • peak_bytes: int, or None if the RSS cannot be read
+                peak RSS above that on entry [bytes], read within the
+                block or after it
+    '''
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self._base = None
+        self._peak = None
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss_bytes()
+        if rss is not None:
+            with self._lock:
+                self._peak = max(self._peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._base = current_rss_bytes()
+        if self._base is not None:
+            self._peak = self._base
+            self._stop.clear()
+            self._thread = Thread(target = self._run, daemon = True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._sample()
+        return False
+
+    @property
+    def peak_bytes(self) -> int:
+        if self._base is None:
+            return None
+        if self._thread is not None:
+            self._sample()
+        return self._peak - self._base
+
+
+def format_bytes(n_bytes: int) -> str:
+    '''
+        Human readable byte count, e.g. 1.5 MB.
+    '''
+    if n_bytes is None:
+        return "unknown"
+    for unit in ("B", "kB", "MB", "GB"):
+        if abs(n_bytes) < 1024 or unit == "GB":
+            break
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} {unit}"
@@ -0,0 +1,84 @@
+'''
+Geometry fingerprints of ROI contours.
+
+A fingerprint is a hash of the contour points, quantized to QUANTUM, plus
+cheap moments: the number of contours and points and the bounding box.
+Two ROIs with equal fingerprints have the same contours to within QUANTUM,
+so they can be reported as an exact match without restoring them or
+running ComparisonOfRoiGeometries.
+
+The hash depends on the order of the contours and their points, as
+RayStation returns them. Identical geometry stored in a different order
+is treated as changed, i.e. it is compared in full.
+
+Only the standard library is used, as per modules/snapshot_io.py.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from hashlib import sha256
+from struct import pack
+
+# Points are quantized to 0.01mm [cm]
+QUANTUM = 0.001
+
+EXACT_MATCH_RESULTS = {
+    'DiceSimilarityCoefficient': 1.0,
+    'Precision': 1.0,
+    'Sensitivity': 1.0,
+    'Specificity': 1.0,
+    'MeanDistanceToAgreement': 0.0,
+    'MaxDistanceToAgreement': 0.0,
+}
+
+
+def contour_fingerprint(contours: list, quantum: float = QUANTUM) -> dict:
+    '''
+        Fingerprint of a RayStation contour list (list of lists of
+        {'x','y','z'} points).
+
+        Returns:
+            dict of digest, n_contours, n_points and bbox, the quantized
+            [x_min, y_min, z_min, x_max, y_max, z_max] [cm]
+    '''
+    digest = sha256()
+    n_points = 0
+    lo = None
+    hi = None
+    for contour in contours:
+        q = [
+            int(round(point[k] / quantum))
+            for point in contour for k in ('x', 'y', 'z')
+        ]
+        digest.update(pack(f"<I{len(q)}q", len(contour), *q))
+        n_points += len(contour)
+        if not q:
+            continue
+        c_lo = [min(q[k::3]) for k in range(3)]
+        c_hi = [max(q[k::3]) for k in range(3)]
+        lo = c_lo if lo is None else [min(a, b) for a, b in zip(lo, c_lo)]
+        hi = c_hi if hi is None else [max(a, b) for a, b in zip(hi, c_hi)]
+
+    return {
+        'digest': digest.hexdigest(),
+        'n_contours': len(contours),
+        'n_points': n_points,
+        'bbox': [
+            round(v * quantum, 6) for v in lo + hi
+        ] if lo is not None else None,
+    }
+
+
+def fingerprints_match(fingerprint1: dict, fingerprint2: dict) -> bool:
+    '''
+        True if both fingerprints exist and are equal.
+    '''
+    if not fingerprint1 or not fingerprint2:
+        return False
+    return (
+        fingerprint1['n_contours'] == fingerprint2['n_contours']
+        and fingerprint1['n_points'] == fingerprint2['n_points']
+        and fingerprint1['digest'] == fingerprint2['digest']
+    )
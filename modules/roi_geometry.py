@@ -0,0 +1,177 @@
+'''
+Vectorised ROI volume and centroid from stored contour points.
+
+Lets saved snapshots be checked offline, without a GetRoiVolume or
+GetCenterOfRoi round trip per ROI. Contours are RayStation PrimaryShape
+contours, i.e. lists of closed axial polygons of {'x','y','z'} points in
+cm. Volumes are returned in cc and centroids in cm, as per RayStation.
+
+Contours that lie inside another contour on the same slice are treated as
+holes (even-odd rule), as per DICOM RT structure sets.
+
+Requires NumPy.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import numpy as np
+
+
+def contours_to_arrays(contours: list) -> tuple:
+    '''
+        Flatten a contour list into a (n_points, 3) float array and an
+        int array of n_contours + 1 offsets into it.
+    '''
+    offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(contour) for contour in contours])
+    points = np.array(
+        [(p['x'], p['y'], p['z']) for contour in contours for p in contour],
+        dtype=np.float64
+    ).reshape(-1, 3)
+    return points, offsets
+
+
+def next_point_index(offsets: np.ndarray) -> np.ndarray:
+    '''
+        Index of the next vertex of every point, wrapping at the end of
+        each contour.
+    '''
+    n_points = offsets[-1]
+    nxt = np.arange(1, n_points + 1)
+    ends = offsets[1:][offsets[1:] > offsets[:-1]] - 1
+    starts = offsets[:-1][offsets[1:] > offsets[:-1]]
+    nxt[ends] = starts
+    return nxt
+
+
+def polygon_areas_and_centroids(points: np.ndarray, offsets: np.ndarray):
+    '''
+        Shoelace area and in-plane centroid of every contour at once.
+
+        Returns:
+            areas: unsigned area of each contour [cm^2]
+            centroids: (n_contours, 3) centroid of each contour [cm]
+    '''
+    n_contours = len(offsets) - 1
+    areas = np.zeros(n_contours)
+    centroids = np.zeros((n_contours, 3))
+    if not len(points):
+        return areas, centroids
+
+    nxt = next_point_index(offsets)
+    x, y = points[:, 0], points[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+
+    contour_index = np.repeat(np.arange(n_contours), np.diff(offsets))
+    signed = np.bincount(contour_index, cross, n_contours) / 2
+    cx = np.bincount(contour_index, (x + x[nxt]) * cross, n_contours)
+    cy = np.bincount(contour_index, (y + y[nxt]) * cross, n_contours)
+    z = np.bincount(contour_index, points[:, 2], n_contours)
+    n = np.diff(offsets)
+
+    valid = signed != 0
+    centroids[valid, 0] = cx[valid] / (6 * signed[valid])
+    centroids[valid, 1] = cy[valid] / (6 * signed[valid])
+    centroids[n > 0, 2] = z[n > 0] / n[n > 0]
+    return np.abs(signed), centroids
+
+
+def _points_in_polygon(px, py, polygon: np.ndarray) -> np.ndarray:
+    '''
+        Even-odd ray cast of the points (px, py) against one polygon.
+    '''
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    px = np.asarray(px)[:, None]
+    py = np.asarray(py)[:, None]
+    crosses = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    return np.count_nonzero(crosses & (px < x_at), axis=1) % 2 == 1
+
+
+def contour_signs(points: np.ndarray, offsets: np.ndarray,
+    decimals: int = 3) -> np.ndarray:
+    '''
+        +1 for outer contours, -1 for holes. A contour is a hole if its
+        first vertex lies inside an odd number of other contours on the
+        same slice.
+    '''
+    n_contours = len(offsets) - 1
+    signs = np.ones(n_contours)
+    if n_contours < 2:
+        return signs
+
+    first = points[np.minimum(offsets[:-1], max(len(points) - 1, 0))]
+    slice_z = np.round(first[:, 2], decimals)
+    for z in np.unique(slice_z):
+        on_slice = np.flatnonzero(slice_z == z)
+        if len(on_slice) < 2:
+            continue
+        depth = np.zeros(len(on_slice), dtype=np.int64)
+        for c in on_slice:
+            polygon = points[offsets[c]:offsets[c+1]]
+            if len(polygon) < 3:
+                continue
+            inside = _points_in_polygon(
+                first[on_slice, 0], first[on_slice, 1], polygon
+            )
+            inside[on_slice == c] = False
+            depth += inside
+        signs[on_slice[depth % 2 == 1]] = -1
+    return signs
+
+
+def slice_thickness_from_points(points: np.ndarray, decimals: int = 3):
+    '''
+        Median spacing of the distinct contour z positions [cm], or None
+        if all contours lie on one slice.
+    '''
+    z = np.unique(np.round(points[:, 2], decimals))
+    if len(z) < 2:
+        return None
+    return float(np.median(np.diff(z)))
+
+
+def roi_volume_and_centroid(contours: list,
+    slice_thickness: float = None) -> tuple:
+    '''
+        Volume [cc] and centroid [cm] of a ROI from its contours.
+
+        Params:
+            contours: RayStation contour list, or a (points, offsets) tuple
+                from contours_to_arrays
+            slice_thickness: [cm], inferred from the contour z spacing if
+                not given
+
+        Returns:
+            volume: float
+            centroid: {'x', 'y', 'z'} dict, as per GetCenterOfRoi
+    '''
+    if isinstance(contours, tuple):
+        points, offsets = contours
+    else:
+        points, offsets = contours_to_arrays(contours)
+
+    if not len(points):
+        return 0.0, {'x': 0.0, 'y': 0.0, 'z': 0.0}
+
+    if slice_thickness is None:
+        slice_thickness = slice_thickness_from_points(points) or 0.0
+
+    areas, centroids = polygon_areas_and_centroids(points, offsets)
+    weights = areas * contour_signs(points, offsets)
+    total = weights.sum()
+
+    if total == 0:
+        centroid = centroids.mean(axis=0)
+    else:
+        centroid = (centroids * weights[:, None]).sum(axis=0) / total
+
+    return float(total * slice_thickness), {
+        'x': float(centroid[0]),
+        'y': float(centroid[1]),
+        'z': float(centroid[2]),
+    }
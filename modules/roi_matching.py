@@ -0,0 +1,222 @@
+'''
+Automatic matching of current ROIs to the ROIs of a reference structure
+set, as used by the ROILockTime rows.
+
+A ROI matches the first reference ROI of the same label, else the
+reference ROI nearest in volume within VOLUME_TOLERANCE, nearest centroid
+first on ties. Whole structure sets are matched in one vectorised step by
+CUHRTToleranceMatrix, see modules/roi_tolerance.py, from the same arrays
+as the row status. CUHRTROIMatcher.find matches a single ROI without
+NumPy: labels are looked up in a dict and volumes by bisection of a
+sorted list.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from bisect import bisect_left, bisect_right
+from math import sqrt
+
+# Half of the last decimal place of the original 2dp volume match [cc]
+VOLUME_TOLERANCE = 0.005
+# Volumes match if equal when rounded to this many decimal places [cc]
+VOLUME_DECIMALS = 1
+# ± tolerance on each centroid coordinate [cm]
+CENTROID_TOLERANCE = 0.1
+
+LABEL_SCORE = 4
+VOLUME_SCORE = 2
+CENTROID_SCORE = 1
+
+
+def volumes_match(volume1: float, volume2: float) -> bool:
+    '''
+        ROILockTime volume check, ± 0.1cc.
+    '''
+    return round(volume1, VOLUME_DECIMALS) == round(volume2, VOLUME_DECIMALS)
+
+
+def centroids_match(centroid1: dict, centroid2: dict) -> bool:
+    '''
+        ROILockTime centroid check, ± 1mm in each of x, y and z.
+    '''
+    return all(
+        abs(centroid1[k] - centroid2[k]) <= CENTROID_TOLERANCE
+        for k in ('x', 'y', 'z')
+    )
+
+
+class CUHRTROIMatcher():
+    '''
+        Index of a list of reference CUHRTROI objects for auto-matching.
+
+        Args:
+            • reference_rois: list of CUHRTROI objects
+
+        Kwargs:
+            • volume_tolerance: float [cc]
+
+        Methods:
+            • find(roi)
+                index of the best reference roi for one CUHRTROI, or None
+            • match(roi)
+                as find, but 0 if nothing matches
+            • match_all(rois, one_to_one = False, default = 0)
+                indices for a list of CUHRTROI objects, see 
+                CUHRTToleranceMatrix.matching_indices
+    '''
+
+    def __init__(self, reference_rois: list,
+        volume_tolerance: float = VOLUME_TOLERANCE):
+        self.reference_rois = reference_rois or []
+        self.volume_tolerance = volume_tolerance
+
+        self._label_index = {}
+        for i, roi in enumerate(self.reference_rois):
+            # Keep the first occurrence, as per list.index
+            self._label_index.setdefault(roi.roi['label'], i)
+
+        by_volume = sorted(
+            (roi.roi['volume'], i) for i, roi in enumerate(self.reference_rois)
+        )
+        self._volumes = [volume for volume, _ in by_volume]
+        self._volume_index = [i for _, i in by_volume]
+
+    def match_by_label(self, label: str):
+        return self._label_index.get(label)
+
+    def match_by_volume(self, volume: float, centroid: dict = None):
+        '''
+            Index of the reference roi nearest in volume, or None if none
+            is within volume_tolerance. Ties go to the nearest centroid, 
+            if given, then the first reference roi. 
+        '''
+        if not self._volumes:
+            return None
+        pos = bisect_left(self._volumes, volume)
+        candidates = [
+            p for p in (pos - 1, pos) if 0 <= p < len(self._volumes)
+        ]
+        difference = min(abs(self._volumes[p] - volume) for p in candidates)
+        if difference > self.volume_tolerance:
+            return None
+
+        # Every reference roi at that difference, either side of volume
+        lo = max(bisect_left(self._volumes, volume - difference) - 1, 0)
+        hi = bisect_right(self._volumes, volume + difference) + 1
+        tied = [
+            self._volume_index[p]
+            for p in range(lo, min(hi, len(self._volumes)))
+            if abs(self._volumes[p] - volume) == difference
+        ]
+        if centroid is None:
+            return min(tied)
+        return min(tied, key = lambda i: (
+            _distance(centroid, self.reference_rois[i].roi['centroid']), i
+        ))
+
+    def find(self, roi):
+        '''
+            Label match, else nearest volume match, else None.
+        '''
+        index = self.match_by_label(roi.roi['label'])
+        if index is None:
+            index = self.match_by_volume(
+                roi.roi['volume'], roi.roi['centroid']
+            )
+        return index
+
+    def match(self, roi) -> int:
+        '''
+            Label match, else nearest volume match, else 0.
+        '''
+        index = self.find(roi)
+        return 0 if index is None else index
+
+    def match_all(self, rois: list, one_to_one: bool = False,
+        default = 0) -> list:
+        '''
+            Indices of the best reference roi for every CUHRTROI in rois,
+            or default for those that match nothing, read from their 
+            CUHRTToleranceMatrix. Requires NumPy. 
+        '''
+        from modules.roi_tolerance import CUHRTToleranceMatrix
+
+        return CUHRTToleranceMatrix(
+            rois, self.reference_rois, self.volume_tolerance
+        ).matching_indices(one_to_one = one_to_one, default = default)
+
+
+def _distance(centroid1: dict, centroid2: dict) -> float:
+    return sqrt(sum(
+        (centroid1[k] - centroid2[k]) ** 2 for k in ('x', 'y', 'z')
+    ))
+
+
+def maximum_assignment(scores: list) -> list:
+    '''
+        Hungarian algorithm. Returns, for each row of the scores matrix,
+        the assigned column (or None) maximising the total score.
+    '''
+    n_rows = len(scores)
+    n_cols = len(scores[0]) if n_rows else 0
+    if not n_rows or not n_cols:
+        return [None] * n_rows
+
+    transpose = n_rows > n_cols
+    if transpose:
+        scores = [list(col) for col in zip(*scores)]
+        n_rows, n_cols = n_cols, n_rows
+
+    # Minimise cost = -score, rows <= cols, 1-based potentials
+    inf = float('inf')
+    u = [0] * (n_rows + 1)
+    v = [0] * (n_cols + 1)
+    owner = [0] * (n_cols + 1)
+    way = [0] * (n_cols + 1)
+    for row in range(1, n_rows + 1):
+        owner[0] = row
+        col0 = 0
+        min_v = [inf] * (n_cols + 1)
+        used = [False] * (n_cols + 1)
+        while True:
+            used[col0] = True
+            row0 = owner[col0]
+            delta = inf
+            col1 = 0
+            for col in range(1, n_cols + 1):
+                if not used[col]:
+                    cur = -scores[row0 - 1][col - 1] - u[row0] - v[col]
+                    if cur < min_v[col]:
+                        min_v[col] = cur
+                        way[col] = col0
+                    if min_v[col] < delta:
+                        delta = min_v[col]
+                        col1 = col
+            for col in range(n_cols + 1):
+                if used[col]:
+                    u[owner[col]] += delta
+                    v[col] -= delta
+                else:
+                    min_v[col] -= delta
+            col0 = col1
+            if owner[col0] == 0:
+                break
+        while col0:
+            col1 = way[col0]
+            owner[col0] = owner[col1]
+            col0 = col1
+
+    assignment = [None] * n_rows
+    for col in range(1, n_cols + 1):
+        if owner[col]:
+            assignment[owner[col] - 1] = col - 1
+
+    if not transpose:
+        return assignment
+    result = [None] * n_cols
+    for row, col in enumerate(assignment):
+        if col is not None:
+            result[col] = row
+    return result
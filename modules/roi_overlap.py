@@ -0,0 +1,163 @@
+'''
+Offline voxel overlap metrics for two ROIs from their stored contours.
+
+Both ROIs are rasterised onto a shared voxel grid, one slice per distinct
+contour z position, by even-odd scanline filling of every slice at once.
+The metrics are returned with the same keys as RayStation's
+ComparisonOfRoiGeometries, with ROI A as the reference:
+    • DiceSimilarityCoefficient: 2|A∩B| / (|A| + |B|)
+    • Precision: |A∩B| / |B|
+    • Sensitivity: |A∩B| / |A|
+    • Specificity: |¬A∩¬B| / |¬A|, over the shared grid
+
+The shared grid is the bounding box of both ROIs plus a margin, so
+Specificity depends on the margin and will not match RayStation exactly.
+
+Requires NumPy.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import numpy as np
+
+from modules.roi_geometry import contours_to_arrays, next_point_index
+from modules.surface_distance import surface_distance_metrics
+
+DEFAULT_VOXEL_SIZE = 0.1 # cm
+DEFAULT_MARGIN = 0.5 # cm
+
+
+class VoxelGrid():
+    '''
+        Shared voxel grid for rasterising contours.
+
+        Attributes:
+            • x, y: voxel centre coordinates [cm]
+            • z: slice positions [cm]
+            • voxel_size: in-plane voxel size [cm]
+    '''
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, z: np.ndarray,
+        voxel_size: float):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.voxel_size = voxel_size
+
+    @classmethod
+    def enclosing(cls, *point_arrays, voxel_size: float = DEFAULT_VOXEL_SIZE,
+        margin: float = DEFAULT_MARGIN, decimals: int = 3):
+        '''
+            Grid covering all of the given (n_points, 3) point arrays.
+        '''
+        points = np.concatenate([p for p in point_arrays if len(p)])
+        lo = points[:, :2].min(axis=0) - margin
+        hi = points[:, :2].max(axis=0) + margin
+        x = np.arange(lo[0], hi[0] + voxel_size, voxel_size)
+        y = np.arange(lo[1], hi[1] + voxel_size, voxel_size)
+        z = np.unique(np.round(points[:, 2], decimals))
+        return cls(x, y, z, voxel_size)
+
+    @property
+    def shape(self) -> tuple:
+        return len(self.z), len(self.y), len(self.x)
+
+    def rasterise(self, points: np.ndarray, offsets: np.ndarray,
+        decimals: int = 3) -> np.ndarray:
+        '''
+            Boolean (z, y, x) mask of the contours, filled with the even-odd
+            rule so that nested contours become holes.
+        '''
+        mask = np.zeros(self.shape, dtype=bool)
+        if not len(points):
+            return mask
+
+        nxt = next_point_index(offsets)
+        x1, y1 = points[:, 0], points[:, 1]
+        x2, y2 = x1[nxt], y1[nxt]
+        slice_index = np.searchsorted(self.z, np.round(points[:, 2], decimals))
+
+        # Scanlines crossed by each edge: rows with y1 <= y < y2, or reverse
+        lo, hi = np.minimum(y1, y2), np.maximum(y1, y2)
+        row_start = np.searchsorted(self.y, lo, side='left')
+        row_stop = np.searchsorted(self.y, hi, side='left')
+        n_rows = row_stop - row_start
+        edge = np.repeat(np.arange(len(points)), n_rows)
+        if not len(edge):
+            return mask
+        row = np.arange(len(edge)) - np.repeat(np.cumsum(n_rows) - n_rows,
+            n_rows) + row_start[edge]
+
+        y_row = self.y[row]
+        x_at = x1[edge] + (y_row - y1[edge]) * (x2[edge] - x1[edge]) / (
+            y2[edge] - y1[edge])
+
+        # Each crossing toggles inside/outside for every voxel to its right
+        col = np.searchsorted(self.x, x_at, side='left')
+        # Only the parity matters, so uint8 wrap-around is harmless
+        toggles = np.zeros(
+            (len(self.z), len(self.y), len(self.x) + 1), dtype=np.uint8
+        )
+        np.add.at(toggles, (slice_index[edge], row, col), 1)
+        mask[:] = np.cumsum(toggles, axis=2, dtype=np.uint8)[:, :, :-1] & 1
+        return mask
+
+
+def overlap_metrics(mask_a: np.ndarray, mask_b: np.ndarray) -> dict:
+    '''
+        Dice, Precision, Sensitivity and Specificity of two boolean masks
+        on the same grid, with mask_a as the reference.
+    '''
+    a = np.count_nonzero(mask_a)
+    b = np.count_nonzero(mask_b)
+    both = np.count_nonzero(mask_a & mask_b)
+    neither = mask_a.size - np.count_nonzero(mask_a | mask_b)
+    not_a = mask_a.size - a
+
+    def ratio(num, den):
+        return float(num / den) if den else None
+
+    return {
+        'DiceSimilarityCoefficient': ratio(2 * both, a + b),
+        'Precision': ratio(both, b),
+        'Sensitivity': ratio(both, a),
+        'Specificity': ratio(neither, not_a),
+    }
+
+
+def compare_contours(contours_a, contours_b,
+    voxel_size: float = DEFAULT_VOXEL_SIZE,
+    margin: float = DEFAULT_MARGIN,
+    distance_to_agreement: bool = True) -> dict:
+    '''
+        Offline equivalent of ComparisonOfRoiGeometries for two contour
+        lists, or (points, offsets) tuples from contours_to_arrays.
+
+        The distance to agreement measures come from
+        modules/surface_distance.py, or are None if distance_to_agreement
+        is False.
+    '''
+    a = contours_a if isinstance(contours_a, tuple) else contours_to_arrays(
+        contours_a)
+    b = contours_b if isinstance(contours_b, tuple) else contours_to_arrays(
+        contours_b)
+
+    results = {
+        'DiceSimilarityCoefficient': None,
+        'Precision': None,
+        'Sensitivity': None,
+        'Specificity': None,
+        'MeanDistanceToAgreement': None,
+        'MaxDistanceToAgreement': None,
+    }
+    if not len(a[0]) or not len(b[0]):
+        return results
+
+    grid = VoxelGrid.enclosing(a[0], b[0], voxel_size=voxel_size,
+        margin=margin)
+    results.update(overlap_metrics(grid.rasterise(*a), grid.rasterise(*b)))
+    if distance_to_agreement:
+        results.update(surface_distance_metrics(a[0], b[0]))
+    return results
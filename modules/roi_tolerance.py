@@ -0,0 +1,178 @@
+'''
+Vectorised ROILockTime volume and centroid checks, and auto-matching, for
+every pair of current and reference ROIs at once.
+
+The checks are those of volumes_match and centroids_match in
+modules/roi_matching.py: volumes equal when rounded to 0.1cc and every
+centroid coordinate within ± 1mm. Volumes are rounded with Python's round
+so that the matrix agrees with the scalar checks exactly.
+
+Auto-matching is read from the same arrays, and is the definition of a
+match used by CUHRTROIMatcher.match_all: the first reference ROI of the
+same label, else the reference ROI nearest in volume within
+VOLUME_TOLERANCE, nearest centroid first on ties. CUHRTROIMatcher.find
+gives the same answer for a single ROI without NumPy.
+
+Requires NumPy.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import numpy as np
+
+from modules.roi_matching import (
+    VOLUME_TOLERANCE, VOLUME_DECIMALS, CENTROID_TOLERANCE,
+    LABEL_SCORE, VOLUME_SCORE, CENTROID_SCORE, maximum_assignment
+)
+
+STATUS = {
+    (True, True): ('VOLUME & CENTROID MATCH', 'good'),
+    (True, False): ('VOLUME MATCH, CENTROID FAIL', 'WARN'),
+    (False, True): ('VOLUME FAIL, CENTROID MATCH', 'WARN'),
+    (False, False): ('FAILURE', 'bad'),
+}
+
+
+def _centroids(rois: list) -> np.ndarray:
+    return np.array([
+        (roi.roi['centroid']['x'], roi.roi['centroid']['y'],
+        roi.roi['centroid']['z']) for roi in rois
+    ], dtype=np.float64).reshape(-1, 3)
+
+
+def _volumes(rois: list) -> np.ndarray:
+    return np.array([roi.roi['volume'] for roi in rois], dtype=np.float64)
+
+
+def _rounded_volumes(rois: list) -> np.ndarray:
+    return np.array(
+        [round(roi.roi['volume'], VOLUME_DECIMALS) for roi in rois],
+        dtype=np.float64
+    )
+
+
+def _labels(rois: list) -> np.ndarray:
+    return np.array([roi.roi['label'] for roi in rois], dtype=object)
+
+
+class CUHRTToleranceMatrix():
+    '''
+        Current × reference match matrix of CUHRTROI labels, volumes and
+        centroids.
+
+        Args:
+            • current_rois: list of CUHRTROI objects (rows)
+            • reference_rois: list of CUHRTROI objects (columns)
+
+        Kwargs:
+            • volume_tolerance: float [cc], of the auto-match
+
+        Attributes:
+            • volume_match: (n, m) bool, the ROILockTime ± 0.1cc check
+            • centroid_match: (n, m) bool, the ROILockTime ± 1mm check
+            • distance: (n, m) float, centroid separation [cm]
+            • volume_difference: (n, m) float [cc]
+            • label_match: (n, m) bool
+
+        Methods:
+            • status(i, j)
+                row status text and disp for CUHLabelText
+            • scores()
+                label, volume and centroid agreement of every pair
+            • matching_indices(one_to_one = False, default = 0)
+                auto-matched reference index for every current roi
+    '''
+
+    def __init__(self, current_rois: list, reference_rois: list,
+        volume_tolerance: float = VOLUME_TOLERANCE):
+        self.current_rois = current_rois
+        self.reference_rois = reference_rois or []
+        self.volume_tolerance = volume_tolerance
+
+        self.volume_match = (
+            _rounded_volumes(self.current_rois)[:, None]
+            == _rounded_volumes(self.reference_rois)[None, :]
+        )
+        self.volume_difference = np.abs(
+            _volumes(self.current_rois)[:, None]
+            - _volumes(self.reference_rois)[None, :]
+        )
+
+        delta = _centroids(self.current_rois)[:, None, :] \
+            - _centroids(self.reference_rois)[None, :, :]
+        self.centroid_match = np.all(
+            np.abs(delta) <= CENTROID_TOLERANCE, axis=2
+        )
+        self.distance = np.sqrt((delta ** 2).sum(axis=2))
+
+        self.label_match = (
+            _labels(self.current_rois)[:, None]
+            == _labels(self.reference_rois)[None, :]
+        ).astype(bool)
+
+    @property
+    def shape(self) -> tuple:
+        return self.volume_match.shape
+
+    def status(self, i: int, j: int) -> tuple:
+        '''
+            ('VOLUME & CENTROID MATCH', 'good') etc. for current roi i and
+            reference roi j.
+        '''
+        return STATUS[
+            (bool(self.volume_match[i, j]), bool(self.centroid_match[i, j]))
+        ]
+
+    def scores(self) -> np.ndarray:
+        '''
+            Label, volume and centroid agreement of every pair.
+        '''
+        return LABEL_SCORE * self.label_match \
+            + VOLUME_SCORE * (self.volume_difference <= self.volume_tolerance) \
+            + CENTROID_SCORE * self.centroid_match
+
+    def _nearest(self) -> np.ndarray:
+        '''
+            Label match, else nearest volume within volume_tolerance and
+            nearest centroid on ties, else -1, for every current roi.
+        '''
+        close = self.volume_difference <= self.volume_tolerance
+        difference = np.where(close, self.volume_difference, np.inf)
+        nearest = close & (difference == difference.min(axis=1)[:, None])
+        by_volume = np.where(nearest, self.distance, np.inf).argmin(axis=1)
+
+        best = np.where(close.any(axis=1), by_volume, -1)
+        has_label = self.label_match.any(axis=1)
+        # argmax gives the first label match, as per list.index
+        best[has_label] = self.label_match.argmax(axis=1)[has_label]
+        return best
+
+    def matching_indices(self, one_to_one: bool = False,
+        default = 0) -> list:
+        '''
+            Reference index for every current roi, or default if none
+            matches.
+
+            If one_to_one, each reference roi is used at most once and the
+            total label, volume and centroid agreement is maximised,
+            nearest centroids first on ties. Rois left without an agreeing
+            partner fall back to the nearest match.
+        '''
+        n, m = self.shape
+        if not n or not m:
+            return [default] * n
+
+        nearest = [default if j < 0 else j for j in self._nearest().tolist()]
+        if not one_to_one:
+            return nearest
+
+        scores = self.scores()
+        # Scaled so that the distances of all pairs sum to under one step
+        ranked = scores - self.distance / ((self.distance.max() + 1) * n)
+        assignment = maximum_assignment(ranked.tolist())
+        return [
+            j if j is not None and scores[i, j] else nearest[i]
+            for i, j in enumerate(assignment)
+        ]
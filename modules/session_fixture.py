@@ -0,0 +1,247 @@
+'''
+Recording of the RayStation scripting responses read by CUHRTStructureSet
+and CUHRTROI, into a compact fixture file that the stand-in connect module
+(fake_connect/connect) can replay offline.
+
+record_patient walks the scripting API as the structure set classes do:
+the patient ID, each sub-structure set's review (reviewer and time) and
+ROI structures (name, colour, volume, centroid), and the ROI geometries of
+the structure set with their contours. The result is a patient dict, as
+per fake_connect/connect/_model.py.
+
+Fixture layout, a zip archive:
+    • patient.json: fixture_version, dtype and the patient dict, with the
+        contours of each ROI replaced by contour_block, the sha256 of its
+        block, or null
+    • contours/<sha256>.bin: encode_contours of the ROI contours, see
+        modules/snapshot_io.py. Identical contours are stored once.
+
+dtype "float64" replays the recorded points exactly; "quantized" rounds
+them to 0.01mm for much smaller fixtures.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from datetime import datetime as dt
+from hashlib import sha256
+from json import dumps, loads
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from modules.snapshot_io import DTYPES, decode_contours, encode_contours
+
+FIXTURE_VERSION = 1
+FIXTURE_EXTENSION = ".cuhfx"
+_PATIENT_ENTRY = "patient.json"
+_CONTOUR_DIR = "contours"
+
+
+def _review(sub_structure_set) -> tuple:
+    '''
+        (reviewer, [year, month, day, hour, minute, second]), or
+        (None, None) if the sub-structure set is not approved.
+    '''
+    try:
+        review = sub_structure_set.Review
+        rev = review.ReviewTime
+        return review.ReviewerFullName, [
+            rev.Year, rev.Month, rev.Day, rev.Hour, rev.Minute, rev.Second
+        ]
+    except Exception:
+        return None, None
+
+
+def _roi_record(roi, include_contours: bool = False) -> dict:
+    '''
+        Name, colour, volume, centroid and, if include_contours, contours
+        of a ROI geometry or ROI structure.
+    '''
+    colour = roi.OfRoi.Color
+    record = {
+        'name': roi.OfRoi.Name,
+        'colour': [
+            colour.get_A(), colour.get_R(), colour.get_G(), colour.get_B()
+        ],
+        'has_contours': bool(roi.HasContours()),
+    }
+    if not record['has_contours']:
+        return record
+
+    centroid = roi.GetCenterOfRoi()
+    record['volume'] = roi.GetRoiVolume()
+    record['centroid'] = {k: centroid[k] for k in ('x', 'y', 'z')}
+    if include_contours and hasattr(roi.PrimaryShape, "Contours"):
+        record['contours'] = [
+            [{k: point[k] for k in ('x', 'y', 'z')} for point in contour]
+            for contour in roi.PrimaryShape.Contours
+        ]
+    return record
+
+
+def _anonymise(patient: dict) -> dict:
+    '''
+        Replace the patient ID with a hash of it, and reviewer names with
+        Reviewer^1, Reviewer^2 etc. in order of appearance.
+    '''
+    reviewers = {}
+    for sub in patient['sub_structure_sets']:
+        if sub['reviewer'] is not None:
+            sub['reviewer'] = reviewers.setdefault(
+                sub['reviewer'], f"Reviewer^{len(reviewers) + 1}"
+            )
+    patient['patient_id'] = "ANON" + sha256(
+        patient['patient_id'].encode('utf-8')
+    ).hexdigest()[:10]
+    return patient
+
+
+def record_patient(get_current, include_contours: bool = True,
+    anonymise: bool = False, progress = None) -> dict:
+    '''
+        Patient dict of the current patient, read through get_current.
+
+        Params:
+            get_current: the connect.get_current function
+            include_contours: also record the contours of the structure
+                set's ROI geometries
+            anonymise: see _anonymise
+            progress: function(done, total, text) (optional), called per
+                ROI geometry
+    '''
+    exam = get_current("Examination")
+    patient_id = get_current("Patient").PatientID
+    case = get_current("Case")
+    ss = case.PatientModel.StructureSets[exam.Name]
+
+    sub_structure_sets = []
+    for sub in ss.SubStructureSets:
+        reviewer, review_time = _review(sub)
+        sub_structure_sets.append({
+            'reviewer': reviewer,
+            'review_time': review_time,
+            'rois': [_roi_record(roi) for roi in sub.RoiStructures],
+        })
+
+    geometries = list(ss.RoiGeometries)
+    roi_geometries = []
+    for i, roi in enumerate(geometries):
+        if progress is not None:
+            progress(i, len(geometries), roi.OfRoi.Name)
+        roi_geometries.append(_roi_record(roi, include_contours))
+    if progress is not None:
+        progress(len(geometries), len(geometries), "")
+
+    patient = {
+        'patient_id': patient_id,
+        'case': getattr(case, "CaseName", None),
+        'exam': exam.Name,
+        'recorded': dt.now().isoformat(timespec = "seconds"),
+        'sub_structure_sets': sub_structure_sets,
+        'roi_geometries': roi_geometries,
+    }
+    return _anonymise(patient) if anonymise else patient
+
+
+def _all_rois(patient: dict):
+    for sub in patient['sub_structure_sets']:
+        yield from sub['rois']
+    yield from patient.get('roi_geometries', [])
+
+
+def write_fixture(f_path: str, patient: dict, dtype: str = "float64") -> dict:
+    '''
+        Write a patient dict to the fixture f_path.
+
+        Returns dict of n_rois, n_blocks (distinct contour lists) and
+        n_points (recorded contour points).
+    '''
+    typecode = DTYPES[dtype]
+    blocks = {}
+    n_points = 0
+
+    def strip(roi: dict) -> dict:
+        nonlocal n_points
+        roi = dict(roi)
+        contours = roi.pop('contours', None)
+        roi['contour_block'] = None
+        if contours:
+            block = encode_contours(contours, typecode)
+            roi['contour_block'] = sha256(block).hexdigest()
+            if roi['contour_block'] not in blocks:
+                blocks[roi['contour_block']] = block
+                n_points += sum(len(contour) for contour in contours)
+        return roi
+
+    document = dict(patient)
+    document['sub_structure_sets'] = [
+        dict(sub, rois = [strip(roi) for roi in sub['rois']])
+        for sub in patient['sub_structure_sets']
+    ]
+    if 'roi_geometries' in patient:
+        document['roi_geometries'] = [
+            strip(roi) for roi in patient['roi_geometries']
+        ]
+
+    with ZipFile(f_path, 'w', compression = ZIP_DEFLATED) as zf:
+        zf.writestr(_PATIENT_ENTRY, dumps({
+            'fixture_version': FIXTURE_VERSION,
+            'dtype': dtype,
+            'patient': document,
+        }))
+        for digest, block in blocks.items():
+            zf.writestr(f"{_CONTOUR_DIR}/{digest}.bin", block)
+
+    return {
+        'n_rois': sum(1 for _ in _all_rois(document)),
+        'n_blocks': len(blocks),
+        'n_points': n_points,
+    }
+
+
+def read_fixture(f_path: str) -> dict:
+    '''
+        The patient dict recorded in the fixture f_path, with contours.
+        ROIs with identical contours share one contour list.
+    '''
+    with ZipFile(f_path) as zf:
+        document = loads(zf.read(_PATIENT_ENTRY).decode('utf-8'))
+        if document['fixture_version'] > FIXTURE_VERSION:
+            raise ValueError(
+                f"Unsupported fixture version: {document['fixture_version']}."
+            )
+        typecode = DTYPES[document['dtype']]
+        patient = document['patient']
+
+        contours = {}
+        for roi in _all_rois(patient):
+            digest = roi.pop('contour_block', None)
+            if digest is None:
+                continue
+            if digest not in contours:
+                contours[digest] = decode_contours(
+                    zf.read(f"{_CONTOUR_DIR}/{digest}.bin"), typecode
+                )
+            roi['contours'] = contours[digest]
+    return patient
+
+
+def record_session(f_path: str, get_current = None, dtype: str = "float64",
+    include_contours: bool = True, anonymise: bool = False,
+    progress = None) -> dict:
+    '''
+        Record the current patient, see record_patient, to the fixture
+        f_path. get_current defaults to connect.get_current.
+
+        Returns the fixture stats, see write_fixture.
+    '''
+    if get_current is None:
+        from connect import get_current
+    return write_fixture(
+        f_path,
+        record_patient(
+            get_current, include_contours = include_contours,
+            anonymise = anonymise, progress = progress
+        ),
+        dtype = dtype
+    )
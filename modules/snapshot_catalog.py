@@ -0,0 +1,209 @@
+'''
+Local SQLite catalog of the structure set snapshots on the F_ROOT share.
+
+Snapshots are keyed by patient ID, reviewer, locktime and path, as read
+from their file names: PatientID+Reviewer+locktime+.ext, as written by
+CUHRTStructureSet. Looking up the snapshots of a patient is then a single
+indexed query, rather than a listing of the share.
+
+The catalog is updated by record on every export, and by scan, which
+lists the share once and only records files that are new or whose mtime
+or size has changed. Files no longer on the share are dropped.
+
+A new connection is opened per call, so a catalog can be used from a
+background task as well as from the GUI.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime as dt
+from os import makedirs, path, scandir, stat
+
+from modules.snapshot_io import EXTENSION, MANIFEST_EXTENSION
+
+SNAPSHOT_EXTENSIONS = (".json", EXTENSION, MANIFEST_EXTENSION)
+# As per CUHRTStructureSet.locktime
+LOCKTIME_FORMAT = "%m_%d_%Y_%H_%M_%S"
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS snapshots (
+        path TEXT PRIMARY KEY,
+        patient_id TEXT NOT NULL,
+        reviewer TEXT,
+        locktime TEXT,
+        locktime_iso TEXT,
+        format TEXT,
+        mtime REAL,
+        size INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS snapshots_patient
+        ON snapshots (patient_id, locktime_iso);
+'''
+
+_COLUMNS = (
+    "path", "patient_id", "reviewer", "locktime", "locktime_iso", "format",
+    "mtime", "size"
+)
+_INSERT = (
+    f"INSERT OR REPLACE INTO snapshots ({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_COLUMNS))})"
+)
+
+
+def parse_snapshot_name(f_name: str):
+    '''
+        (patient_id, reviewer, locktime, format) from a snapshot file name,
+        or None if it is not one. locktime is None for unapproved sets.
+    '''
+    stem, extension = path.splitext(f_name)
+    if extension.lower() not in SNAPSHOT_EXTENSIONS or "+" not in stem:
+        return None
+    parts = stem.split("+")
+    if parts[-1] == "":
+        parts = parts[:-1]
+    if len(parts) < 2:
+        return None
+    return (
+        parts[0], parts[1].replace("_", " "),
+        parts[2] if len(parts) > 2 else None, extension.lower()
+    )
+
+
+def locktime_iso(locktime: str):
+    '''
+        ISO 8601 form of a CUHRTStructureSet locktime, or None.
+    '''
+    try:
+        return dt.strptime(locktime, LOCKTIME_FORMAT).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+class CUHSnapshotCatalog():
+    '''
+        SQLite index of snapshots, at db_path.
+
+        Methods:
+            • record(f_path)
+                add or update one snapshot, e.g. after an export
+            • scan(root, progress = None)
+                incremental re-index of the snapshots in root
+            • snapshots_for_patient(patient_id)
+                list of dicts, newest locktime first
+    '''
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        makedirs(path.dirname(path.abspath(db_path)), exist_ok=True)
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        '''
+            Connection that commits on success and is always closed.
+        '''
+        con = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @staticmethod
+    def _row(f_path: str, f_stat) -> tuple:
+        parsed = parse_snapshot_name(path.basename(f_path))
+        if parsed is None:
+            return None
+        patient_id, reviewer, locktime, extension = parsed
+        return (
+            path.normpath(f_path), patient_id, reviewer, locktime,
+            locktime_iso(locktime), extension,
+            f_stat.st_mtime, f_stat.st_size
+        )
+
+    def record(self, f_path: str) -> bool:
+        '''
+            Add or update the snapshot at f_path. False if its name is not
+            that of a snapshot.
+        '''
+        row = self._row(f_path, stat(f_path))
+        if row is None:
+            return False
+        with self._connect() as con:
+            con.execute(_INSERT, row)
+        return True
+
+    def scan(self, root: str, progress = None) -> dict:
+        '''
+            Re-index the snapshots in root: record new and changed files,
+            by mtime and size, and drop those that have gone. Sub-folders,
+            e.g. the blob store, are not scanned.
+
+            progress: function(done, total, text) (optional), return False
+                to stop, raising CUHRTOperationCancelled; the catalog is 
+                left as it was.
+
+            Returns dict of added, updated, unchanged and removed counts.
+        '''
+        if progress is not None:
+            # Imported here, as only the GUI, which has connect, passes 
+            # progress; the batch checker uses the catalog without it
+            from modules.structure_set_classes import report_progress
+
+        root = path.normpath(root)
+        with self._connect() as con:
+            known = {
+                f_path: (mtime, size) for f_path, mtime, size in con.execute(
+                    "SELECT path, mtime, size FROM snapshots "
+                    "WHERE path LIKE ?", (path.join(root, "%"),)
+                )
+                if path.dirname(f_path) == root
+            }
+
+        stats = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0}
+        rows = []
+        seen = set()
+        entries = [entry for entry in scandir(root) if entry.is_file()]
+        for i, entry in enumerate(entries):
+            if progress is not None:
+                report_progress(progress, i, len(entries), entry.name)
+            f_path = path.normpath(entry.path)
+            f_stat = entry.stat()
+            if f_path in known:
+                seen.add(f_path)
+                if known[f_path] == (f_stat.st_mtime, f_stat.st_size):
+                    stats['unchanged'] += 1
+                    continue
+            row = self._row(f_path, f_stat)
+            if row is None:
+                continue
+            seen.add(f_path)
+            stats['updated' if f_path in known else 'added'] += 1
+            rows.append(row)
+
+        gone = [(f_path,) for f_path in known if f_path not in seen]
+        stats['removed'] = len(gone)
+        with self._connect() as con:
+            con.executemany(_INSERT, rows)
+            con.executemany("DELETE FROM snapshots WHERE path = ?", gone)
+        if progress is not None:
+            # Already written, so too late to cancel
+            progress(len(entries), len(entries), "")
+        return stats
+
+    def snapshots_for_patient(self, patient_id: str) -> list:
+        '''
+            Catalogued snapshots of patient_id, newest locktime first.
+        '''
+        with self._connect() as con:
+            rows = con.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM snapshots "
+                "WHERE patient_id = ? ORDER BY locktime_iso DESC, path",
+                (patient_id,)
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
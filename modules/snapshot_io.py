@@ -0,0 +1,708 @@
+'''
+Compact binary snapshot format for CUHRTStructureSet objects, and the 
+table of contents (TOC) used to read any snapshot lazily.
+
+Binary layout (all integers little-endian):
+    • MAGIC (8 bytes), version, compression, point dtype, 1 pad byte
+    • header: uint32 length + compressed utf-8 json
+        f_name, locktime, reviewer and the ROI summaries (no contours)
+    • one block per ROI, in header order: uint32 length + compressed
+        uint32 n_contours, uint32 contour offsets[n_contours + 1],
+        points[n_points * 3] as float32 or float64
+      A zero length block means the ROI has no contours.
+    • version 4 onwards, the points may instead be quantized: 
+        float64 quantum [cm], uint8 delta width (2 or 4),
+        int32 first point[n_contours * 3] in quanta, 
+        int16 or int32 deltas[n_points * 3] from the previous point of 
+        the same contour, 0 for the first point of each contour
+      Decoded points are within quantum / 2 of the originals. Version 3 
+      is still written for float32 and float64 snapshots.
+    • version 2 onwards, TOC: uint32 n_rois + (uint64 offset, uint32 
+      length) per ROI block, then the uint64 offset of the TOC itself.
+    • version 3 onwards, the TOC entries are followed by a uint32 length 
+      + compressed json list of the geometry fingerprint of each ROI 
+      (see modules/roi_fingerprint.py), null if not known.
+
+Json TOC layout, written by write_json_snapshot:
+    • the first key is "toc_offset", a fixed width string holding the 
+      byte offset of the "toc" value at the end of the file
+    • "rois" holds the ROI summaries, "contours" the contours per ROI 
+    • "toc" holds f_name, locktime, reviewer, the [start, stop) byte 
+      range of "rois" and of every entry in "contours", and the geometry 
+      fingerprint of each ROI
+
+Manifest layout, written by write_manifest_snapshot:
+    • a json document whose first key is "manifest_version"
+    • f_name, locktime, reviewer, compression, dtype, blob_dir and the
+      ROI summaries, as per the binary header
+    • "blobs" holds the sha256 of the contour block of each ROI, or null,
+      and "fingerprints" the geometry fingerprint of each ROI
+    • each contour block is stored once, as a binary ROI block without
+      the length, in a CUHBlobStore at blob_dir, relative to the manifest
+
+Only the standard library is used so that files can be read anywhere
+RayStation scripts run.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import lzma
+import zlib
+from array import array
+from hashlib import sha256
+from json import dumps, loads
+from os import makedirs, path, remove, replace, getpid
+from struct import Struct
+from sys import byteorder
+from uuid import uuid4
+
+MAGIC = b"CUHRTSS\x00"
+VERSION = 4
+EXTENSION = ".cuhss"
+
+COMPRESSION = {"none": 0, "zlib": 1, "lzma": 2}
+# "z" is not an array typecode, it marks the quantized delta encoding
+DTYPES = {"float64": "d", "float32": "f", "quantized": "z"}
+QUANTIZED = DTYPES["quantized"]
+# Quantized points are stored to 0.01mm [cm]
+QUANTUM = 0.001
+
+_PREAMBLE = Struct("<8sBBBx")
+_UINT32 = Struct("<I")
+_UINT64 = Struct("<Q")
+_TOC_ENTRY = Struct("<QI")
+_QUANTIZED = Struct("<dB")
+_INT16_RANGE = (-2**15, 2**15 - 1)
+
+JSON_TOC_PREFIX = b'{"toc_offset": "'
+_JSON_TOC_WIDTH = 16
+
+MANIFEST_VERSION = 1
+MANIFEST_EXTENSION = ".cuhsm"
+MANIFEST_PREFIX = b'{"manifest_version": '
+BLOB_DIR = "blobs"
+
+
+def _compress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION["zlib"]:
+        return zlib.compress(data, 6)
+    if compression == COMPRESSION["lzma"]:
+        return lzma.compress(data)
+    return data
+
+
+def _decompress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION["zlib"]:
+        return zlib.decompress(data)
+    if compression == COMPRESSION["lzma"]:
+        return lzma.decompress(data)
+    return data
+
+
+def _to_little_endian(values: array) -> bytes:
+    if byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def is_binary_snapshot(f_path: str) -> bool:
+    '''
+        True if the file at f_path starts with the binary snapshot MAGIC.
+    '''
+    with open(f_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _numpy():
+    '''
+        NumPy if installed, else None. Only used to decode faster.
+    '''
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def encode_contours(contours: list, typecode: str = "d") -> bytes:
+    '''
+        Pack a RayStation contour list (list of lists of {'x','y','z'}
+        points) into offsets and a flat point array.
+    '''
+    if typecode == QUANTIZED:
+        return encode_quantized_contours(contours)
+
+    offsets = array("I", [0])
+    points = array(typecode)
+    for contour in contours:
+        for point in contour:
+            points.extend((point['x'], point['y'], point['z']))
+        offsets.append(len(points) // 3)
+
+    return b"".join([
+        _UINT32.pack(len(contours)),
+        _to_little_endian(offsets),
+        _to_little_endian(points),
+    ])
+
+
+def encode_quantized_contours(contours: list,
+    quantum: float = QUANTUM) -> bytes:
+    '''
+        As per encode_contours, but with the points quantized to quantum 
+        [cm] and delta encoded within each contour. 
+    '''
+    offsets = array("I", [0])
+    starts = array("i")
+    deltas = array("i")
+    for contour in contours:
+        previous = None
+        for point in contour:
+            q = (
+                int(round(point['x'] / quantum)), 
+                int(round(point['y'] / quantum)), 
+                int(round(point['z'] / quantum)),
+            )
+            if previous is None:
+                starts.extend(q)
+                deltas.extend((0, 0, 0))
+            else:
+                deltas.extend((
+                    q[0] - previous[0], q[1] - previous[1], q[2] - previous[2]
+                ))
+            previous = q
+        if previous is None:
+            starts.extend((0, 0, 0))
+        offsets.append(len(deltas) // 3)
+
+    if not deltas or (
+        _INT16_RANGE[0] <= min(deltas) and max(deltas) <= _INT16_RANGE[1]):
+        deltas = array("h", deltas)
+
+    return b"".join([
+        _UINT32.pack(len(contours)),
+        _to_little_endian(offsets),
+        _QUANTIZED.pack(quantum, deltas.itemsize),
+        _to_little_endian(starts),
+        _to_little_endian(deltas),
+    ])
+
+
+def decode_quantized_contours(data: bytes) -> list:
+    '''
+        Inverse of encode_quantized_contours. The running sums are 
+        vectorised with NumPy, if installed. 
+    '''
+    n_contours = _UINT32.unpack_from(data)[0]
+    position = _UINT32.size * (n_contours + 2)
+    offsets = _from_little_endian("I", data[_UINT32.size:position])
+    quantum, width = _QUANTIZED.unpack_from(data, position)
+    position += _QUANTIZED.size
+    starts_end = position + 4 * 3 * n_contours
+    starts = _from_little_endian("i", data[position:starts_end])
+    deltas = _from_little_endian(
+        "h" if width == 2 else "i", data[starts_end:]
+    )
+
+    np = _numpy()
+    if np is not None:
+        offsets = np.asarray(offsets, dtype=np.int64)
+        q = np.asarray(deltas, dtype=np.int64).reshape(-1, 3)
+        nonempty = offsets[1:] > offsets[:-1]
+        first = offsets[:-1][nonempty]
+        q[first] = np.asarray(starts, dtype=np.int64).reshape(-1, 3)[nonempty]
+        total = np.cumsum(q, axis=0)
+        # Restart the running sum at the first point of every contour
+        before = np.zeros((len(first), 3), dtype=np.int64)
+        before[first > 0] = total[first[first > 0] - 1]
+        total -= np.repeat(before, np.diff(offsets)[nonempty], axis=0)
+        points = (total * quantum).tolist()
+        return [
+            [{'x': x, 'y': y, 'z': z} for x, y, z in points[start:stop]]
+            for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+        ]
+
+    contours = []
+    for c, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+        x, y, z = starts[3*c:3*c + 3]
+        contour = []
+        for i in range(3*start, 3*stop, 3):
+            if i > 3*start:
+                x += deltas[i]
+                y += deltas[i+1]
+                z += deltas[i+2]
+            contour.append(
+                {'x': x * quantum, 'y': y * quantum, 'z': z * quantum}
+            )
+        contours.append(contour)
+    return contours
+
+
+def decode_contours(data: bytes, typecode: str = "d") -> list:
+    '''
+        Inverse of encode_contours.
+    '''
+    if typecode == QUANTIZED:
+        return decode_quantized_contours(data)
+
+    n_contours = _UINT32.unpack_from(data)[0]
+    offsets_end = _UINT32.size * (n_contours + 2)
+    offsets = _from_little_endian("I", data[_UINT32.size:offsets_end])
+    points = _from_little_endian(typecode, data[offsets_end:])
+
+    contours = []
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        contours.append([
+            {'x': points[i], 'y': points[i+1], 'z': points[i+2]}
+            for i in range(3*start, 3*stop, 3)
+        ])
+    return contours
+
+
+def _roi_summary(roi: dict) -> dict:
+    '''
+        ROI dict without its contours. The fingerprint is stored in the TOC, 
+        as streamed exports only know it once the contours are written. 
+    '''
+    return {
+        k: v for k, v in roi.items() 
+        if k not in ('contours', 'has_contours', 'fingerprint')
+    }
+
+
+def write_binary_header(f, header: dict, rois: list,
+    compression: str = "zlib", dtype: str = "float64"):
+    '''
+        Write the preamble and header of a snapshot to the open binary file
+        object f. Must be followed by one write_binary_roi_block per roi.
+
+        Params:
+            header: dict of f_name, locktime, reviewer
+            rois: list of CUHRTROI roi dicts, contours are not written
+            compression: "none", "zlib" or "lzma"
+            dtype: "float64", "float32" or "quantized"
+    '''
+    header = dict(header)
+    header['rois'] = [_roi_summary(roi) for roi in rois]
+    compression = COMPRESSION[compression]
+    header_bytes = _compress(dumps(header).encode('utf-8'), compression)
+
+    # Older readers can still read float snapshots
+    version = VERSION if dtype == "quantized" else 3
+    f.write(_PREAMBLE.pack(MAGIC, version, compression, ord(DTYPES[dtype])))
+    f.write(_UINT32.pack(len(header_bytes)))
+    f.write(header_bytes)
+
+
+def encode_roi_block(roi: dict, compression: str = "zlib",
+    dtype: str = "float64") -> bytes:
+    '''
+        Compressed contour block of one CUHRTROI roi dict, b"" if it has 
+        no contours.
+    '''
+    if roi.get('has_contours') and roi.get('contours'):
+        return _compress(
+            encode_contours(roi['contours'], DTYPES[dtype]),
+            COMPRESSION[compression]
+        )
+    return b""
+
+
+def write_binary_roi_block(f, roi: dict,
+    compression: str = "zlib", dtype: str = "float64") -> tuple:
+    '''
+        Write the contour block of one CUHRTROI roi dict to f.
+        Returns the (offset, length) TOC entry of the block.
+    '''
+    block = encode_roi_block(roi, compression, dtype)
+    f.write(_UINT32.pack(len(block)))
+    offset = f.tell()
+    f.write(block)
+    return offset, len(block)
+
+
+def write_binary_toc(f, toc: list, fingerprints: list = None,
+    compression: str = "zlib"):
+    '''
+        Write the TOC, a list of (offset, length) per ROI block, and the 
+        fingerprint (or None) of each ROI to f.
+        Must be the last thing written to the file.
+    '''
+    toc_offset = f.tell()
+    f.write(_UINT32.pack(len(toc)))
+    for offset, length in toc:
+        f.write(_TOC_ENTRY.pack(offset, length))
+    fingerprint_bytes = _compress(
+        dumps(fingerprints or [None] * len(toc)).encode('utf-8'),
+        COMPRESSION[compression]
+    )
+    f.write(_UINT32.pack(len(fingerprint_bytes)))
+    f.write(fingerprint_bytes)
+    f.write(_UINT64.pack(toc_offset))
+
+
+def write_binary_snapshot(f, header: dict, rois: list,
+    compression: str = "zlib", dtype: str = "float64"):
+    '''
+        Write a snapshot to the open binary file object f.
+
+        Params:
+            header: dict of f_name, locktime, reviewer
+            rois: list of CUHRTROI roi dicts, contours optional
+            compression: "none", "zlib" or "lzma"
+            dtype: "float64", "float32" or "quantized"
+    '''
+    write_binary_header(f, header, rois, compression, dtype)
+    write_binary_toc(f, [
+        write_binary_roi_block(f, roi, compression, dtype) for roi in rois
+    ], [roi.get('fingerprint') for roi in rois], compression)
+
+
+def _read_binary_preamble(f) -> tuple:
+    magic, version, compression, typecode = _PREAMBLE.unpack(
+        f.read(_PREAMBLE.size)
+    )
+    if magic != MAGIC:
+        raise ValueError("Not a binary structure set snapshot.")
+    if version > VERSION:
+        raise ValueError(f"Unsupported snapshot version: {version}.")
+    header_len = _UINT32.unpack(f.read(_UINT32.size))[0]
+    data = loads(_decompress(f.read(header_len), compression).decode('utf-8'))
+    return version, compression, chr(typecode), data
+
+
+def read_binary_snapshot(f) -> dict:
+    '''
+        Read a snapshot from the open binary file object f.
+        Returns a dict in the same shape as the json snapshot.
+    '''
+    version, compression, typecode, data = _read_binary_preamble(f)
+
+    for roi in data['rois']:
+        block_len = _UINT32.unpack(f.read(_UINT32.size))[0]
+        if block_len:
+            roi['contours'] = decode_contours(
+                _decompress(f.read(block_len), compression), typecode
+            )
+            roi['has_contours'] = True
+        else:
+            roi['has_contours'] = False
+
+    return data
+
+
+def write_json_snapshot(f, header: dict, rois: list, streamed_rois):
+    '''
+        Write a json snapshot with a TOC to the open binary file object f.
+
+        Params:
+            header: dict of f_name, locktime, reviewer
+            rois: list of CUHRTROI roi dicts, for the ROI summaries
+            streamed_rois: iterable yielding the same roi dicts with their 
+                contours loaded, one at a time, whose fingerprints are 
+                stored
+    '''
+    def write(text: str) -> tuple:
+        start = f.tell()
+        f.write(text.encode('utf-8'))
+        return start, f.tell()
+
+    f.write(JSON_TOC_PREFIX + b"0" * _JSON_TOC_WIDTH + b'",\n')
+    for key in ("f_name", "locktime", "reviewer"):
+        write(f"    {dumps(key)}: {dumps(header[key])},\n")
+
+    write('    "rois": ')
+    rois_range = write(dumps(
+        [_roi_summary(roi) for roi in rois], indent=4, sort_keys=True
+    ))
+
+    write(',\n    "contours": [\n')
+    contour_ranges = []
+    fingerprints = []
+    for i, roi in enumerate(streamed_rois):
+        fingerprints.append(roi.get('fingerprint'))
+        if i:
+            write(",\n")
+        if roi.get('has_contours') and roi.get('contours'):
+            contour_ranges.append(
+                write(dumps(roi['contours'], separators=(",", ":")))
+            )
+        else:
+            write("null")
+            contour_ranges.append(None)
+
+    write('\n    ],\n    "toc": ')
+    toc = {key: header[key] for key in ("f_name", "locktime", "reviewer")}
+    toc['rois'] = rois_range
+    toc['contours'] = contour_ranges
+    toc['fingerprints'] = fingerprints
+    toc_offset, _ = write(dumps(toc))
+    write("\n}\n")
+
+    f.seek(len(JSON_TOC_PREFIX))
+    f.write(str(toc_offset).zfill(_JSON_TOC_WIDTH).encode('ascii'))
+    f.seek(0, 2)
+
+
+class CUHBlobStore():
+    '''
+        Content addressed store of contour blocks: each block is written 
+        once, under the sha256 of its bytes, at 
+        root/<first 2 hex digits>/<sha256>.blob. 
+
+        Blocks are written to a temporary file and renamed into place, so 
+        a block that exists is always complete, even if two exports write 
+        it at the same time. 
+
+        Methods: 
+            • put(data) 
+                returns (digest, written), written is False if the block 
+                was already stored 
+            • get(digest) 
+                returns the block, checked against its digest 
+            • has(digest) 
+    '''
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob_path(self, digest: str) -> str:
+        return path.join(self.root, digest[:2], digest + ".blob")
+
+    def has(self, digest: str) -> bool:
+        return path.exists(self.blob_path(digest))
+
+    def put(self, data: bytes) -> tuple:
+        digest = sha256(data).hexdigest()
+        if self.has(digest):
+            return digest, False
+
+        blob_path = self.blob_path(digest)
+        makedirs(path.dirname(blob_path), exist_ok=True)
+        tmp_path = f"{blob_path}.{getpid()}.{uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            replace(tmp_path, blob_path)
+        finally:
+            if path.exists(tmp_path):
+                remove(tmp_path)
+        return digest, True
+
+    def get(self, digest: str) -> bytes:
+        with open(self.blob_path(digest), 'rb') as f:
+            data = f.read()
+        if sha256(data).hexdigest() != digest:
+            raise ValueError(f"Corrupt blob: {digest}.")
+        return data
+
+
+def write_manifest_snapshot(f, store: CUHBlobStore, header: dict,
+    rois: list, streamed_rois, compression: str = "zlib",
+    dtype: str = "quantized", blob_dir: str = BLOB_DIR) -> dict:
+    '''
+        Put the contour block of every ROI in store, skipping those already 
+        stored, and write a manifest referencing them to the open binary 
+        file object f.
+
+        Params:
+            store: CUHBlobStore at blob_dir, relative to the manifest
+            header: dict of f_name, locktime, reviewer
+            rois: list of CUHRTROI roi dicts, for the ROI summaries
+            streamed_rois: iterable yielding the same roi dicts with their 
+                contours loaded, one at a time, whose fingerprints are 
+                stored
+
+        Returns dict of blobs_written, blobs_skipped and blob_bytes_written.
+    '''
+    stats = {'blobs_written': 0, 'blobs_skipped': 0, 'blob_bytes_written': 0}
+    blobs = []
+    fingerprints = []
+    for roi in streamed_rois:
+        fingerprints.append(roi.get('fingerprint'))
+        block = encode_roi_block(roi, compression, dtype)
+        if not block:
+            blobs.append(None)
+            continue
+        digest, written = store.put(block)
+        blobs.append(digest)
+        if written:
+            stats['blobs_written'] += 1
+            stats['blob_bytes_written'] += len(block)
+        else:
+            stats['blobs_skipped'] += 1
+
+    manifest = {'manifest_version': MANIFEST_VERSION}
+    for key in ("f_name", "locktime", "reviewer"):
+        manifest[key] = header[key]
+    manifest['compression'] = compression
+    manifest['dtype'] = dtype
+    manifest['blob_dir'] = blob_dir
+    manifest['rois'] = [_roi_summary(roi) for roi in rois]
+    manifest['blobs'] = blobs
+    manifest['fingerprints'] = fingerprints
+    f.write(dumps(manifest).encode('utf-8'))
+    return stats
+
+
+class SnapshotReader():
+    '''
+        Reads the metadata of a snapshot up front and the contours of each 
+        ROI on demand, using the snapshot TOC. 
+
+        Manifests are read lazily too, each ROI's contours from its blob. 
+        Snapshots without a TOC (plain json, binary version 1) are read 
+        in full at init and served from memory. 
+
+        Attributes: 
+            • f_path: str 
+            • data: dict 
+                f_name, locktime, reviewer, rois (with has_contours and, 
+                if stored, fingerprint) 
+            • lazy: bool 
+                True if contours are read on demand 
+
+        Methods: 
+            • read_contours(index) 
+                returns the contours of ROI index, or None 
+    '''
+
+    def __init__(self, f_path: str):
+        self.f_path = f_path
+        self.lazy = True
+        self._toc = None
+        self._json_toc = False
+        self._blobs = None
+
+        with open(f_path, 'rb') as f:
+            start = f.read(max(len(JSON_TOC_PREFIX), len(MANIFEST_PREFIX)))
+            f.seek(0)
+            if start[:len(MAGIC)] == MAGIC:
+                self._open_binary(f)
+            elif start[:len(JSON_TOC_PREFIX)] == JSON_TOC_PREFIX:
+                self._open_json_toc(f)
+            elif start[:len(MANIFEST_PREFIX)] == MANIFEST_PREFIX:
+                self._open_manifest(f)
+            else:
+                self.lazy = False
+                self.data = loads(f.read().decode('utf-8'))
+
+    def _open_binary(self, f):
+        version, self._compression, self._typecode, self.data = \
+            _read_binary_preamble(f)
+
+        if version < 2:
+            self.lazy = False
+            f.seek(0)
+            self.data = read_binary_snapshot(f)
+            return
+
+        f.seek(-_UINT64.size, 2)
+        f.seek(_UINT64.unpack(f.read(_UINT64.size))[0])
+        n_rois = _UINT32.unpack(f.read(_UINT32.size))[0]
+        self._toc = [
+            _TOC_ENTRY.unpack(f.read(_TOC_ENTRY.size)) for _ in range(n_rois)
+        ]
+        for roi, (_, length) in zip(self.data['rois'], self._toc):
+            roi['has_contours'] = bool(length)
+
+        if version >= 3:
+            length = _UINT32.unpack(f.read(_UINT32.size))[0]
+            fingerprints = loads(
+                _decompress(f.read(length), self._compression).decode('utf-8')
+            )
+            for roi, fingerprint in zip(self.data['rois'], fingerprints):
+                if fingerprint:
+                    roi['fingerprint'] = fingerprint
+
+    def _open_json_toc(self, f):
+        f.seek(len(JSON_TOC_PREFIX))
+        f.seek(int(f.read(_JSON_TOC_WIDTH)))
+        # The toc value is followed by the closing brace of the document
+        toc = loads(f.read().decode('utf-8').rstrip()[:-1])
+
+        start, stop = toc['rois']
+        f.seek(start)
+        rois = loads(f.read(stop - start).decode('utf-8'))
+        for roi, contour_range in zip(rois, toc['contours']):
+            roi['has_contours'] = contour_range is not None
+        for roi, fingerprint in zip(rois, toc.get('fingerprints', [])):
+            if fingerprint:
+                roi['fingerprint'] = fingerprint
+
+        self._toc = toc['contours']
+        self._json_toc = True
+        self.data = {
+            'f_name': toc['f_name'],
+            'locktime': toc['locktime'],
+            'reviewer': toc['reviewer'],
+            'rois': rois,
+        }
+
+    def _open_manifest(self, f):
+        manifest = loads(f.read().decode('utf-8'))
+        if manifest['manifest_version'] > MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported manifest version: {manifest['manifest_version']}."
+            )
+        self._store = CUHBlobStore(
+            path.join(path.dirname(self.f_path), manifest['blob_dir'])
+        )
+        self._compression = COMPRESSION[manifest['compression']]
+        self._typecode = DTYPES[manifest['dtype']]
+        self._blobs = manifest['blobs']
+        for roi, blob, fingerprint in zip(
+            manifest['rois'], manifest['blobs'], manifest['fingerprints']):
+            roi['has_contours'] = blob is not None
+            if fingerprint:
+                roi['fingerprint'] = fingerprint
+        self.data = {
+            key: manifest[key] for key in ("f_name", "locktime", "reviewer")
+        }
+        self.data['rois'] = manifest['rois']
+
+    def read_contours(self, index: int) -> list:
+        '''
+            Returns the contours of ROI index, or None if it has none. 
+        '''
+        if not self.lazy:
+            return self.data['rois'][index].get('contours')
+
+        if self._blobs is not None:
+            digest = self._blobs[index]
+            if digest is None:
+                return None
+            return decode_contours(
+                _decompress(self._store.get(digest), self._compression), 
+                self._typecode
+            )
+
+        entry = self._toc[index]
+        if not entry:
+            return None
+
+        with open(self.f_path, 'rb') as f:
+            if self._json_toc:
+                start, stop = entry
+                f.seek(start)
+                return loads(f.read(stop - start).decode('utf-8'))
+
+            offset, length = entry
+            if not length:
+                return None
+            f.seek(offset)
+            return decode_contours(
+                _decompress(f.read(length), self._compression), 
+                self._typecode
+            )
@@ -1,11 +1,140 @@
 from connect import get_current 
-from os import path
+from os import path, remove
 from sys import exit
-from json import load, dump, dumps
+from json import dump
 from datetime import datetime as dt
-from tkinter import Tk
-from tkinter import messagebox as mb
+from functools import partial
+from threading import current_thread, main_thread
+from time import perf_counter
 from tkinter.messagebox import WARNING
+from widgets.cuh_tkinter import DIALOGS
+from modules.roi_matching import volumes_match, centroids_match
+from modules.memory_usage import CUHPeakMemory, format_bytes
+from modules.call_timing import TIMINGS
+from modules.roi_fingerprint import (
+    contour_fingerprint, fingerprints_match, EXACT_MATCH_RESULTS
+)
+from modules.snapshot_io import (
+    SnapshotReader, write_binary_snapshot, write_binary_header, 
+    write_binary_roi_block, write_binary_toc, write_json_snapshot, 
+    write_manifest_snapshot, CUHBlobStore, BLOB_DIR, MANIFEST_EXTENSION, 
+    EXTENSION as SNAPSHOT_EXTENSION
+)
+
+# Every scripting object is reached through get_current, so while timing 
+# is on this times every scripting call made through them, see 
+# modules/call_timing.py 
+get_current = TIMINGS.wrap_entry(get_current, "get_current")
+
+class CUHRayStationSession():
+    '''
+        Memoized RayStation get_current context. 
+
+        Resolved once, on first use, and shared by every script object so 
+        that each ROI does not repeat the scripting-bridge calls. 
+
+        Attributes: 
+            • exam, patientID, case, ss 
+                as per CUHGetCurrentStructureSetObject
+            • resolves: int 
+                times the context was resolved through the scripting bridge
+            • resolves_skipped: int 
+                times the cached context was returned instead
+
+        Methods: 
+            • resolve 
+                resolve the context if not already cached 
+            • invalidate 
+                drop the cached context
+            • current_identity 
+                patient ID, case name and exam name selected in RayStation 
+            • refresh 
+                invalidate if the patient, case or exam has changed since 
+                the context was last resolved 
+    '''
+
+    def __init__(self):
+        self.resolves = 0 
+        self.resolves_skipped = 0 
+        self._context = None 
+        # Kept across invalidate, so that refresh can tell a change of exam 
+        self._identity = None 
+
+    def resolve(self):
+        '''
+            Resolve the get_current context, unless already cached. 
+        '''
+        if self._context is not None:
+            self.resolves_skipped += 1 
+            return self._context
+
+        exam = get_current("Examination")
+        patientID = get_current("Patient").PatientID
+        case = get_current("Case")
+        exam_name = exam.Name
+        ss = case.PatientModel.StructureSets[exam_name]
+
+        self.resolves += 1 
+        self._identity = (patientID, case.CaseName, exam_name)
+        self._context = {
+            'exam': exam,
+            'patientID': patientID,
+            'case': case,
+            'ss': ss,
+        }
+        return self._context
+
+    def invalidate(self):
+        '''
+            Forget the cached context. The next script object to be 
+            initialised will resolve it again. 
+        '''
+        self._context = None 
+
+    @staticmethod
+    def current_identity() -> tuple:
+        '''
+            (patient ID, case name, exam name) selected in RayStation. 
+        '''
+        return (
+            get_current("Patient").PatientID, 
+            get_current("Case").CaseName, 
+            get_current("Examination").Name, 
+        )
+
+    def refresh(self) -> bool:
+        '''
+            Invalidate the cached context if the patient, case or exam 
+            selected in RayStation is not the one it was last resolved for. 
+            Returns True if so, and False if it was never resolved. 
+        '''
+        if self._identity is None \
+            or self.current_identity() == self._identity:
+            return False
+        self.invalidate()
+        return True
+
+    @property
+    def exam(self):
+        return self.resolve()['exam']
+
+    @property
+    def patientID(self):
+        return self.resolve()['patientID']
+
+    @property
+    def case(self):
+        return self.resolve()['case']
+
+    @property
+    def ss(self):
+        return self.resolve()['ss']
+
+
+SESSION = CUHRayStationSession()
+# Resolve again, wrapped or not, when timing is switched on or off 
+TIMINGS.on_toggle(SESSION.invalidate)
+
 
 class CUHGetCurrentStructureSetObject():
     '''
@@ -13,15 +142,37 @@ class CUHGetCurrentStructureSetObject():
         RayStation. 
 
         Subsequent script objects inherit from this. 
+
+        The properties are read from the shared SESSION on first use, so 
+        the get_current calls are only made once per session, and never by 
+        objects that are only used offline. 
     '''
     def __init__(self):
+        self._context = None 
+
+    @property
+    def exam(self):
+        return self._session_context()['exam']
 
-        self.exam = get_current("Examination")
-        self.patientID = get_current("Patient").PatientID
-        self.case = get_current("Case")
+    @property
+    def patientID(self):
+        return self._session_context()['patientID']
 
-        self.ss = self.case.PatientModel.StructureSets[
-            self.exam.Name]
+    @property
+    def case(self):
+        return self._session_context()['case']
+
+    @property
+    def ss(self):
+        return self._session_context()['ss']
+
+    def _session_context(self) -> dict:
+        '''
+            Re-resolve if the SESSION has been invalidated since init. 
+        '''
+        if self._context is None or SESSION._context is not self._context:
+            self._context = SESSION.resolve()
+        return self._context
   
 
 class CUHRTWarningMessage(): 
@@ -30,24 +181,23 @@ class CUHRTWarningMessage():
     '''
     def __init__(self, title: str = "WARNING: ", message: str = None):
         
-        root = Tk()
-        root.iconbitmap(
-            "//MOSAIQAPP-20/mosaiq_app/TOOLS/RayStation"
-            "/microscope_io/microscope.ico"
-            )
-        root.withdraw() 
-        self.answer = mb.askokcancel(
+        # Shown over the app window, or one shared hidden root 
+        self.answer = DIALOGS.askokcancel(
             title = title,
             message = message,
             icon = WARNING
         )
-        root.destroy() 
 
 
 class CUHRTStructureSetException(Exception):
     '''
         Super exception class - raised if any of the following classes fail. 
 
+        Shows an error dialog and exits. Tk dialogs can only be shown from 
+        the main thread, so if raised elsewhere, e.g. in a background task, 
+        show_and_exit must be called by whoever handles it on the main 
+        thread. 
+
         Attributes: 
             • message: str 
             • err: str
@@ -58,19 +208,46 @@ class CUHRTStructureSetException(Exception):
             self.message = message + f"\n{error}."
         else: 
             self.message = message 
-        root = Tk()
-        root.iconbitmap(
-            "//MOSAIQAPP-20/mosaiq_app/TOOLS/RayStation"
-            "/microscope_io/microscope.ico"
-            )
-        root.withdraw() 
-        mb.showerror(
+        super().__init__(self.message)
+        if current_thread() is main_thread():
+            self.show_and_exit()
+
+    def show_and_exit(self):
+        DIALOGS.showerror(
             title = "ERROR: CUHRTStructureSetException",
             message = self.message
         ) 
-        super().__init__(self.message)
         exit()
 
+
+class CUHRTOperationCancelled(Exception):
+    '''
+        Raised when a progress callback asks a long operation to stop. 
+    '''
+
+
+def unique_roi_name(label: str, taken: set) -> str:
+    '''
+        label, or "label (1)", "label (2)" etc. if already taken, as per 
+        GetUniqueRoiName. The name returned is added to taken. 
+    '''
+    name = label
+    k = 1
+    while name in taken:
+        name = f"{label} ({k})"
+        k += 1
+    taken.add(name)
+    return name
+
+
+def report_progress(progress, done: int, total: int, text: str = ""):
+    '''
+        Call progress(done, total, text), if given. Raises 
+        CUHRTOperationCancelled if it returns False. 
+    '''
+    if progress is not None and progress(done, total, text) is False:
+        raise CUHRTOperationCancelled(f"Cancelled at {text or done}.")
+
 class CUHRTROI(CUHGetCurrentStructureSetObject):
     ''' 
         Workhorse of ROILockTime script and other script tools.
@@ -78,6 +255,8 @@ class CUHRTROI(CUHGetCurrentStructureSetObject):
         Attributes: 
             • roi: dict 
                 label, volume, centroid, colour, contours, has_contours
+            • contour_source: callable (optional)
+                returns the contours of a CUHRTROI read from a snapshot file
 
         Methods: 
             • load_contours 
@@ -86,18 +265,35 @@ class CUHRTROI(CUHGetCurrentStructureSetObject):
                 opposite of above 
             • restore_contours
                 adds structures back in to current structure set from file
+            • local_volume_and_centroid
+                volume and centroid computed from the stored contours
+            • stored_contours
+                contours in memory or in the snapshot file, never RayStation
+            • fingerprint
+                geometry fingerprint of the contours, see 
+                modules/roi_fingerprint.py
             
     '''
 
-    def __init__(self, roi: dict, ):
+    def __init__(self, roi: dict, contour_source = None):
         super().__init__()
         self.roi = roi 
+        self.contour_source = contour_source
             
     def load_contours(self):
         '''
             Attempts to load contours into memory from RayStation get_current
             Patient Model object. 
+
+            If the CUHRTROI was read lazily from a snapshot file, the 
+            contours are read from the file instead. 
         '''
+        if self.contour_source is not None:
+            if 'contours' not in self.roi.keys():
+                self.roi['contours'] = self.contour_source()
+            self.roi['has_contours'] = bool(self.roi['contours'])
+            return
+
         roi = self.ss.RoiGeometries[self.roi['label']]
 
         try:
@@ -124,7 +320,9 @@ class CUHRTROI(CUHGetCurrentStructureSetObject):
         '''
         if 'contours' in self.roi.keys():
             self.roi.pop('contours') 
-            self.roi['has_contours'] = False
+            # Contours read from a snapshot file can be re-read on demand
+            if self.contour_source is None:
+                self.roi['has_contours'] = False
 
 
     def restore_contours(self):
@@ -134,6 +332,9 @@ class CUHRTROI(CUHGetCurrentStructureSetObject):
         '''        
         print(f"Attempting to recreate ROI: {self.roi['label']}")
 
+        if self.contour_source is not None:
+            self.load_contours()
+
         new_roi_name = self.case.PatientModel.GetUniqueRoiName(
             DesiredName = self.roi["label"]
             )
@@ -165,6 +366,52 @@ class CUHRTROI(CUHGetCurrentStructureSetObject):
                 f"{self.roi['label']}.")
             )
 
+    def fingerprint(self) -> dict:
+        '''
+            Geometry fingerprint of the contours, stored in roi. Read from 
+            the snapshot if it has one, else computed once from the 
+            contours, loading them for the duration if needed. None if the 
+            CUHRTROI has no contours. 
+        '''
+        if self.roi.get('fingerprint') is None:
+            loaded = 'contours' in self.roi
+            if not loaded:
+                self.load_contours()
+            contours = self.roi.get('contours')
+            self.roi['fingerprint'] = \
+                contour_fingerprint(contours) if contours else None
+            if not loaded:
+                self.unload_contours()
+        return self.roi['fingerprint']
+
+    def local_volume_and_centroid(self, slice_thickness: float = None):
+        '''
+            Volume [cc] and centroid [cm] computed from the stored contours, 
+            without a RayStation round trip. See modules/roi_geometry.py. 
+            Returns (None, None) if the CUHRTROI has no contours. 
+        '''
+        # Imported here so that NumPy is only needed for offline geometry
+        from modules.roi_geometry import roi_volume_and_centroid
+
+        contours = self.stored_contours()
+        if not contours:
+            return None, None
+
+        return roi_volume_and_centroid(
+            contours, slice_thickness = slice_thickness
+        )
+
+    def stored_contours(self) -> list:
+        '''
+            Contours held in memory, or read from the snapshot file, 
+            without touching RayStation. Returns None if there are none. 
+        '''
+        if 'contours' not in self.roi.keys():
+            if self.contour_source is None:
+                return None
+            self.load_contours()
+        return self.roi.get('contours')
+
     def compare_with_roi(self, roi2: str):
         '''
             Return comparison result for two CUHRTROI objects. 
@@ -212,12 +459,26 @@ class CUHRTCompareROI(CUHGetCurrentStructureSetObject):
             • centroid_match: bool
             • roi_comparison_results
                 - RayStation method of extracting Dice and Hausdorff distance
+                - or, if offline, computed from the stored contours 
+                - or, if identical, an exact match 
+            • identical: bool 
+                True if the geometry fingerprints of the rois match 
+
+        Kwargs: 
+            • offline: bool (default False)
+                compare the stored contours without RayStation 
+            • voxel_size: float [cm] (optional)
+                voxel size of the offline comparison grid 
+            • check_identical: bool (default False)
+                report rois with matching geometry fingerprints as an exact 
+                match, without comparing them 
         
         Methods:
             • return_formatted_dict
     '''
 
-    def __init__(self, roi1, roi2):
+    def __init__(self, roi1, roi2, offline: bool = False, 
+        voxel_size: float = None, check_identical: bool = False):
         super().__init__()
         self.reference_roi_label = roi1.roi['label']
         self.reference_roi_volume = roi1.roi['volume']
@@ -225,15 +486,24 @@ class CUHRTCompareROI(CUHGetCurrentStructureSetObject):
         self.compare_roi_label = roi2.roi['label']
         self.compare_roi_volume = roi2.roi['volume']
         self.compare_roi_centroid = roi2.roi['centroid']
-        self.volume_match = round(roi1.roi['volume'],1) == round(
-            roi2.roi['volume'],1)
-
-        deltas = [abs(delta)>0.1 for delta in [
-            roi1.roi['centroid']['x'] - roi2.roi['centroid']['x'],
-            roi1.roi['centroid']['y'] - roi2.roi['centroid']['y'],
-            roi1.roi['centroid']['z'] - roi2.roi['centroid']['z']
-        ]]
-        self.centroid_match = not any(deltas)
+        self.volume_match = volumes_match(
+            roi1.roi['volume'], roi2.roi['volume'])
+        self.centroid_match = centroids_match(
+            roi1.roi['centroid'], roi2.roi['centroid'])
+        self.identical = check_identical and fingerprints_match(
+            roi1.fingerprint(), roi2.fingerprint()
+        )
+
+        if self.identical:
+            self.roi_comparison_results = dict(EXACT_MATCH_RESULTS)
+            return
+
+        if offline:
+            self.roi_comparison_results = self._compare_offline(
+                roi1, roi2, voxel_size
+            )
+            return
+
         try:
             self.roi_comparison_results = self.ss.ComparisonOfRoiGeometries(
                 RoiA = roi1.roi['label'],
@@ -249,6 +519,26 @@ class CUHRTCompareROI(CUHGetCurrentStructureSetObject):
                 )
             )
     
+    @staticmethod
+    def _compare_offline(roi1, roi2, voxel_size: float = None) -> dict:
+        '''
+            ComparisonOfRoiGeometries equivalent from the stored contours, 
+            see modules/roi_overlap.py. 
+        '''
+        # Imported here so that NumPy is only needed for offline geometry
+        from modules.roi_overlap import compare_contours, DEFAULT_VOXEL_SIZE
+
+        contours1 = roi1.stored_contours()
+        contours2 = roi2.stored_contours()
+        if not contours1 or not contours2:
+            raise CUHRTStructureSetException(
+                message = ("ERROR: Offline comparison needs the contours of "
+                f"{roi1.roi['label']} and {roi2.roi['label']}.")
+            )
+        return compare_contours(
+            contours1, contours2, voxel_size = voxel_size or DEFAULT_VOXEL_SIZE
+        )
+
     def return_formatted_dict(self) -> dict: 
         '''
             Returns a nicely formatted dict of CUHRTCompareROI object 
@@ -270,6 +560,7 @@ class CUHRTCompareROI(CUHGetCurrentStructureSetObject):
             'MaxDistanceToAgreement': self.roi_comparison_results[
                 'MaxDistanceToAgreement'
             ],
+            'Identical Geometry': self.identical,
         }
 
 class CUHRTStructureSet(CUHGetCurrentStructureSetObject):
@@ -280,34 +571,70 @@ class CUHRTStructureSet(CUHGetCurrentStructureSetObject):
             • SubStructureSet object 
             • JSON export
 
+        Kwargs: 
+            • load_rois: bool (default True)
+                if False, only the reviewer and locktime are read from the 
+                SubStructureSet. Call load_rois before using rois. 
+
         Attributes:
             • locktime 
             • reviewer
             • f_name 
             • rois: list 
                 list of CUHRTROI objects 
+            • export_stats: dict 
+                f_path, rois_written, bytes_written, peak_memory_bytes and 
+                simplification of the last export 
+            • restore_stats: dict 
+                restored, failures and per-stage timings of the last restore 
 
         Methods:
+            • load_rois
+                builds the list of CUHRTROI objects, if not already built
             • json_export
                 exports rudimentary structure set data to json 
+            • binary_export
+                as above, but to the compact binary snapshot format
+            • store_export
+                as above, but to the deduplicated snapshot store 
             • restore_all_contours
                 restore all contours in CUHRTStructureSet object
+            • restore_selected_contours
+                restore the contours of the rois at a list of indices
+            • batch_restore_contours
+                restore the contours of a list of CUHRTROI objects, stage 
+                by stage, collecting failures 
+            • compare_offline
+                compare stored contours with a reference, without RayStation
+            • identical_rois
+                pairs of rois whose geometry matches a reference exactly
 
 
     '''
 
-    def __init__(self, sub_structure_set = None, f_path = None, ):
+    def __init__(self, sub_structure_set = None, f_path = None, 
+        load_rois: bool = True):
         super().__init__()
+        self.export_stats = None 
+        self.restore_stats = None 
 
         if f_path:
             try: 
-                with open(path.normpath(f_path), 'r', encoding='utf-8') as f:
-                    data = load(f)
+                # Only the metadata is read here, the contours of each ROI 
+                # are read from the file the first time they are needed.
+                self.snapshot = SnapshotReader(path.normpath(f_path))
+                data = self.snapshot.data
                 self.locktime = data['locktime']
                 self.reviewer = data['reviewer']
                 self.f_name = path.split(f_path)[-1]
+                self._sub_structure_set = None
                 self.rois = [
-                    CUHRTROI(roi=roi) for roi in data['rois']
+                    CUHRTROI(
+                        roi = roi, 
+                        contour_source = partial(
+                            self.snapshot.read_contours, i
+                        ) if self.snapshot.lazy else None
+                    ) for i, roi in enumerate(data['rois'])
                 ]
             except Exception as err:
                 raise CUHRTStructureSetException(
@@ -343,22 +670,10 @@ class CUHRTStructureSet(CUHGetCurrentStructureSetObject):
                     ]
                 )
 
-            self.rois = [
-                CUHRTROI(
-                    roi = {
-                        'label':roi.OfRoi.Name,
-                        'colour': ", ".join(
-                            [str(rgb_val) for rgb_val in[
-                            roi.OfRoi.Color.get_A(), roi.OfRoi.Color.get_R(),
-                            roi.OfRoi.Color.get_G(), roi.OfRoi.Color.get_B(),
-                         ]]),
-                        'centroid': roi.GetCenterOfRoi(), 
-                        'volume': roi.GetRoiVolume(), 
-                        'has_contours': False
-                    },
-                ) for roi in sub_structure_set.RoiStructures
-                if roi.HasContours()
-            ]
+            self._sub_structure_set = sub_structure_set
+            self.rois = None 
+            if load_rois:
+                self.load_rois()
 
         else:
             raise CUHRTStructureSetException(
@@ -368,7 +683,152 @@ class CUHRTStructureSet(CUHGetCurrentStructureSetObject):
                 ))
 
 
-    def json_export(self, f_out: str, include_contours: bool = False):
+    @property
+    def sub_structure_set(self):
+        '''
+            The SubStructureSet scripting object, timed while TIMINGS is on. 
+        '''
+        return TIMINGS.wrap(self._sub_structure_set, "SubStructureSets[]")
+
+    @property
+    def rois_loaded(self) -> bool:
+        return self.rois is not None
+
+    def load_rois(self):
+        '''
+            Build the CUHRTROI summaries (volume, centroid, colour) from the 
+            SubStructureSet object. Does nothing if already loaded. 
+        '''
+        if self.rois_loaded:
+            return self.rois
+
+        self.rois = [
+            CUHRTROI(
+                roi = {
+                    'label':roi.OfRoi.Name,
+                    'colour': ", ".join(
+                        [str(rgb_val) for rgb_val in[
+                        roi.OfRoi.Color.get_A(), roi.OfRoi.Color.get_R(),
+                        roi.OfRoi.Color.get_G(), roi.OfRoi.Color.get_B(),
+                     ]]),
+                    'centroid': roi.GetCenterOfRoi(), 
+                    'volume': roi.GetRoiVolume(), 
+                    'has_contours': False
+                },
+            ) for roi in self.sub_structure_set.RoiStructures
+            if roi.HasContours()
+        ]
+        return self.rois
+
+    def _load_or_unload_contours(self, include_contours: bool, 
+        progress = None):
+        for i, roi in enumerate(self.rois):
+            report_progress(progress, i, len(self.rois), roi.roi['label'])
+            if include_contours:
+                roi.load_contours() 
+                roi.fingerprint()
+            else: 
+                roi.unload_contours()
+        report_progress(progress, len(self.rois), len(self.rois))
+
+    def export_f_name(self, extension: str = ".json") -> str:
+        '''
+            Returns f_name with its extension swapped for extension. 
+        '''
+        return path.splitext(self.f_name)[0] + extension
+
+    def _export_stats(self, f_path: str, rois_written: int, 
+        peak_memory_bytes: int = None, simplification: list = None, 
+        store_stats: dict = None) -> dict:
+        '''
+            Record, print and return the cost of the last export. 
+        '''
+        self.export_stats = {
+            'f_path': f_path,
+            'rois_written': rois_written,
+            'bytes_written': path.getsize(f_path),
+            'peak_memory_bytes': peak_memory_bytes,
+            'simplification': simplification or [],
+        }
+        if store_stats:
+            self.export_stats.update(store_stats)
+            self.export_stats['bytes_written'] += \
+                store_stats['blob_bytes_written']
+        print(
+            f"Exported {rois_written} ROIs to {f_path}: "
+            f"{format_bytes(self.export_stats['bytes_written'])} written, "
+            "peak memory "
+            f"{format_bytes(self.export_stats['peak_memory_bytes'])}."
+        )
+        if store_stats:
+            print(
+                f"{store_stats['blobs_written']} contour blobs written, "
+                f"{store_stats['blobs_skipped']} already stored."
+            )
+        for stats in self.export_stats['simplification']:
+            if stats['simplified']:
+                print(
+                    f"Simplified ROI: {stats['label']} from "
+                    f"{stats['points_before']} to {stats['points_after']} "
+                    "points."
+                )
+            else:
+                print(
+                    f"Kept all points of ROI: {stats['label']}, simplified "
+                    f"{stats['reason']}."
+                )
+        return self.export_stats
+
+    @staticmethod
+    def _export_roi(roi, simplify_tolerance_mm: float = None, 
+        simplification: list = None) -> dict:
+        '''
+            The roi dict to write. If simplify_tolerance_mm, a copy with the 
+            contours simplified, see modules/contour_simplify.py, and the 
+            outcome appended to simplification. The copy has the fingerprint 
+            of the simplified contours, so that they are not taken to be 
+            identical to the originals. 
+        '''
+        if not simplify_tolerance_mm or not roi.roi.get('contours'):
+            return roi.roi
+
+        # Imported here so that NumPy is only needed for simplification
+        from modules.contour_simplify import simplify_roi_contours
+
+        contours, stats = simplify_roi_contours(
+            roi.roi['contours'], simplify_tolerance_mm
+        )
+        stats['label'] = roi.roi['label']
+        if simplification is not None:
+            simplification.append(stats)
+        if not stats['simplified']:
+            return roi.roi
+        return dict(
+            roi.roi, contours = contours, 
+            fingerprint = contour_fingerprint(contours)
+        )
+
+    def _streamed_rois(self, include_contours: bool, progress = None, 
+        simplify_tolerance_mm: float = None, simplification: list = None):
+        '''
+            Yields each roi dict with its contours loaded, if requested, 
+            and unloads them again once the caller has written them. 
+        '''
+        for i, roi in enumerate(self.rois):
+            report_progress(progress, i, len(self.rois), roi.roi['label'])
+            if include_contours:
+                roi.load_contours()
+                roi.fingerprint()
+            else:
+                roi.unload_contours()
+            yield self._export_roi(roi, simplify_tolerance_mm, simplification)
+            roi.unload_contours()
+        report_progress(progress, len(self.rois), len(self.rois))
+
+    @TIMINGS.timed_function("json_export")
+    def json_export(self, f_out: str, include_contours: bool = False, 
+        stream: bool = False, progress = None, 
+        simplify_tolerance_mm: float = None) -> dict:
         '''
             Write contents of CUHRTStructureSet to 
             JSON.
@@ -376,39 +836,427 @@ class CUHRTStructureSet(CUHGetCurrentStructureSetObject):
             Params:
                 f_out: path to output json data. 
                 include_contours: bool 
-             
+                stream: bool 
+                    load, write and unload the contours one ROI at a time, 
+                    so peak memory is bounded by the largest ROI. 
+                progress: function(done, total, text) (optional) 
+                    called per ROI, return False to cancel the export. 
+                simplify_tolerance_mm: float (optional) 
+                    simplify the exported contours to this tolerance, 
+                    if their volume and centroid stay within tolerance. 
+
+            Returns dict of export_stats: f_path, rois_written, 
+            bytes_written, peak_memory_bytes, the peak growth of the 
+            process RSS during the export (see modules/memory_usage.py), 
+            and simplification, the outcome for each ROI with contours if 
+            simplified. 
         '''
+        f_path = path.normpath(path.join(f_out, self.export_f_name(".json")))
+        simplification = []
 
-        if include_contours:
-            for roi in self.rois:
-                roi.load_contours() 
-        else: 
-            for roi in self.rois:
-                roi.unload_contours()
- 
-        json_data_out = {
+        with CUHPeakMemory() as memory:
+            try: 
+                if stream:
+                    self._stream_json(
+                        f_path, include_contours, progress, 
+                        simplify_tolerance_mm, simplification
+                    )
+                else:
+                    self._load_or_unload_contours(include_contours, progress)
+         
+                    json_data_out = {
+                        "f_name" : self.f_name,
+                        "locktime" : self.locktime,
+                        "reviewer" : self.reviewer,
+                        "rois": [
+                            self._export_roi(
+                                roi, simplify_tolerance_mm, simplification
+                            ) for roi in self.rois
+                        ]
+                    }
+
+                    with open(f_path, 'w',encoding='utf-8') as f:
+                        dump(json_data_out, f, indent=4, sort_keys=True) 
+            except CUHRTOperationCancelled:
+                self._remove_partial_export(f_path)
+                raise
+            except Exception as err:
+                raise CUHRTStructureSetException(
+                    error = err, 
+                    message = (
+                        "Could not write RT SS to json.\n"
+                    )
+                ) 
+
+            return self._export_stats(
+                f_path, len(self.rois), memory.peak_bytes, simplification
+            )
+
+    @staticmethod
+    def _remove_partial_export(f_path: str):
+        if path.exists(f_path):
+            remove(f_path)
+
+    def _stream_json(self, f_path: str, include_contours: bool, 
+        progress = None, simplify_tolerance_mm: float = None, 
+        simplification: list = None):
+        '''
+            Writes a json snapshot with a TOC, one ROI at a time. 
+        '''
+        header = {
             "f_name" : self.f_name,
             "locktime" : self.locktime,
             "reviewer" : self.reviewer,
-            "rois": [roi.roi for roi in self.rois]
         }
-
-        try: 
-            with open(path.normpath(path.join(f_out, self.f_name)), 
-            'w',encoding='utf-8') as f:
-                dump(json_data_out, f, indent=4, sort_keys=True) 
-        except Exception as err:
-            raise CUHRTStructureSetException(
-                error = err, 
-                message = (
-                    "Could not write RT SS to json.\n"
+        with open(f_path, 'wb') as f:
+            write_json_snapshot(
+                f, header, [roi.roi for roi in self.rois], 
+                self._streamed_rois(
+                    include_contours, progress, 
+                    simplify_tolerance_mm, simplification
                 )
-            ) 
+            )
+
+    @TIMINGS.timed_function("binary_export")
+    def binary_export(self, f_out: str, include_contours: bool = False, 
+        compression: str = "zlib", dtype: str = "float64", 
+        stream: bool = False, progress = None, 
+        simplify_tolerance_mm: float = None) -> dict:
+        '''
+            Write contents of CUHRTStructureSet to the compact binary 
+            snapshot format, see modules/snapshot_io.py. 
+
+            Params:
+                f_out: path to output data. 
+                include_contours: bool 
+                compression: "none", "zlib" or "lzma" 
+                dtype: "float64" or "float32" contour points, or 
+                    "quantized" to 0.01mm and delta encoded
+                stream: bool 
+                    as per json_export 
+                progress: function(done, total, text) (optional) 
+                    as per json_export 
+                simplify_tolerance_mm: float (optional) 
+                    as per json_export 
+
+            Returns dict of export_stats, as per json_export. 
+        '''
+        f_path = path.normpath(
+            path.join(f_out, self.export_f_name(SNAPSHOT_EXTENSION))
+        )
+        header = {
+            "f_name" : self.export_f_name(SNAPSHOT_EXTENSION),
+            "locktime" : self.locktime,
+            "reviewer" : self.reviewer,
+        }
+        simplification = []
 
-    def restore_all_contours(self):
+        with CUHPeakMemory() as memory:
+            try: 
+                with open(f_path, 'wb') as f:
+                    if stream:
+                        write_binary_header(
+                            f, header, [roi.roi for roi in self.rois], 
+                            compression = compression, dtype = dtype
+                        )
+                        # Fingerprints of the contours written, which may 
+                        # have been simplified 
+                        toc, fingerprints = [], []
+                        for roi in self._streamed_rois(
+                            include_contours, progress, 
+                            simplify_tolerance_mm, simplification):
+                            toc.append(write_binary_roi_block(
+                                f, roi, compression = compression, dtype = dtype
+                            ))
+                            fingerprints.append(roi.get('fingerprint'))
+                        write_binary_toc(
+                            f, toc, fingerprints, compression = compression
+                        )
+                    else:
+                        self._load_or_unload_contours(include_contours, progress)
+                        write_binary_snapshot(
+                            f, header, [
+                                self._export_roi(
+                                    roi, simplify_tolerance_mm, simplification
+                                ) for roi in self.rois
+                            ], 
+                            compression = compression, dtype = dtype
+                        ) 
+            except CUHRTOperationCancelled:
+                self._remove_partial_export(f_path)
+                raise
+            except Exception as err:
+                raise CUHRTStructureSetException(
+                    error = err, 
+                    message = (
+                        "Could not write RT SS to binary snapshot.\n"
+                    )
+                ) 
+
+            return self._export_stats(
+                f_path, len(self.rois), memory.peak_bytes, simplification
+            )
+
+    @TIMINGS.timed_function("store_export")
+    def store_export(self, f_out: str, compression: str = "zlib", 
+        dtype: str = "quantized", progress = None, 
+        simplify_tolerance_mm: float = None) -> dict:
+        '''
+            Write contents of CUHRTStructureSet, with contours, to the 
+            deduplicated snapshot store at f_out: a small manifest, plus a 
+            blob per ROI geometry that is only written if no earlier export 
+            stored the same one. See modules/snapshot_io.py. 
+
+            Params:
+                f_out: path to the store, blobs are kept in f_out/blobs 
+                compression, dtype: as per binary_export 
+                progress, simplify_tolerance_mm: as per json_export 
+
+            Returns dict of export_stats, as per json_export, plus 
+            blobs_written, blobs_skipped and blob_bytes_written. 
+        '''
+        f_path = path.normpath(
+            path.join(f_out, self.export_f_name(MANIFEST_EXTENSION))
+        )
+        header = {
+            "f_name" : self.export_f_name(MANIFEST_EXTENSION),
+            "locktime" : self.locktime,
+            "reviewer" : self.reviewer,
+        }
+        simplification = []
+
+        with CUHPeakMemory() as memory:
+            try: 
+                with open(f_path, 'wb') as f:
+                    store_stats = write_manifest_snapshot(
+                        f, CUHBlobStore(path.join(f_out, BLOB_DIR)), header, 
+                        [roi.roi for roi in self.rois], 
+                        self._streamed_rois(
+                            True, progress, simplify_tolerance_mm, simplification
+                        ), 
+                        compression = compression, dtype = dtype
+                    )
+            except CUHRTOperationCancelled:
+                self._remove_partial_export(f_path)
+                raise
+            except Exception as err:
+                raise CUHRTStructureSetException(
+                    error = err, 
+                    message = (
+                        "Could not write RT SS to the snapshot store.\n"
+                    )
+                ) 
+
+            return self._export_stats(
+                f_path, len(self.rois), memory.peak_bytes, simplification, 
+                store_stats
+            )
+
+    def compare_offline(self, reference_structure_set, 
+        voxel_size: float = None) -> list:
+        '''
+            Compare the stored contours of every ROI with the ROI of the 
+            same label in reference_structure_set, without RayStation. 
+            ROIs with matching geometry fingerprints are reported as exact 
+            matches without comparing them. 
+            Returns a list of CUHRTCompareROI objects. 
+        '''
+        reference_rois = {
+            roi.roi['label']: roi for roi in reference_structure_set.rois
+        }
+        return [
+            CUHRTCompareROI(
+                reference_rois[roi.roi['label']], roi, 
+                offline = True, voxel_size = voxel_size, 
+                check_identical = True
+            ) for roi in self.rois
+            if roi.roi['label'] in reference_rois 
+            and roi.roi.get('has_contours') 
+            and reference_rois[roi.roi['label']].roi.get('has_contours')
+        ]
+
+    def identical_rois(self, reference_structure_set, pairs: list, 
+        progress = None) -> list:
+        '''
+            The (index, reference index) pairs, into rois and 
+            reference_structure_set.rois, whose geometry fingerprints match. 
+            The contours of current rois are loaded for their fingerprint 
+            and unloaded again. 
+        '''
+        identical = []
+        for k, (i, j) in enumerate(pairs):
+            roi = self.rois[i]
+            report_progress(progress, k, len(pairs), roi.roi['label'])
+            if fingerprints_match(
+                roi.fingerprint(), 
+                reference_structure_set.rois[j].fingerprint()):
+                identical.append((i, j))
+        report_progress(progress, len(pairs), len(pairs))
+        return identical
+
+    def restore_all_contours(self, progress = None) -> dict:
         '''
             Restore all contours in CUHRTStructureSet object.
+
+            progress: function(done, total, text) (optional) 
+                called per ROI and stage, return False to stop restoring. 
+
+            Returns restore_stats, see batch_restore_contours. 
+        '''
+        return self.batch_restore_contours(progress = progress)
+
+    def restore_selected_contours(self, indices: list, 
+        progress = None) -> dict:
+        '''
+            Restore only the rois at indices, e.g. those that failed the 
+            volume and centroid check. For snapshots with a table of 
+            contents, only their contours are read from file. 
+
+            Returns restore_stats, see batch_restore_contours. 
+        '''
+        return self.batch_restore_contours(
+            [
+                self.rois[i] for i in sorted(set(indices)) 
+                if self.rois[i].roi['has_contours']
+            ], 
+            progress = progress
+        )
+
+    def batch_restore_contours(self, rois: list = None, 
+        progress = None) -> dict:
+        '''
+            Restore the contours of rois (default: every CUHRTROI with 
+            contours) onto the current examination, one stage at a time 
+            for all ROIs: 
+                1. read contours 
+                2. resolve names, from one read of the existing ROI names 
+                3. create rois 
+                4. create geometry, a voxel box converted to contours 
+                5. set contours 
+
+            A ROI that fails a stage is recorded and left out of the later 
+            stages, rather than stopping the restore. A ROI created for one 
+            that then fails is deleted, so no empty or partial ROI is left 
+            in the case; if it cannot be deleted it is reported as left 
+            behind. 
+
+            Returns restore_stats: dict 
+                • restored: list of (label, new roi name) 
+                • failures: list of (label, stage, error) 
+                • deleted: list of (label, new roi name) of failed rois 
+                • left_behind: list of (label, new roi name, error) of 
+                    failed rois that could not be deleted 
+                • timings: {stage: seconds} 
+        '''
+        if rois is None:
+            rois = [roi for roi in self.rois if roi.roi['has_contours']]
+
+        patient_model = self.case.PatientModel
+        exam = self.exam
+        ss = self.ss
+        names = {}
+        created = []
+        stats = {
+            'restored': [], 'failures': [], 'deleted': [], 'left_behind': [], 
+            'timings': {}
+        }
+
+        def read_contours(roi):
+            if roi.contour_source is not None:
+                roi.load_contours()
+            if not roi.roi.get('contours'):
+                raise ValueError("no contours")
+
+        taken = set()
+
+        def resolve_name(roi):
+            names[roi] = unique_roi_name(roi.roi['label'], taken)
+
+        def create_roi(roi):
+            patient_model.CreateRoi(
+                Name = names[roi], Type = "Undefined", 
+                Color = roi.roi['colour'],
+            )
+            created.append(roi)
+
+        def create_geometry(roi):
+            patient_model.RegionsOfInterest[names[roi]].CreateBoxGeometry(
+                Size={"x":2,"y":2,"z":2},Examination = exam,
+                Center = {"x":0,"y":0,"z":0},Representation = 'Voxels',
+                VoxelSize = None
+            )
+            ss.RoiGeometries[names[roi]].SetRepresentation(
+                Representation = "Contours"
+            )
+
+        def set_contours(roi):
+            ss.RoiGeometries[names[roi]].PrimaryShape.Contours = \
+                roi.roi['contours']
+            if roi.contour_source is not None:
+                roi.unload_contours()
+
+        stages = (
+            ("read contours", read_contours),
+            ("resolve names", resolve_name),
+            ("create rois", create_roi),
+            ("create geometry", create_geometry),
+            ("set contours", set_contours),
+        )
+        total = len(stages) * len(rois)
+        for i, (stage, func) in enumerate(stages):
+            start = perf_counter()
+            if stage == "resolve names":
+                taken.update(
+                    roi.Name for roi in patient_model.RegionsOfInterest
+                )
+            passed = []
+            for j, roi in enumerate(rois):
+                report_progress(
+                    progress, i * len(rois) + j, total, 
+                    f"{stage}: {roi.roi['label']}"
+                )
+                try:
+                    func(roi)
+                    passed.append(roi)
+                except Exception as err:
+                    stats['failures'].append((roi.roi['label'], stage, str(err)))
+            rois = passed
+            stats['timings'][stage] = perf_counter() - start
+
+        start = perf_counter()
+        for roi in created:
+            if roi in rois:
+                continue
+            try:
+                patient_model.RegionsOfInterest[names[roi]].DeleteRoi()
+                stats['deleted'].append((roi.roi['label'], names[roi]))
+            except Exception as err:
+                stats['left_behind'].append(
+                    (roi.roi['label'], names[roi], str(err))
+                )
+        stats['timings']["delete failed rois"] = perf_counter() - start
+        report_progress(progress, total, total)
+
+        stats['restored'] = [(roi.roi['label'], names[roi]) for roi in rois]
+        return self._restore_stats(stats)
+
+    def _restore_stats(self, stats: dict) -> dict:
+        '''
+            Record, print and return the outcome of the last restore. 
         '''
-        for roi in self.rois:
-            if roi.roi['has_contours']: 
-                roi.restore_contours() 
+        self.restore_stats = stats
+        print(
+            f"Restored {len(stats['restored'])} ROIs, "
+            f"{len(stats['failures'])} failed. " + ", ".join(
+                f"{stage} {seconds:.2f}s" 
+                for stage, seconds in stats['timings'].items()
+            )
+        )
+        for label, stage, error in stats['failures']:
+            print(f"Failed to restore ROI: {label} ({stage}): {error}")
+        for label, name, error in stats.get('left_behind', []):
+            print(
+                f"Could not delete ROI {name}, created for {label}, "
+                f"left in the case: {error}"
+            )
+        return stats 
@@ -0,0 +1,192 @@
+'''
+Surface distance to agreement from stored contour points.
+
+The contour vertices of each ROI are treated as a sampled surface. For
+every point of one ROI the distance to the nearest point of the other is
+found through a uniform grid hash, searching shells of cells outwards
+until no closer point can exist, so queries cost roughly O(n log n)
+rather than all-pairs. A brute force path is kept as the reference.
+
+With the same keys as RayStation's ComparisonOfRoiGeometries:
+    • MeanDistanceToAgreement: mean of the nearest distances in both
+      directions, A to B and B to A
+    • MaxDistanceToAgreement: the largest of these, i.e. the Hausdorff
+      distance
+
+Distances are in cm. As only the contour vertices are used, sparse
+contours will slightly over-estimate the distances.
+
+Requires NumPy.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import numpy as np
+
+# Grid shells searched before falling back to brute force
+MAX_SHELLS = 8
+# Upper limit of point pairs held in memory at once
+CHUNK_PAIRS = 2_000_000
+
+
+def _shell_offsets(r: int) -> np.ndarray:
+    '''
+        Integer cell offsets at Chebyshev distance r.
+    '''
+    rng = np.arange(-r, r + 1)
+    offsets = np.stack(np.meshgrid(rng, rng, rng, indexing='ij'), -1)
+    offsets = offsets.reshape(-1, 3)
+    return offsets[np.abs(offsets).max(axis=1) == r]
+
+
+def brute_force_nearest_distances(queries: np.ndarray,
+    points: np.ndarray) -> np.ndarray:
+    '''
+        Distance from every query to its nearest point, all pairs.
+    '''
+    distances = np.empty(len(queries))
+    chunk = max(1, CHUNK_PAIRS // max(len(points), 1))
+    for start in range(0, len(queries), chunk):
+        q = queries[start:start + chunk]
+        d2 = ((q[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+        distances[start:start + chunk] = np.sqrt(d2.min(axis=1))
+    return distances
+
+
+class PointGridIndex():
+    '''
+        Uniform grid hash of a (n_points, 3) point cloud.
+
+        Attributes:
+            • points: points sorted by cell
+            • cell_size: float [cm]
+
+        Methods:
+            • nearest_distances(queries)
+    '''
+
+    def __init__(self, points: np.ndarray, cell_size: float = None,
+        points_per_cell: int = 4):
+        points = np.asarray(points, dtype=np.float64)
+        self.lo = points.min(axis=0)
+        extent = np.maximum(points.max(axis=0) - self.lo, 1e-6)
+
+        if cell_size is None:
+            # Contour points sample a surface, so size the cells by the
+            # bounding box surface area rather than its volume
+            area = 2 * (extent[0]*extent[1] + extent[1]*extent[2]
+                + extent[0]*extent[2])
+            cell_size = np.sqrt(points_per_cell * area / len(points))
+        self.cell_size = float(cell_size)
+
+        self.dims = np.floor(extent / self.cell_size).astype(np.int64) + 1
+        keys = self._keys(self._cells(points))
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.points = points[order]
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.lo) / self.cell_size).astype(np.int64)
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[..., 0] * self.dims[1] + cells[..., 1]) \
+            * self.dims[2] + cells[..., 2]
+
+    def _search_shell(self, queries: np.ndarray, best: np.ndarray, r: int):
+        '''
+            Update best with the points in the cells at shell r around each
+            query.
+        '''
+        offsets = _shell_offsets(r)
+        cells = self._cells(queries)[:, None, :] + offsets[None, :, :]
+        inside = np.all((cells >= 0) & (cells < self.dims), axis=2)
+        query_index, _ = np.nonzero(inside)
+        keys = self._keys(cells[inside])
+
+        start = np.searchsorted(self.keys, keys, side='left')
+        counts = np.searchsorted(self.keys, keys, side='right') - start
+        total = counts.sum()
+        if not total:
+            return
+
+        pair_query = np.repeat(query_index, counts)
+        pair_point = np.repeat(start - np.cumsum(counts) + counts, counts) \
+            + np.arange(total)
+        d2 = ((queries[pair_query] - self.points[pair_point]) ** 2).sum(axis=1)
+
+        # pair_query is sorted, so reduce each query's run of pairs at once
+        first = np.flatnonzero(np.r_[True, pair_query[1:] != pair_query[:-1]])
+        owner = pair_query[first]
+        best[owner] = np.minimum(
+            best[owner], np.sqrt(np.minimum.reduceat(d2, first))
+        )
+
+    def nearest_distances(self, queries: np.ndarray) -> np.ndarray:
+        '''
+            Distance from every query to its nearest indexed point.
+        '''
+        queries = np.asarray(queries, dtype=np.float64)
+        best = np.full(len(queries), np.inf)
+        pending = np.arange(len(queries))
+
+        for r in range(MAX_SHELLS + 1):
+            if not len(pending):
+                break
+            chunk = max(1, CHUNK_PAIRS // (16 * len(_shell_offsets(r))))
+            for start in range(0, len(pending), chunk):
+                index = pending[start:start + chunk]
+                sub_best = best[index]
+                self._search_shell(queries[index], sub_best, r)
+                best[index] = sub_best
+            # Points beyond shell r are at least this far from the query
+            frac = (queries[pending] - self.lo) / self.cell_size % 1
+            reach = (r + np.minimum(frac, 1 - frac).min(axis=1)) \
+                * self.cell_size
+            pending = pending[best[pending] > reach]
+            if r >= self.dims.max():
+                # Every cell has been searched around queries inside the
+                # grid. Those outside it, e.g. of a distant disjoint ROI,
+                # may not have reached any cell yet.
+                cells = self._cells(queries[pending])
+                inside = np.all((cells >= 0) & (cells < self.dims), axis=1)
+                pending = pending[~inside]
+                break
+
+        if len(pending):
+            best[pending] = brute_force_nearest_distances(
+                queries[pending], self.points
+            )
+        return best
+
+
+def nearest_distances(queries: np.ndarray, points: np.ndarray,
+    method: str = "grid") -> np.ndarray:
+    '''
+        Distance from every query to its nearest point.
+        method: "grid" (default) or "brute_force".
+    '''
+    if method == "brute_force":
+        return brute_force_nearest_distances(queries, points)
+    return PointGridIndex(points).nearest_distances(queries)
+
+
+def surface_distance_metrics(points_a: np.ndarray, points_b: np.ndarray,
+    method: str = "grid") -> dict:
+    '''
+        Mean and max (Hausdorff) distance to agreement between two
+        (n_points, 3) contour point clouds [cm].
+    '''
+    if not len(points_a) or not len(points_b):
+        return {
+            'MeanDistanceToAgreement': None,
+            'MaxDistanceToAgreement': None,
+        }
+    a_to_b = nearest_distances(points_a, points_b, method)
+    b_to_a = nearest_distances(points_b, points_a, method)
+    both = np.concatenate([a_to_b, b_to_a])
+    return {
+        'MeanDistanceToAgreement': float(both.mean()),
+        'MaxDistanceToAgreement': float(both.max()),
+    }
@@ -0,0 +1,276 @@
+'''
+Headless ROILockTime check of a folder of structure set snapshots, without
+RayStation or Tk.
+
+Snapshots are grouped by the patient ID of their file name,
+PatientID+Reviewer+locktime+.ext. For each patient the latest approval is
+checked against the approval before it or, with --reference-reviewer,
+against the latest approval by that reviewer (e.g. the Dr approval). Rows
+are matched as per ROILockTimeWindow and given the same volume & centroid
+result. With --geometry, the stored contours of each matched pair are
+also compared offline (Dice, precision, sensitivity, specificity and
+distance to agreement). Identical fingerprints are reported as an exact
+match without comparing the contours.
+
+Patients are checked in parallel by a pool of worker processes and the
+results written to one CSV report.
+
+Usage, from the repository root:
+    python roi_lock_time_batch.py SNAPSHOT_DIR [-o report.csv]
+        [--reference-reviewer NAME] [--geometry] [--workers N]
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from csv import DictWriter
+from os import path, scandir
+from time import perf_counter
+from types import SimpleNamespace
+
+from modules.roi_fingerprint import EXACT_MATCH_RESULTS, fingerprints_match
+from modules.roi_tolerance import CUHRTToleranceMatrix
+from modules.snapshot_catalog import locktime_iso, parse_snapshot_name
+from modules.snapshot_io import (
+    EXTENSION as SNAPSHOT_EXTENSION, MANIFEST_EXTENSION, SnapshotReader
+)
+
+# Use each reference ROI at most once when auto-matching rows
+ONE_TO_ONE_MATCHING = False
+# Preferred format where one approval was exported more than once
+FORMAT_PREFERENCE = (MANIFEST_EXTENSION, SNAPSHOT_EXTENSION, ".json")
+
+HEADERS = (
+    'Patient ID', 'Reference SS', 'Current SS',
+    'Current ROI Label', 'Current ROI Volume [cc]',
+    'Current ROI Centroid [cm]', 'Reference ROI Label',
+    'Reference ROI Volume [cc]', 'Reference ROI Centroid [cm]',
+    'Check Result', 'DICE', 'Precision', 'Sensitivity', 'Specificity',
+    'MeanDistanceToAgreement', 'MaxDistanceToAgreement',
+    'Identical Geometry', 'Error',
+)
+
+
+def find_snapshot_pairs(root: str, reference_reviewer: str = None) -> list:
+    '''
+        (patient_id, reference path, current path) for every patient in
+        root with two or more approved snapshots.
+
+        The current snapshot is the latest approval. The reference is the
+        approval before it or, if reference_reviewer is given, the latest
+        earlier approval whose reviewer contains it (case insensitive).
+    '''
+    approvals = defaultdict(dict)
+    for entry in scandir(root):
+        parsed = parse_snapshot_name(entry.name) if entry.is_file() else None
+        if parsed is None:
+            continue
+        patient_id, reviewer, locktime, extension = parsed
+        approved = locktime_iso(locktime)
+        if approved is None:
+            continue
+        key = (approved, reviewer)
+        known = approvals[patient_id].get(key)
+        if known is None or FORMAT_PREFERENCE.index(extension) \
+            < FORMAT_PREFERENCE.index(path.splitext(known)[1].lower()):
+            approvals[patient_id][key] = entry.path
+
+    pairs = []
+    for patient_id in sorted(approvals):
+        ordered = sorted(approvals[patient_id].items())
+        if len(ordered) < 2:
+            continue
+        current = ordered[-1]
+        if reference_reviewer is None:
+            reference = ordered[-2]
+        else:
+            candidates = [
+                x for x in ordered[:-1]
+                if reference_reviewer.lower() in x[0][1].lower()
+            ]
+            if not candidates:
+                continue
+            reference = candidates[-1]
+        pairs.append((patient_id, reference[1], current[1]))
+    return pairs
+
+
+def _compare_geometry(reference: SnapshotReader, current: SnapshotReader,
+    j: int, i: int, voxel_size: float = None) -> tuple:
+    '''
+        (roi_comparison_results, identical) of current ROI i and reference
+        ROI j, from their stored contours.
+    '''
+    fingerprint1 = reference.data['rois'][j].get('fingerprint')
+    fingerprint2 = current.data['rois'][i].get('fingerprint')
+    if fingerprints_match(fingerprint1, fingerprint2):
+        return dict(EXACT_MATCH_RESULTS), True
+
+    # Imported here so that the overlap engine is only loaded if needed
+    from modules.roi_overlap import compare_contours, DEFAULT_VOXEL_SIZE
+
+    contours1 = reference.read_contours(j)
+    contours2 = current.read_contours(i)
+    if not contours1 or not contours2:
+        return {}, False
+    return compare_contours(
+        contours1, contours2, voxel_size = voxel_size or DEFAULT_VOXEL_SIZE
+    ), False
+
+
+def check_snapshot_pair(pair: tuple, geometry: bool = False,
+    voxel_size: float = None) -> list:
+    '''
+        Report rows for one (patient_id, reference path, current path).
+        Errors are reported in a single row rather than raised, so that
+        one bad snapshot does not stop the batch.
+    '''
+    patient_id, reference_path, current_path = pair
+    base = {
+        'Patient ID': patient_id,
+        'Reference SS': path.basename(reference_path),
+        'Current SS': path.basename(current_path),
+    }
+    try:
+        reference = SnapshotReader(reference_path)
+        current = SnapshotReader(current_path)
+        reference_rois = [
+            SimpleNamespace(roi = roi) for roi in reference.data['rois']
+        ]
+        current_rois = [
+            SimpleNamespace(roi = roi) for roi in current.data['rois']
+        ]
+        matrix = CUHRTToleranceMatrix(current_rois, reference_rois)
+        indices = matrix.matching_indices(
+            one_to_one = ONE_TO_ONE_MATCHING, default = None
+        )
+
+        rows = []
+        for i, (roi, j) in enumerate(zip(current_rois, indices)):
+            row = dict(base)
+            row.update({
+                'Current ROI Label': roi.roi['label'],
+                'Current ROI Volume [cc]': roi.roi['volume'],
+                'Current ROI Centroid [cm]': roi.roi['centroid'],
+            })
+            if j is None:
+                row['Check Result'] = 'NO MATCHING REFERENCE ROI'
+                rows.append(row)
+                continue
+
+            reference_roi = reference_rois[j].roi
+            row.update({
+                'Reference ROI Label': reference_roi['label'],
+                'Reference ROI Volume [cc]': reference_roi['volume'],
+                'Reference ROI Centroid [cm]': reference_roi['centroid'],
+                'Check Result': matrix.status(i, j)[0],
+            })
+            if geometry:
+                results, identical = _compare_geometry(
+                    reference, current, j, i, voxel_size
+                )
+                row.update({
+                    'DICE': results.get('DiceSimilarityCoefficient'),
+                    'Precision': results.get('Precision'),
+                    'Sensitivity': results.get('Sensitivity'),
+                    'Specificity': results.get('Specificity'),
+                    'MeanDistanceToAgreement': results.get(
+                        'MeanDistanceToAgreement'
+                    ),
+                    'MaxDistanceToAgreement': results.get(
+                        'MaxDistanceToAgreement'
+                    ),
+                    'Identical Geometry': identical,
+                })
+            rows.append(row)
+        return rows
+
+    except Exception as err:
+        row = dict(base)
+        row['Error'] = f"{type(err).__name__}: {err}"
+        return [row]
+
+
+def _check(args: tuple) -> list:
+    return check_snapshot_pair(*args)
+
+
+def run_batch(root: str, f_out: str, reference_reviewer: str = None,
+    geometry: bool = False, voxel_size: float = None,
+    workers: int = None) -> dict:
+    '''
+        Check every snapshot pair in root across a pool of worker
+        processes, and write the rows to the CSV f_out.
+
+        Returns dict of pairs, rows, failures (rows not a VOLUME &
+        CENTROID MATCH), errors and seconds.
+    '''
+    start = perf_counter()
+    pairs = find_snapshot_pairs(root, reference_reviewer)
+    jobs = [(pair, geometry, voxel_size) for pair in pairs]
+
+    stats = {'pairs': len(pairs), 'rows': 0, 'failures': 0, 'errors': 0}
+    with open(f_out, 'w', encoding='utf-8', newline = '') as f:
+        dw = DictWriter(f, HEADERS)
+        dw.writeheader()
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            for k, rows in enumerate(pool.map(_check, jobs)):
+                dw.writerows(rows)
+                stats['rows'] += len(rows)
+                stats['errors'] += sum(1 for row in rows if row.get('Error'))
+                stats['failures'] += sum(
+                    1 for row in rows if 'Check Result' in row
+                    and row['Check Result'] != 'VOLUME & CENTROID MATCH'
+                )
+                print(f"[{k + 1}/{len(pairs)}] {pairs[k][0]}")
+
+    stats['seconds'] = perf_counter() - start
+    return stats
+
+
+def main(argv = None):
+    parser = ArgumentParser(
+        description = "Headless ROILockTime check of a snapshot folder."
+    )
+    parser.add_argument("root", help = "folder of structure set snapshots")
+    parser.add_argument(
+        "-o", "--output", default = "ROILockTimeReport.csv",
+        help = "CSV report to write (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--reference-reviewer", default = None,
+        help = "check against the latest approval by this reviewer"
+    )
+    parser.add_argument(
+        "--geometry", action = "store_true",
+        help = "also compare the stored contours offline"
+    )
+    parser.add_argument(
+        "--voxel-size", type = float, default = None,
+        help = "voxel size of the offline comparison grid [cm]"
+    )
+    parser.add_argument(
+        "--workers", type = int, default = None,
+        help = "worker processes (default: one per CPU)"
+    )
+    args = parser.parse_args(argv)
+
+    stats = run_batch(
+        args.root, args.output,
+        reference_reviewer = args.reference_reviewer,
+        geometry = args.geometry, voxel_size = args.voxel_size,
+        workers = args.workers
+    )
+    print(
+        f"{stats['pairs']} patients, {stats['rows']} ROIs checked in "
+        f"{stats['seconds']:.1f}s: {stats['failures']} not matching, "
+        f"{stats['errors']} errors. Report: {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
+from time import perf_counter
+# Launch time, for the first paint probe 
+LAUNCH_TIME = perf_counter()
+
 from os import path
 import tkinter as tk 
 from tkinter import filedialog as fd
 from widgets.cuh_tkinter import *
 from modules.structure_set_classes import *
+from modules.snapshot_catalog import CUHSnapshotCatalog
+from modules.call_timing import TIMINGS
 from csv import DictWriter
 
 
@@ -11,104 +17,141 @@ __version__ = "v0.0.0"
 
 F_ROOT = "//GBCBGPPHFS001.net.addenbrookes.nhs.uk/Planning/ROILockTime"
 
+# Use each reference ROI at most once when auto-matching rows
+ONE_TO_ONE_MATCHING = False
+# Number of pooled ROI rows in the window
+VISIBLE_ROWS = 14
+# Point encoding of Compact binary? snapshots, see modules/snapshot_io.py
+BINARY_DTYPE = "quantized"
+# Tolerance of Simplify contours? [mm]
+SIMPLIFY_TOLERANCE_MM = 0.1
+# Local index of the snapshots on F_ROOT, see modules/snapshot_catalog.py
+CATALOG_PATH = path.join(
+    path.expanduser("~"), "ROILockTime", "snapshot_catalog.sqlite"
+)
+# Run exports, loads, restores and comparisons on a worker thread. 
+# Set False to run them on the main thread, as before. 
+BACKGROUND_TASKS = True
+
 class ROILockTimeRow(tk.Frame):
     '''
-        Each row in the structure set window is an instance of this class. 
+        Each visible row in the structure set window is an instance of this 
+        class. Rows are pooled by CUHVirtualList and re-bound to a different 
+        ROI with bind_roi, which updates the widgets in place. 
+
         current_roi and reference_roi(s) should be an instance(s) of CUHRTROI.
+        tolerance_matrix is the CUHRTToleranceMatrix of the current and 
+        reference structure sets, and matrix_row the index of current_roi 
+        in it. A single row matrix is built if not given. 
+        matching_roi_index is the auto-matched index into reference_rois, 
+        found by get_matching_roi_index if not given. 
+        on_select(matrix_row, index) is called when the user picks a 
+        different reference roi, and on_tick(matrix_row, ticked) when the 
+        restore check box is toggled. 
     '''
     def __init__(
-        self, parent, row: int, current_roi, reference_rois: list = None
+        self, parent, row: int, current_roi = None, 
+        reference_rois: list = None, matching_roi_index: int = None, 
+        tolerance_matrix = None, matrix_row: int = 0, on_select = None, 
+        on_tick = None
         ):
         super().__init__(
             parent, background = BLACK, padx = 0, pady = 0 
         )
         self.grid(row=row, column = 0)
         self.columnconfigure((0, 1, 2), weight = 1)
-        self.reference_rois = reference_rois 
-        self.current_roi = current_roi 
+        self.on_select = on_select
+        self.on_tick = on_tick
+        self.reference_rois = None 
+        self.current_roi = None 
 
-        self.current_roi_label = CUHLabelText(
-            self, self.current_roi.roi['label'], 0, 0 
-        )
+        self.current_roi_label = CUHLabelText(self, '', 0, 0)
+
+        # Ticked rows are restored by Restore reference contours
+        self.restore_tick = CUHCheckBox(self, 'CF.', 0, 1)
+        self.restore_tick['command'] = self.tick_roi
 
-        CUHLabelText(self, 'CF.', 0, 1)
+        self.selected_roi = CUHDropDownMenu(
+            self, [''], 0, 2, self.select_reference_roi, 
+        )
+        self.status_label = CUHStatusCell(self, '', 0, 3, disp="good")
 
-        if self.reference_rois:
-            self.selected_roi = CUHDropDownMenu(
-                self, [roi.roi['label'] for roi in self.reference_rois], 
-                0, 2, self.cf_centroid_and_volume, 
-                current_selection_index=self.get_matching_roi_index(),
+        if current_roi is not None:
+            self.bind_roi(
+                current_roi, reference_rois, matching_roi_index, 
+                tolerance_matrix, matrix_row
             )
-        else:
-            self.selected_roi = CUHDropDownMenu(
-                self, [''], 
-                0, 2, self.cf_centroid_and_volume, 
-                current_selection_index=self.get_matching_roi_index(),
+
+    def bind_roi(
+        self, current_roi, reference_rois: list = None, 
+        matching_roi_index: int = None, tolerance_matrix = None, 
+        matrix_row: int = 0
+        ):
+        '''
+            Show current_roi in this row, updating the widgets in place. 
+        '''
+        if reference_rois and tolerance_matrix is None:
+            # Imported here so that NumPy is only needed with a reference
+            from modules.roi_tolerance import CUHRTToleranceMatrix
+
+            tolerance_matrix = CUHRTToleranceMatrix(
+                [current_roi], reference_rois
             )
+            matrix_row = 0
+        self.current_roi = current_roi 
+        self.tolerance_matrix = tolerance_matrix
+        self.matrix_row = matrix_row
+
+        # Only reset the drop down values if the reference has changed
+        if reference_rois is not self.reference_rois:
+            self.reference_rois = reference_rois 
+            if self.reference_rois:
+                self.selected_roi['values'] = [
+                    roi.roi['label'] for roi in self.reference_rois
+                ]
+            else:
+                self.selected_roi['values'] = ['']
 
+        if matching_roi_index is None:
+            matching_roi_index = self.get_matching_roi_index()
 
+        self.current_roi_label['text'] = self.current_roi.roi['label']
+        self.selected_roi.current(matching_roi_index)
         self.cf_centroid_and_volume()
 
+    def select_reference_roi(self, event = None):
+        '''
+            Drop down callback: record the selection and re-check. 
+        '''
+        if self.on_select is not None:
+            self.on_select(self.matrix_row, self.selected_roi.current())
+        self.cf_centroid_and_volume()
+
+    def tick_roi(self):
+        if self.on_tick is not None:
+            self.on_tick(self.matrix_row, bool(self.restore_tick.var.get()))
+
     def cf_centroid_and_volume(self, event = None):
         '''
             Compare the centroid and volume of the current and reference roi.
+            Read from the tolerance matrix, so nothing is recomputed here. 
         '''
         if not self.reference_rois:
-            CUHLabelText(
-                self, '', 0, 3, disp="good"
-            ) 
+            text, disp = '', "good"
         else:
-            roi2 = self.reference_rois[
-                self.selected_roi.current() 
-            ]
-            roi1 = self.current_roi
-            volume_match = (
-                abs(round(roi1.roi['volume'],1) == round(roi2.roi['volume'],1))
+            text, disp = self.tolerance_matrix.status(
+                self.matrix_row, self.selected_roi.current()
             )
-            deltas = [abs(delta)>0.1 for delta in [
-                roi1.roi['centroid']['x'] - roi2.roi['centroid']['x'],
-                roi1.roi['centroid']['y'] - roi2.roi['centroid']['y'],
-                roi1.roi['centroid']['z'] - roi2.roi['centroid']['z']
-            ]]
-            centroid_match = not any(deltas)
-            if volume_match and centroid_match:
-                CUHLabelText(
-                    self, 'VOLUME & CENTROID MATCH', 0, 3, disp="good"
-                ) 
-            elif volume_match and not centroid_match:
-                CUHLabelText(
-                    self, 'VOLUME MATCH, CENTROID FAIL', 0, 3, disp="WARN"
-                ) 
-            elif not volume_match and centroid_match:
-                CUHLabelText(
-                    self, 'VOLUME FAIL, CENTROID MATCH', 0, 3, disp="WARN"
-                ) 
-            else:
-                 CUHLabelText(
-                    self, 'FAILURE', 0, 3, disp="bad"
-                ) 
+        self.status_label.set_status(text, disp)
 
     def get_matching_roi_index(self):
         '''
             Find the closest matching roi from list of reference_rois 
             Reference rois must be objects of type CUHRTROI. 
         '''
-        if self.reference_rois:
-            try: # Try to find a roi with a matching name 
-                index = [
-                    roi.roi['label'] for roi in self.reference_rois
-                    ].index(self.current_roi.roi['label'])
-            except  ValueError:
-                try: # Otherwise try to match to the vol to 2 decimal place 
-                    index = [
-                        round(roi.roi['volume'],2) for roi in 
-                        self.reference_rois].index(
-                            round(self.current_roi.roi['volume'],2)) 
-                except ValueError:
-                    index = 0         
-        else:
-            index = 0
-        return index
+        if not self.reference_rois:
+            return 0
+        return self.tolerance_matrix.matching_indices()[self.matrix_row]
 
 
 class ROILockTimeWindow(tk.Tk):
@@ -119,21 +162,23 @@ class ROILockTimeWindow(tk.Tk):
 
         # -- INITIALISATION -- #
         self.raystation = CUHGetCurrentStructureSetObject() 
-        self.structure_sets = [CUHRTStructureSet(sub_structure_set = i)
-        for i in self.raystation.ss.SubStructureSets]
+        self.load_structure_sets()
         self.reference_structure_set = None 
-        self.sub_structure_set_labels = [
-            ss.f_name.split("+")[1:-1] for ss in self.structure_sets
-            ]
+        self.tolerance_matrix = None 
         self.reference_structure_set_contours_restored = False
+        self.identical_rois = []
+        self.task = None 
+        self.catalog = CUHSnapshotCatalog(CATALOG_PATH)
+        self.catalogued_snapshots = []
 
         super().__init__() 
         self.title(__title__ + " " + __version__)
         self.configure(background="black")
         self.columnconfigure(0, weight = 1)
-        self.iconbitmap(
-        "//MOSAIQAPP-20/mosaiq_app/TOOLS/RayStation"
-        "/microscope_io/microscope.ico"
+        # Dialogs are shown over this window, which gets the shared icon 
+        DIALOGS.register_root(self)
+        self.startup_probe = CUHStartupProbe(
+            self, LAUNCH_TIME, on_paint = self.first_painted
         )
 
         # -- TITLE -- #
@@ -152,22 +197,39 @@ class ROILockTimeWindow(tk.Tk):
             current_selection_index=len(self.sub_structure_set_labels)-1
         )
 
-        self.current_structure_set = self.structure_sets[
-            self.ss_dropdown.current()
-            ]
-
-        CUHAppButton(
+        load_button = CUHAppButton(
             first_row_frame, 'Load Reference SS', 
             self.load_reference_structure_set_from_file, 0, 2
             )
         CUHLabelText(
             first_row_frame, 'Check Result', 0, 3
         )
+        CUHLabelText(first_row_frame, "Catalogued Reference SS: ", 1, 0)
+        self.catalog_dropdown = CUHDropDownMenu(
+            first_row_frame, [''], 1, 1, lambda event = None: None
+        )
+        load_catalogued_button = CUHAppButton(
+            first_row_frame, 'Load Catalogued SS', 
+            self.load_catalogued_reference_structure_set, 1, 2
+            )
+        rescan_button = CUHAppButton(
+            first_row_frame, 'Rescan Share', self.rescan_catalog, 1, 3
+            )
+        self.show_catalogued_snapshots()
         CUHHorizontalRule(self, 3, 0)
 
         # -- STRUCTURES -- # 
-        self.main_frame = CUHScrollableFrame(self, 4, 0, 600)
-        self.main_frame.frame.columnconfigure(0, weight =1)
+        self.selected_roi_indices = []
+        self.ticked_roi_indices = set()
+        self.main_frame = CUHVirtualList(
+            self, 4, 0, 
+            row_factory = lambda parent, i: ROILockTimeRow(
+                parent, i, on_select = self.record_selected_roi, 
+                on_tick = self.record_ticked_roi
+            ),
+            bind_row = self.bind_roi_row, 
+            visible_rows = VISIBLE_ROWS
+        )
         self.show_current_sub_structure_sets_in_window()
 
         CUHHorizontalRule(self, 5, 0)
@@ -175,24 +237,61 @@ class ROILockTimeWindow(tk.Tk):
         # -- BOTTOM ROW -- # 
         bottom_row_frame = CUHFrame(self, 6, 0)
         bottom_row_frame.columnconfigure((0,1,2,3), weight=1)
-        CUHAppButton(
+        export_button = CUHAppButton(
             bottom_row_frame, 'Export Current SS to json', self.export_to_json,
             0,0
         ) 
         self.include_contours = CUHCheckBox(
             bottom_row_frame, 'Include contours?', 0, 1
         ) 
+        self.binary_snapshot = CUHCheckBox(
+            bottom_row_frame, 'Compact binary?', 1, 1
+        ) 
+        self.simplify_contours = CUHCheckBox(
+            bottom_row_frame, 'Simplify contours?', 2, 1
+        ) 
+        self.deduplicated_store = CUHCheckBox(
+            bottom_row_frame, 'Deduplicated store?', 3, 1
+        ) 
+        self.restore_failing_only = CUHCheckBox(
+            bottom_row_frame, 'Failing ROIs only?', 1, 2
+        ) 
+        self.time_calls = CUHCheckBox(
+            bottom_row_frame, 'Time scripting calls?', 2, 2
+        ) 
+        self.time_calls.var.set(int(TIMINGS.enabled))
+        self.time_calls['command'] = self.toggle_call_timing
 
-        CUHAppButton(
+        restore_button = CUHAppButton(
             bottom_row_frame, 'Restore reference contours', 
             self.restore_reference_contours,0,2
         ) 
 
-        CUHAppButton(
+        compare_button = CUHAppButton(
             bottom_row_frame, 'Compare restored contours', 
             self.export_comparison_of_restored_contours,0,3
         ) 
 
+        # The scripting API is not thread-safe, so nothing that may call 
+        # it is left enabled while a task runs, see run_in_background 
+        self.task_controls = [
+            self.ss_dropdown, load_button, self.catalog_dropdown, 
+            load_catalogued_button, rescan_button, export_button, 
+            self.include_contours, self.binary_snapshot, 
+            self.simplify_contours, self.deduplicated_store, 
+            self.restore_failing_only, self.time_calls, restore_button, 
+            compare_button
+        ]
+
+        # -- PROGRESS -- # 
+        progress_row_frame = CUHFrame(self, 7, 0)
+        progress_row_frame.columnconfigure((0,1,2), weight=1)
+        self.progress_bar = CUHProgressBar(progress_row_frame, 0, 0)
+        self.progress_label = CUHStatusCell(progress_row_frame, '', 0, 1)
+        CUHAppButton(
+            progress_row_frame, 'Cancel', self.cancel_task, 0, 2
+        )
+
         self.initial_warning_message()
 
     def initial_warning_message(self):
@@ -207,21 +306,236 @@ class ROILockTimeWindow(tk.Tk):
         if not initial_warning.answer:
             exit() 
 
+    def first_painted(self, probe):
+        '''
+            Report the time from launch to first paint, and the number 
+            of widgets painted. 
+        '''
+        print(
+            f"First paint {probe.first_paint_time:.2f}s after launch, "
+            f"{count_widgets(self)} widgets."
+        )
+        if TIMINGS.enabled:
+            TIMINGS.record("first paint", None, probe.first_paint_time)
+
+    def toggle_call_timing(self):
+        '''
+            Start or stop timing the RayStation scripting calls, see 
+            modules/call_timing.py. The report is printed on closing. 
+        '''
+        if self.time_calls.var.get():
+            TIMINGS.enable()
+        else:
+            TIMINGS.disable()
+
+    def enable_task_controls(self, enabled: bool = True):
+        '''
+            Enable, or disable, every control in task_controls. 
+        '''
+        for widget in self.task_controls:
+            if isinstance(widget, CUHDropDownMenu):
+                widget['state'] = "readonly" if enabled else "disabled"
+            else:
+                widget['state'] = "normal" if enabled else "disabled"
+
+    def run_in_background(self, func, on_done, description: str): 
+        '''
+            Run func(report) as a CUHBackgroundTask, showing its progress. 
+            on_done(result) is called on the main thread. Only one task 
+            runs at a time, and the task_controls are disabled until it 
+            has finished, so that no scripting call is made from the main 
+            thread meanwhile. 
+        '''
+        if self.task is not None and self.task.running:
+            CUHRTWarningMessage(
+                title = "INFO: ",
+                message = "Please wait for the current task to finish."
+            )
+            return
+        self.progress_label.set_status(description, "info")
+        self.progress_bar.update_progress(0)
+        self.enable_task_controls(False)
+        self.task = CUHBackgroundTask(
+            self, func, 
+            on_done = lambda result: self.task_finished(on_done, result), 
+            on_error = self.task_failed, 
+            on_progress = self.show_task_progress, 
+            threaded = BACKGROUND_TASKS
+        ).start()
+
+    def show_task_progress(self, done: int, total: int, text: str):
+        self.progress_bar.update_progress(done, total)
+        if text:
+            self.progress_label.set_status(text, "info")
+
+    def task_finished(self, on_done, result):
+        self.progress_bar.reset()
+        self.progress_label.set_status('', "info")
+        self.enable_task_controls()
+        on_done(result)
+
+    def task_failed(self, err):
+        '''
+            Exceptions from a background task are shown here, on the main 
+            thread. 
+        '''
+        self.progress_bar.reset()
+        self.progress_label.set_status('', "info")
+        self.enable_task_controls()
+        if isinstance(err, CUHRTOperationCancelled):
+            CUHRTWarningMessage(title = "INFO: ", message = str(err))
+        elif isinstance(err, CUHRTStructureSetException):
+            err.show_and_exit()
+        elif isinstance(err, SystemExit):
+            exit()
+        else:
+            CUHRTStructureSetException(
+                err, "Unexpected error in background task."
+            )
+
+    def cancel_task(self):
+        if self.task is not None and self.task.running:
+            self.task.cancel()
+            self.progress_label.set_status('Cancelling...', "warn")
+
+    def load_structure_sets(self):
+        '''
+            Read the sub-structure sets of the current exam. Only the 
+            reviewer and locktime labels are read here, the ROI summaries 
+            are built when a sub-structure set is first selected. 
+        '''
+        self.structure_sets = [
+            CUHRTStructureSet(sub_structure_set = i, load_rois = False)
+            for i in self.raystation.ss.SubStructureSets
+        ]
+        self.sub_structure_set_labels = [
+            ss.f_name.split("+")[1:-1] for ss in self.structure_sets
+            ]
+
+    def reload_if_exam_changed(self) -> bool:
+        '''
+            If the patient, case or exam selected in RayStation has changed 
+            since the sub-structure sets were read, read them again, select 
+            the latest and drop the reference SS. Returns True if so. 
+        '''
+        if not SESSION.refresh():
+            return False
+        self.load_structure_sets()
+        self.ss_dropdown['values'] = self.sub_structure_set_labels
+        self.ss_dropdown.current(len(self.sub_structure_set_labels) - 1)
+        self.reference_structure_set = None 
+        self.reference_structure_set_contours_restored = False
+        self.identical_rois = []
+        self.show_catalogued_snapshots()
+        return True
+
+    def warn_if_exam_changed(self) -> bool:
+        '''
+            reload_if_exam_changed, telling the user if it did, so that 
+            an export or restore is not made for the wrong exam. 
+        '''
+        if not self.reload_if_exam_changed():
+            return False
+        self.show_current_sub_structure_sets_in_window()
+        CUHRTWarningMessage(
+            title = "INFO: ",
+            message = (
+                "The patient, case or exam selected in RayStation has "
+                "changed, so its approvals have been reloaded.\n"
+                "Check the selection and try again."
+            )
+        )
+        return True
+
+    def get_sub_structure_set(self, index: int):
+        '''
+            Returns the CUHRTStructureSet at index, building its ROI summaries
+            the first time it is requested. 
+        '''
+        structure_set = self.structure_sets[index]
+        structure_set.load_rois()
+        return structure_set
+
     def show_current_sub_structure_sets_in_window(self, event = None): 
-        self.current_structure_set = self.structure_sets[
+        self.reload_if_exam_changed()
+        self.current_structure_set = self.get_sub_structure_set(
             self.ss_dropdown.current()
-        ]
-        [item.destroy() for item in self.main_frame.frame.winfo_children()]
-        for i, roi in enumerate(self.current_structure_set.rois):
-            if self.reference_structure_set:
-                ROILockTimeRow(
-                    self.main_frame.frame, i, roi, 
-                    self.reference_structure_set.rois
-                )
-            else:
-                ROILockTimeRow(
-                    self.main_frame.frame, i, roi,
-                )
+        )
+        if self.reference_structure_set:
+            # Imported here so that NumPy is only needed with a reference
+            from modules.roi_tolerance import CUHRTToleranceMatrix
+
+            # Every current x reference check in one vectorised step
+            self.tolerance_matrix = CUHRTToleranceMatrix(
+                self.current_structure_set.rois, 
+                self.reference_structure_set.rois
+            )
+            self.selected_roi_indices = self.tolerance_matrix.matching_indices(
+                one_to_one = ONE_TO_ONE_MATCHING
+            )
+        else:
+            self.tolerance_matrix = None 
+            self.selected_roi_indices = [
+                0 for _ in self.current_structure_set.rois
+            ]
+        self.ticked_roi_indices = set()
+        if not TIMINGS.enabled:
+            self.main_frame.set_items(self.current_structure_set.rois)
+            return
+        # Rows are pooled, so a refresh should add no widgets
+        with CUHLayoutProbe(self.main_frame) as probe:
+            self.main_frame.set_items(self.current_structure_set.rois)
+        TIMINGS.record("ROI table layout", None, probe.layout_time)
+        if probe.widgets_added:
+            print(f"ROI table grew by {probe.widgets_added} widgets.")
+
+    def bind_roi_row(self, row, roi, index: int):
+        '''
+            CUHVirtualList bind_row: show ROI index of the current 
+            structure set in a pooled ROILockTimeRow. 
+        '''
+        if self.reference_structure_set:
+            row.bind_roi(
+                roi, self.reference_structure_set.rois, 
+                matching_roi_index = self.selected_roi_indices[index], 
+                tolerance_matrix = self.tolerance_matrix, 
+                matrix_row = index
+            )
+        else:
+            row.bind_roi(roi, matching_roi_index = 0)
+        row.restore_tick.var.set(int(index in self.ticked_roi_indices))
+
+    def record_selected_roi(self, index: int, reference_index: int):
+        '''
+            Keep the user's drop down choice when the row is re-bound. 
+        '''
+        self.selected_roi_indices[index] = reference_index
+
+    def record_ticked_roi(self, index: int, ticked: bool):
+        '''
+            Keep the user's restore check box when the row is re-bound. 
+        '''
+        if ticked:
+            self.ticked_roi_indices.add(index)
+        else:
+            self.ticked_roi_indices.discard(index)
+
+    def reference_indices_to_restore(self):
+        '''
+            Reference rois selected by the ticked rows, else by the rows 
+            that are not VOLUME & CENTROID MATCH if Failing ROIs only? is 
+            ticked. None means all reference rois. 
+        '''
+        if self.ticked_roi_indices:
+            rows = sorted(self.ticked_roi_indices)
+        elif self.restore_failing_only.var.get():
+            rows = [
+                i for i, j in enumerate(self.selected_roi_indices)
+                if self.tolerance_matrix.status(i, j)[1] != "good"
+            ]
+        else:
+            return None
+        return sorted({self.selected_roi_indices[i] for i in rows})
     
     def load_reference_structure_set_from_file(self):
         '''
@@ -229,86 +543,293 @@ class ROILockTimeWindow(tk.Tk):
             CUHRTStructureSet
         '''
         f_path = fd.askopenfilename(
-            filetypes = (('Json File','*.json'),),
+            filetypes = (
+                ('Structure Set Snapshot', (
+                    '*.json', '*' + SNAPSHOT_EXTENSION, 
+                    '*' + MANIFEST_EXTENSION
+                )),
+                ('Json File','*.json'),
+                ('Binary Snapshot', '*' + SNAPSHOT_EXTENSION),
+                ('Snapshot Manifest', '*' + MANIFEST_EXTENSION),
+            ),
             initialdir = F_ROOT,
-            title = "Select a json SS to load.",
+            title = "Select a SS snapshot to load.",
             
         )
+        if not f_path:
+            return
+        self.load_reference_structure_set(f_path)
 
-        self.reference_structure_set = CUHRTStructureSet(
-            f_path = f_path,
-            sub_structure_set=None
+    def show_catalogued_snapshots(self):
+        '''
+            Catalogued snapshots of the current patient, newest first. 
+        '''
+        self.catalogued_snapshots = self.catalog.snapshots_for_patient(
+            self.raystation.patientID
         )
+        labels = [
+            f"{x['reviewer']} {x['locktime'] or ''} {x['format']}"
+            for x in self.catalogued_snapshots
+        ]
+        self.catalog_dropdown['values'] = labels or ['']
+        self.catalog_dropdown.current(0)
 
-        self.show_current_sub_structure_sets_in_window()
-
-        CUHRTWarningMessage(
-            title="SUCCESS: ",
-            message = (
-                "Structure Set data loaded from json: \n"
-                f"{path.join(f_path, self.current_structure_set.f_name)}"
+    def load_catalogued_reference_structure_set(self):
+        '''
+            Load the snapshot selected in the catalogue dropdown. 
+        '''
+        index = self.catalog_dropdown.current()
+        if not self.catalogued_snapshots or index < 0:
+            CUHRTWarningMessage(
+                message = (
+                    "No catalogued snapshots for this patient. \n"
+                    "Rescan the share, or load a reference SS from file."
+                )
             )
+            return
+        self.load_reference_structure_set(
+            self.catalogued_snapshots[index]['path']
         )
 
+    def rescan_catalog(self):
+        '''
+            Re-index the snapshots on F_ROOT, then refresh the dropdown. 
+        '''
+        def scan(report):
+            return self.catalog.scan(F_ROOT, progress = report)
+
+        def scanned(scan_stats):
+            self.show_catalogued_snapshots()
+            CUHRTWarningMessage(
+                title="SUCCESS: ",
+                message = (
+                    "Snapshot catalogue updated: \n"
+                    f"{scan_stats['added']} added, "
+                    f"{scan_stats['updated']} updated, "
+                    f"{scan_stats['removed']} removed, "
+                    f"{scan_stats['unchanged']} unchanged."
+                )
+            )
+
+        self.run_in_background(scan, scanned, "Rescanning share")
+
+    def load_reference_structure_set(self, f_path: str):
+        '''
+            Load the snapshot at f_path as the reference structure set. 
+        '''
+        def load(report):
+            report(0, None, "Loading snapshot...")
+            return CUHRTStructureSet(f_path = f_path, sub_structure_set=None)
+
+        def loaded(structure_set):
+            self.reference_structure_set = structure_set
+            self.reference_structure_set_contours_restored = False
+            self.identical_rois = []
+            self.show_current_sub_structure_sets_in_window()
+
+            CUHRTWarningMessage(
+                title="SUCCESS: ",
+                message = (
+                    "Structure Set data loaded from json: \n"
+                    f"{path.join(f_path, self.current_structure_set.f_name)}"
+                )
+            )
+
+        self.run_in_background(load, loaded, "Loading reference SS")
+
     def export_to_json(self):
         '''
             Export selected sub-structure set to JSON. 
         '''
+        if self.warn_if_exam_changed():
+            return
         f_out = F_ROOT
-         
-        self.current_structure_set.json_export(
-            f_out = f_out,
-            include_contours=self.include_contours.var.get()
-        )
+        structure_set = self.current_structure_set
+        include_contours = self.include_contours.var.get()
+        binary = self.binary_snapshot.var.get()
+        deduplicated = self.deduplicated_store.var.get()
+        simplify_tolerance_mm = SIMPLIFY_TOLERANCE_MM \
+            if self.simplify_contours.var.get() else None
+
+        def export(report):
+            if deduplicated:
+                return structure_set.store_export(
+                    f_out = f_out, dtype = BINARY_DTYPE, progress = report, 
+                    simplify_tolerance_mm = simplify_tolerance_mm
+                )
+            if binary:
+                return structure_set.binary_export(
+                    f_out = f_out,
+                    include_contours = include_contours,
+                    dtype = BINARY_DTYPE, stream = True, progress = report, 
+                    simplify_tolerance_mm = simplify_tolerance_mm
+                )
+            return structure_set.json_export(
+                f_out = f_out,
+                include_contours = include_contours,
+                stream = True, progress = report, 
+                simplify_tolerance_mm = simplify_tolerance_mm
+            )
 
-        CUHRTWarningMessage(
-            title="SUCCESS: ",
-            message = (
-                "Structure Set data exported to json: \n"
-                f"{path.join(f_out, self.current_structure_set.f_name)}"
+        def exported(export_stats):
+            self.catalog.record(export_stats['f_path'])
+            self.show_catalogued_snapshots()
+            simplification = export_stats['simplification']
+            simplified = [x for x in simplification if x['simplified']]
+            skipped = [x for x in simplification if not x['simplified']]
+            CUHRTWarningMessage(
+                title="SUCCESS: ",
+                message = (
+                    "Structure Set data exported: \n"
+                    f"{export_stats['f_path']}\n"
+                    f"{format_bytes(export_stats['bytes_written'])} written, "
+                    "peak memory "
+                    f"{format_bytes(export_stats['peak_memory_bytes'])}."
+                ) + (
+                    f"\n{len(simplified)} of {len(simplification)} ROIs "
+                    "simplified, from "
+                    f"{sum(x['points_before'] for x in simplified)} to "
+                    f"{sum(x['points_after'] for x in simplified)} points."
+                    if simplification else ""
+                ) + "".join(
+                    f"\nKept all points of {x['label']}: {x['reason']}."
+                    for x in skipped
+                )
             )
-        )
+
+        self.run_in_background(export, exported, "Exporting current SS")
 
     def restore_reference_contours(self):
         '''
             Attempts to restore reference sub-structure set contours 
             into the current exam's structure set. 
         '''
-        if self.reference_structure_set is not None:
-            self.reference_structure_set.restore_all_contours()
-            self.reference_structure_set_contours_restored = True
-            CUHRTWarningMessage(
-                title = "INFO: ",
-                message = ("If contours were found in the reference structure "
-                "set, these have been restored into the current exam's "
-                "structure set.")
-            )
-        else:
+        if self.warn_if_exam_changed():
+            return
+        if self.reference_structure_set is None:
             CUHRTWarningMessage(
                 title = "ERROR: ",
                 message = "You must load a reference structure set first."
             )
             self.reference_structure_set_contours_restored = False
+            return
+
+        indices = self.reference_indices_to_restore()
+        if indices == []:
+            CUHRTWarningMessage(
+                title = "INFO: ",
+                message = "There are no failing ROIs to restore."
+            )
+            return
+
+        current_structure_set = self.current_structure_set
+        reference_structure_set = self.reference_structure_set
+        selected = list(enumerate(self.selected_roi_indices))
+
+        def restore(report):
+            reference_rois = reference_structure_set.rois
+            candidates = {
+                j for j in (
+                    range(len(reference_rois)) if indices is None else indices
+                ) if reference_rois[j].roi['has_contours']
+            }
+            # Reference rois identical to the current roi of their row 
+            # need not be restored to be compared
+            identical = current_structure_set.identical_rois(
+                reference_structure_set, 
+                [(i, j) for i, j in selected if j in candidates], 
+                progress = report
+            )
+            restore_stats = reference_structure_set.restore_selected_contours(
+                sorted(candidates - {j for _, j in identical}), 
+                progress = report
+            )
+            return restore_stats, [
+                (current_structure_set.rois[i], reference_rois[j]) 
+                for i, j in identical
+            ]
+
+        def restored(result):
+            restore_stats, self.identical_rois = result
+            self.reference_structure_set_contours_restored = True
+            failures = "".join(
+                f"\n{label} ({stage}): {error}" 
+                for label, stage, error in restore_stats['failures']
+            )
+            left_behind = "".join(
+                f"\n{name} ({label}): {error}" 
+                for label, name, error in restore_stats['left_behind']
+            )
+            CUHRTWarningMessage(
+                title = "INFO: ",
+                message = (
+                    f"{len(restore_stats['restored'])} ROIs with contours in "
+                    "the reference structure set have been restored into the "
+                    "current exam's structure set in "
+                    f"{sum(restore_stats['timings'].values()):.1f}s. "
+                    f"{len(self.identical_rois)} identical ROIs were skipped."
+                    + (f"\n\nFailed:{failures}" if failures else "")
+                    + (
+                        "\n\nCould not be deleted, left in the case:"
+                        f"{left_behind}" if left_behind else ""
+                    )
+                )
+            )
+
+        self.run_in_background(
+            restore, restored, "Restoring reference contours"
+        )
 
     def export_comparison_of_restored_contours(self):
         '''
             If reference contours has been restored into the current structure
             set, it is possible to evaluate Dice and Hausdorff distance for 
-            these structures.  
-        '''
-        list_of_compare_objects = [] 
-        roi_geometries = self.raystation.ss.RoiGeometries
-        if self.reference_structure_set_contours_restored:
-            for roi1 in self.current_structure_set.rois:
-                try:
-                    index = [
-                        roi.OfRoi.Name for roi in roi_geometries
-                        ].index(roi1.roi['label']+ " (1)") # TO DO
-                    list_of_compare_objects.append(
-                        roi1.compare_with_roi(index)
-                    )
-                except ValueError:
-                    continue
+            these structures. Only the rois of the last restore are compared, 
+            each with the current roi of the row that selected it. Rois 
+            skipped by the restore as identical are reported as exact 
+            matches. 
+        '''
+        if not self.reference_structure_set_contours_restored:
+            CUHRTWarningMessage(
+                title = "ERRROR: ",
+                message = ("This method only works through the App if you "
+                "have already restored some contours into the current exam's "
+                "structure set.")
+            )
+            return
+
+        current_structure_set = self.current_structure_set
+        reference_structure_set = self.reference_structure_set
+        restored_names = dict(reference_structure_set.restore_stats['restored'])
+        pairs = [
+            (current_structure_set.rois[i], restored_names[label])
+            for i, label in enumerate(
+                reference_structure_set.rois[j].roi['label'] 
+                for j in self.selected_roi_indices
+            ) if label in restored_names
+        ]
+        identical_rois = self.identical_rois
+        if not pairs and not identical_rois:
+            CUHRTWarningMessage(
+                title = "INFO: ",
+                message = "None of the restored ROIs are selected in a row."
+            )
+            return
+        csv_file_name = "_".join(
+            [self.raystation.patientID, 'ROIComparison.csv']
+            ) 
+        f_out = path.join(F_ROOT, csv_file_name)
+
+        def compare(report):
+            list_of_compare_objects = [
+                CUHRTCompareROI(roi1, roi2, check_identical = True)
+                for roi1, roi2 in identical_rois
+            ]
+            for i, (roi1, restored_name) in enumerate(pairs):
+                report_progress(report, i, len(pairs), roi1.roi['label'])
+                list_of_compare_objects.append(
+                    roi1.compare_with_roi(restored_name)
+                )
 
             to_csv = [
                 compare_object.return_formatted_dict()
@@ -317,15 +838,9 @@ class ROILockTimeWindow(tk.Tk):
             
             headers = to_csv[0].keys()
 
-            csv_file_name = "_".join(
-                [self.raystation.patientID, 'ROIComparison.csv']
-                ) 
-
-            f_out = path.join(F_ROOT, csv_file_name)
-
             csv_first_line = (
-                f"{self.current_structure_set.f_name} compared with "
-                f"{self.reference_structure_set.f_name}.\n\n"
+                f"{current_structure_set.f_name} compared with "
+                f"{reference_structure_set.f_name}.\n\n"
             
             )
 
@@ -334,7 +849,9 @@ class ROILockTimeWindow(tk.Tk):
                 dw = DictWriter(f, headers)
                 dw.writeheader()
                 dw.writerows(to_csv)
+            return f_out
 
+        def compared(f_out):
             CUHRTWarningMessage(
                 title = "SUCCESS: ",
                 message = (
@@ -343,15 +860,11 @@ class ROILockTimeWindow(tk.Tk):
                 )
             )
 
-        else:
-            CUHRTWarningMessage(
-                title = "ERRROR: ",
-                message = ("This method only works through the App if you "
-                "have already restored some contours into the current exam's "
-                "structure set.")
-            )
+        self.run_in_background(compare, compared, "Comparing contours")
 
 
 
-root = ROILockTimeWindow()
-root.mainloop()
+if __name__ == "__main__":
+    root = ROILockTimeWindow()
+    root.mainloop()
+    TIMINGS.dump_report()
@@ -0,0 +1,46 @@
+'''
+Record the current RayStation patient to a fixture file, for replay and
+benchmarking offline with fake_connect, see modules/session_fixture.py.
+
+Run as a RayStation script with the patient, case and examination open.
+The patient ID and reviewer names are anonymised unless ANONYMISE is
+False.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from os import makedirs, path
+
+from connect import get_current
+from modules.memory_usage import format_bytes
+from modules.session_fixture import (
+    FIXTURE_EXTENSION, record_patient, write_fixture
+)
+
+FIXTURE_ROOT = path.join(path.expanduser("~"), "ROILockTime", "fixtures")
+ANONYMISE = True
+# "float64" replays exactly, "quantized" is much smaller, see snapshot_io
+FIXTURE_DTYPE = "float64"
+
+
+def progress(done: int, total: int, text: str):
+    if text:
+        print(f"Recording ROI {done + 1} of {total}: {text}")
+
+
+patient = record_patient(get_current, anonymise = ANONYMISE,
+    progress = progress)
+makedirs(FIXTURE_ROOT, exist_ok = True)
+f_path = path.join(
+    FIXTURE_ROOT,
+    f"{patient['patient_id']}_{patient['recorded'].replace(':', '')}"
+    f"{FIXTURE_EXTENSION}"
+)
+fixture_stats = write_fixture(f_path, patient, dtype = FIXTURE_DTYPE)
+print(
+    f"Recorded {fixture_stats['n_rois']} ROIs, "
+    f"{fixture_stats['n_points']} contour points, to {f_path}: "
+    f"{format_bytes(path.getsize(f_path))}."
+)
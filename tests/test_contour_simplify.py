@@ -0,0 +1,75 @@
+'''
+Volume, area and centroid checks of simplify_roi_contours, see
+modules/contour_simplify.py.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import numpy as np
+import pytest
+
+from modules.contour_simplify import simplify_roi_contours
+from modules.roi_geometry import roi_volume_and_centroid
+from modules.roi_matching import volumes_match
+
+
+def circle_contours(radius: float, n_slices: int, spacing: float = 0.05,
+    slice_thickness: float = 0.3) -> list:
+    n_points = int(2 * np.pi * radius / spacing)
+    angles = np.linspace(0, 2 * np.pi, n_points, endpoint = False)
+    return [
+        [
+            {'x': radius * np.cos(a), 'y': radius * np.sin(a),
+                'z': k * slice_thickness}
+            for a in angles
+        ]
+        for k in range(n_slices)
+    ]
+
+
+@pytest.mark.parametrize("radius", [0.5, 1.0, 2.0])
+def test_realistic_rois_are_simplified(radius):
+    contours = circle_contours(radius, 11)
+    simplified, stats = simplify_roi_contours(contours, 0.1)
+
+    assert stats['simplified'], stats['reason']
+    assert stats['reason'] is None
+    assert stats['points_after'] < stats['points_before']
+    volume, _ = roi_volume_and_centroid(contours)
+    new_volume, _ = roi_volume_and_centroid(simplified)
+    assert volumes_match(volume, new_volume)
+    assert abs(new_volume - volume) <= 0.1
+
+
+def test_single_slice_roi_is_checked_by_area():
+    contours = circle_contours(2.0, 1)
+    simplified, stats = simplify_roi_contours(contours, 0.1)
+    assert stats['simplified']
+    assert stats['volume_change'] is None
+
+    # A coarse tolerance cuts far into the outline, which a volume check
+    # of a single slice, always 0cc, would not notice
+    simplified, stats = simplify_roi_contours(contours, 5)
+    assert not stats['simplified']
+    assert stats['reason'].startswith("area changed by")
+    assert simplified is contours
+    assert stats['points_after'] == stats['points_before']
+
+
+def test_large_roi_keeps_its_contours():
+    # Loses over 0.1cc at every tolerance tried, so would fail ROILockTime
+    contours = circle_contours(15.0, 100)
+    simplified, stats = simplify_roi_contours(contours, 0.1)
+    assert not stats['simplified']
+    assert stats['tolerance_mm'] is None
+    assert simplified is contours
+
+
+def test_large_volume_change_is_rejected():
+    contours = circle_contours(2.0, 11)
+    simplified, stats = simplify_roi_contours(contours, 5)
+    assert not stats['simplified']
+    assert stats['reason'].startswith("volume changed by")
+    assert simplified is contours
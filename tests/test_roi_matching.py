@@ -0,0 +1,71 @@
+'''
+Auto-matching read from CUHRTToleranceMatrix against the scalar
+CUHRTROIMatcher, see modules/roi_tolerance.py.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from modules.roi_matching import (
+    CUHRTROIMatcher, centroids_match, volumes_match
+)
+from modules.roi_tolerance import CUHRTToleranceMatrix
+
+
+def make_rois(n_rois: int, seed: int, labels: list = None) -> list:
+    '''
+        ROIs with volumes on a coarse grid, so that exact and tied volume
+        differences occur.
+    '''
+    rng = np.random.default_rng(seed)
+    labels = labels or [f"ROI_{i:03d}" for i in range(n_rois)]
+    return [
+        SimpleNamespace(roi = {
+            'label': labels[i % len(labels)],
+            'volume': float(rng.integers(0, 40)) * 0.0025,
+            'centroid': dict(zip('xyz', rng.normal(0, 0.1, 3).tolist())),
+        }) for i in range(n_rois)
+    ]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matrix_matches_scalar_find(seed):
+    current = make_rois(30, seed, ["A", "B", "X", "Y", "Z"])
+    reference = make_rois(20, seed + 100, ["A", "B", "C"])
+    matcher = CUHRTROIMatcher(reference)
+    matrix = CUHRTToleranceMatrix(current, reference)
+
+    expected = [matcher.find(roi) for roi in current]
+    assert matrix.matching_indices(default = None) == expected
+    assert matcher.match_all(current, default = None) == expected
+
+
+def test_matrix_checks_match_scalar_checks():
+    current = make_rois(15, 1)
+    reference = make_rois(10, 2)
+    matrix = CUHRTToleranceMatrix(current, reference)
+    for i, roi in enumerate(current):
+        for j, ref in enumerate(reference):
+            assert matrix.volume_match[i, j] == volumes_match(
+                roi.roi['volume'], ref.roi['volume'])
+            assert matrix.centroid_match[i, j] == centroids_match(
+                roi.roi['centroid'], ref.roi['centroid'])
+
+
+def test_one_to_one_uses_each_reference_once():
+    reference = make_rois(6, 3)
+    current = [
+        SimpleNamespace(roi = dict(ref.roi, label = f"renamed {i}"))
+        for i, ref in enumerate(reference)
+    ]
+    indices = CUHRTToleranceMatrix(current, reference).matching_indices(
+        one_to_one = True
+    )
+    assert sorted(indices) == list(range(len(reference)))
+    assert indices == list(range(len(reference)))
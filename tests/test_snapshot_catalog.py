@@ -0,0 +1,115 @@
+'''
+Incremental re-indexing of a snapshot folder by CUHSnapshotCatalog, see
+modules/snapshot_catalog.py.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import sys
+from os import path, remove
+
+import pytest
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+# The cancelled scan raises from modules.structure_set_classes, which
+# imports connect, served by the stand-in
+sys.path.insert(0, path.join(ROOT, "fake_connect"))
+
+from modules.snapshot_catalog import CUHSnapshotCatalog, parse_snapshot_name
+
+SNAPSHOTS = (
+    "TEST001+Doctor_Test+01_01_2024_09_00_00+.json",
+    "TEST001+Doctor_Test+03_01_2024_09_00_00+.cuhss",
+    "TEST002+Doctor_Other+02_01_2024_09_00_00+.cuhsm",
+)
+
+
+def write(f_path, text: str = "{}"):
+    with open(f_path, 'w') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def share(tmp_path):
+    root = tmp_path / "share"
+    (root / "blobs" / "ab").mkdir(parents = True)
+    for f_name in SNAPSHOTS:
+        write(root / f_name)
+    write(root / "notes.txt")
+    write(root / "blobs" / "ab" / "TEST003+Doctor_Test+.json")
+    return root
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return CUHSnapshotCatalog(str(tmp_path / "catalog" / "snapshots.db"))
+
+
+def test_parse_snapshot_name():
+    assert parse_snapshot_name(SNAPSHOTS[0]) \
+        == ("TEST001", "Doctor Test", "01_01_2024_09_00_00", ".json")
+    assert parse_snapshot_name("TEST001+Doctor_Test+.cuhss") \
+        == ("TEST001", "Doctor Test", None, ".cuhss")
+    assert parse_snapshot_name("notes.txt") is None
+    assert parse_snapshot_name("TEST001.json") is None
+
+
+def test_scan_is_incremental(share, catalog):
+    assert catalog.scan(str(share)) \
+        == {'added': 3, 'updated': 0, 'unchanged': 0, 'removed': 0}
+    assert catalog.scan(str(share)) \
+        == {'added': 0, 'updated': 0, 'unchanged': 3, 'removed': 0}
+
+    write(share / SNAPSHOTS[0], '{"rois": []}')
+    remove(share / SNAPSHOTS[2])
+    write(share / "TEST002+Doctor_Other+04_01_2024_09_00_00+.json")
+    assert catalog.scan(str(share)) \
+        == {'added': 1, 'updated': 1, 'unchanged': 1, 'removed': 1}
+
+    snapshots = catalog.snapshots_for_patient("TEST002")
+    assert [path.basename(s['path']) for s in snapshots] \
+        == ["TEST002+Doctor_Other+04_01_2024_09_00_00+.json"]
+
+
+def test_snapshots_for_patient_newest_first(share, catalog):
+    catalog.scan(str(share))
+    snapshots = catalog.snapshots_for_patient("TEST001")
+    assert [path.basename(s['path']) for s in snapshots] \
+        == [SNAPSHOTS[1], SNAPSHOTS[0]]
+    assert snapshots[0]['reviewer'] == "Doctor Test"
+    assert snapshots[0]['locktime_iso'] == "2024-03-01T09:00:00"
+    assert snapshots[0]['format'] == ".cuhss"
+    # Sub-folders, e.g. the blob store, are not scanned
+    assert catalog.snapshots_for_patient("TEST003") == []
+
+
+def test_recorded_snapshot_is_unchanged_on_scan(share, catalog):
+    f_path = share / "TEST004+Doctor_Test+05_01_2024_09_00_00+.cuhsm"
+    write(f_path)
+    assert catalog.record(str(f_path))
+    assert not catalog.record(str(share / "notes.txt"))
+    assert len(catalog.snapshots_for_patient("TEST004")) == 1
+
+    assert catalog.scan(str(share)) \
+        == {'added': 3, 'updated': 0, 'unchanged': 1, 'removed': 0}
+
+
+def test_cancelled_scan_leaves_the_catalog(share, catalog):
+    from modules.structure_set_classes import CUHRTOperationCancelled
+
+    catalog.scan(str(share))
+    remove(share / SNAPSHOTS[0])
+    write(share / "TEST001+Doctor_Test+06_01_2024_09_00_00+.json")
+
+    calls = []
+    def progress(done, total, text):
+        calls.append(done)
+        return len(calls) < 2
+
+    with pytest.raises(CUHRTOperationCancelled):
+        catalog.scan(str(share), progress = progress)
+    assert [path.basename(s['path'])
+        for s in catalog.snapshots_for_patient("TEST001")] \
+        == [SNAPSHOTS[1], SNAPSHOTS[0]]
@@ -0,0 +1,228 @@
+'''
+Round trips of binary, json and manifest snapshots, and the error bound
+of each point encoding, see modules/snapshot_io.py.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import json
+
+import numpy as np
+import pytest
+
+import modules.snapshot_io as snapshot_io
+from modules.snapshot_io import (
+    BLOB_DIR, COMPRESSION, DTYPES, QUANTUM, CUHBlobStore, SnapshotReader,
+    decode_contours, encode_contours, read_binary_snapshot,
+    write_binary_snapshot, write_json_snapshot, write_manifest_snapshot
+)
+
+HEADER = {
+    'f_name': "TEST001+Doctor_Test+01_01_2024_09_00_00+",
+    'locktime': "01/01/2024 09:00:00",
+    'reviewer': "Doctor^Test",
+}
+
+# Largest round trip error of each encoding, relative to the largest
+# coordinate for float32 [cm]
+MAX_ERROR = {
+    'float64': lambda scale: 0.0,
+    'float32': lambda scale: scale * 2.0 ** -24,
+    'quantized': lambda scale: QUANTUM / 2 + 1e-12,
+}
+
+
+def random_contours(seed: int = 0) -> list:
+    '''
+        Wobbly circles on 3mm slices, with one contour that jumps across
+        the patient so that the quantized deltas overflow int16.
+    '''
+    rng = np.random.default_rng(seed)
+    contours = []
+    for k in range(12):
+        theta = np.sort(rng.uniform(0, 2 * np.pi, 200))
+        r = 5 + rng.normal(0, 0.05, len(theta))
+        contours.append([
+            {'x': x, 'y': y, 'z': -10 + 0.3 * k}
+            for x, y in zip(3.3 + r * np.cos(theta), -7.1 + r * np.sin(theta))
+        ])
+    contours.append([
+        {'x': x, 'y': y, 'z': 25.123456789}
+        for x, y in rng.uniform(-40, 40, (50, 2))
+    ])
+    return contours
+
+
+def rois() -> list:
+    return [
+        {
+            'label': "PTV", 'colour': "255, 255, 0, 0", 'volume': 300.0,
+            'centroid': {'x': 3.3, 'y': -7.1, 'z': -8.35},
+            'has_contours': True, 'contours': random_contours(1),
+        },
+        {
+            'label': "Empty", 'colour': "255, 0, 0, 255", 'volume': 0.0,
+            'centroid': {'x': 0.0, 'y': 0.0, 'z': 0.0},
+            'has_contours': False,
+        },
+        {
+            'label': "Body", 'colour': "255, 0, 255, 0", 'volume': 9000.0,
+            'centroid': {'x': 0.0, 'y': 0.0, 'z': 0.0},
+            'has_contours': True, 'contours': random_contours(2),
+        },
+    ]
+
+
+def as_array(contours: list) -> np.ndarray:
+    return np.array([
+        (point['x'], point['y'], point['z'])
+        for contour in contours for point in contour
+    ])
+
+
+@pytest.mark.parametrize("compression", list(COMPRESSION))
+@pytest.mark.parametrize("dtype", list(DTYPES))
+def test_binary_round_trip_error(tmp_path, dtype, compression):
+    original = rois()
+    f_path = tmp_path / "snapshot.cuhss"
+    with open(f_path, 'wb') as f:
+        write_binary_snapshot(f, HEADER, original, compression, dtype)
+
+    with open(f_path, 'rb') as f:
+        in_full = read_binary_snapshot(f)
+    reader = SnapshotReader(str(f_path))
+    assert reader.lazy
+    for key, value in HEADER.items():
+        assert reader.data[key] == value == in_full[key]
+
+    for index, roi in enumerate(original):
+        assert reader.data['rois'][index]['label'] == roi['label']
+        assert reader.data['rois'][index]['has_contours'] \
+            == roi['has_contours']
+        lazy_contours = reader.read_contours(index)
+        if not roi['has_contours']:
+            assert lazy_contours is None
+            assert 'contours' not in in_full['rois'][index]
+            continue
+
+        assert [len(c) for c in lazy_contours] \
+            == [len(c) for c in roi['contours']]
+        expected = as_array(roi['contours'])
+        bound = MAX_ERROR[dtype](np.abs(expected).max())
+        for contours in (lazy_contours, in_full['rois'][index]['contours']):
+            error = np.abs(as_array(contours) - expected).max()
+            assert error <= bound, f"{dtype}: {error} > {bound}"
+
+
+def test_quantized_decode_without_numpy(monkeypatch):
+    contours = random_contours(3)
+    contours.insert(4, [])
+    data = encode_contours(contours, DTYPES['quantized'])
+    with_numpy = decode_contours(data, DTYPES['quantized'])
+    monkeypatch.setattr(snapshot_io, "_numpy", lambda: None)
+    without_numpy = decode_contours(data, DTYPES['quantized'])
+
+    assert [len(c) for c in without_numpy] == [len(c) for c in contours]
+    np.testing.assert_allclose(
+        as_array(without_numpy), as_array(with_numpy), rtol = 0, atol = 1e-12
+    )
+    assert np.abs(as_array(without_numpy) - as_array(contours)).max() \
+        <= MAX_ERROR['quantized'](None)
+
+
+def write_manifest(tmp_path, name: str, original: list) -> dict:
+    store = CUHBlobStore(str(tmp_path / BLOB_DIR))
+    with open(tmp_path / name, 'wb') as f:
+        return write_manifest_snapshot(
+            f, store, HEADER, original, iter(original), "zlib", "quantized"
+        )
+
+
+def test_manifest_round_trip(tmp_path):
+    original = rois()
+    original[0]['fingerprint'] = "f" * 64
+    stats = write_manifest(tmp_path, "snapshot.cuhsm", original)
+    assert stats['blobs_written'] == 2
+    assert stats['blobs_skipped'] == 0
+    assert stats['blob_bytes_written'] > 0
+
+    reader = SnapshotReader(str(tmp_path / "snapshot.cuhsm"))
+    assert reader.lazy
+    for key, value in HEADER.items():
+        assert reader.data[key] == value
+    assert reader.data['rois'][0]['fingerprint'] == "f" * 64
+    assert 'fingerprint' not in reader.data['rois'][2]
+
+    for index, roi in enumerate(original):
+        assert reader.data['rois'][index]['has_contours'] \
+            == roi['has_contours']
+        contours = reader.read_contours(index)
+        if not roi['has_contours']:
+            assert contours is None
+            continue
+        assert [len(c) for c in contours] == [len(c) for c in roi['contours']]
+        assert np.abs(as_array(contours) - as_array(roi['contours'])).max() \
+            <= MAX_ERROR['quantized'](None)
+
+
+def test_manifest_blobs_are_written_once(tmp_path):
+    first = write_manifest(tmp_path, "first.cuhsm", rois())
+    second = write_manifest(tmp_path, "second.cuhsm", rois())
+    assert first['blobs_written'] == 2
+    assert second == {
+        'blobs_written': 0, 'blobs_skipped': 2, 'blob_bytes_written': 0
+    }
+    assert len(list((tmp_path / BLOB_DIR).rglob("*.blob"))) == 2
+
+    reader = SnapshotReader(str(tmp_path / "second.cuhsm"))
+    assert as_array(reader.read_contours(2)).shape \
+        == as_array(rois()[2]['contours']).shape
+
+
+def test_corrupt_blob_is_detected(tmp_path):
+    write_manifest(tmp_path, "snapshot.cuhsm", rois())
+    with open(tmp_path / "snapshot.cuhsm") as f:
+        digest = json.load(f)['blobs'][0]
+    blob_path = CUHBlobStore(str(tmp_path / BLOB_DIR)).blob_path(digest)
+    with open(blob_path, 'r+b') as f:
+        data = f.read()
+        f.seek(len(data) // 2)
+        f.write(bytes([data[len(data) // 2] ^ 0xFF]))
+
+    reader = SnapshotReader(str(tmp_path / "snapshot.cuhsm"))
+    with pytest.raises(ValueError, match = "Corrupt blob"):
+        reader.read_contours(0)
+    assert reader.read_contours(2) is not None
+
+
+def test_json_toc_round_trip(tmp_path):
+    original = rois()
+    original[2]['fingerprint'] = "b" * 64
+    f_path = tmp_path / "snapshot.json"
+    with open(f_path, 'wb') as f:
+        write_json_snapshot(f, HEADER, original, iter(original))
+
+    # Still a plain json document, for the readers without a TOC
+    with open(f_path) as f:
+        in_full = json.load(f)
+    assert in_full['f_name'] == HEADER['f_name']
+
+    reader = SnapshotReader(str(f_path))
+    assert reader.lazy
+    for key, value in HEADER.items():
+        assert reader.data[key] == value
+    assert reader.data['rois'][2]['fingerprint'] == "b" * 64
+    assert 'fingerprint' not in reader.data['rois'][0]
+
+    for index, roi in enumerate(original):
+        assert reader.data['rois'][index]['label'] == roi['label']
+        assert reader.data['rois'][index]['has_contours'] \
+            == roi['has_contours']
+        contours = reader.read_contours(index)
+        if not roi['has_contours']:
+            assert contours is None
+            continue
+        # json round trips floats exactly
+        assert contours == json.loads(json.dumps(roi['contours']))
@@ -0,0 +1,46 @@
+'''
+Grid index against the brute force reference, see
+modules/surface_distance.py.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import numpy as np
+import pytest
+
+from modules.surface_distance import (
+    nearest_distances, surface_distance_metrics
+)
+
+
+def sphere_points(n_points: int, centre, radius: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size = (n_points, 3))
+    points /= np.linalg.norm(points, axis = 1)[:, None]
+    return np.asarray(centre) + radius * points
+
+
+@pytest.mark.parametrize("offset", [0.2, 5.0, 40.0, 500.0])
+def test_grid_matches_brute_force(offset):
+    a = sphere_points(2000, (0, 0, 0), 2.0, seed = 1)
+    b = sphere_points(1500, (offset, 0.5 * offset, 0), 1.5, seed = 2)
+
+    for queries, points in ((a, b), (b, a)):
+        np.testing.assert_allclose(
+            nearest_distances(queries, points),
+            nearest_distances(queries, points, method = "brute_force")
+        )
+
+
+def test_disjoint_distant_metrics_finite():
+    a = sphere_points(1000, (0, 0, 0), 1.0, seed = 3)
+    b = sphere_points(1000, (100, 0, 0), 1.0, seed = 4)
+
+    grid = surface_distance_metrics(a, b)
+    brute = surface_distance_metrics(a, b, method = "brute_force")
+    for key, value in grid.items():
+        assert np.isfinite(value)
+        assert value == pytest.approx(brute[key])
+    assert grid['MaxDistanceToAgreement'] > 98
@@ -0,0 +1,87 @@
+'''
+Widget count probes of the pooled ROILockTime rows and status cells, see
+CUHLayoutProbe in widgets/cuh_tkinter.py. Skipped without a display.
+
+Author: Liam Stubbington
+RT Physicist, Cambridge University Hospitals NHS Foundation Trust
+
+'''
+
+import sys
+import tkinter as tk
+from os import path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+# roi_lock_time_main imports connect, served by the stand-in
+sys.path.insert(0, path.join(ROOT, "fake_connect"))
+
+from widgets.cuh_tkinter import (
+    CUHLayoutProbe, CUHStatusCell, CUHVirtualList, count_widgets
+)
+
+REFRESHES = 20
+
+
+@pytest.fixture
+def root():
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip("no display")
+    root.withdraw()
+    yield root
+    root.destroy()
+
+
+def make_rois(n_rois: int, offset: float = 0.0) -> list:
+    return [
+        SimpleNamespace(roi = {
+            'label': f"ROI_{i:03d}",
+            'volume': 10.0 + i + offset,
+            'centroid': {'x': 0.1 * i, 'y': 0.0, 'z': offset},
+        }) for i in range(n_rois)
+    ]
+
+
+def test_status_cell_updates_in_place(root):
+    cell = CUHStatusCell(root, '', 0, 0)
+    with CUHLayoutProbe(root) as probe:
+        for i in range(REFRESHES):
+            cell.set_status(f"status {i}", ("good", "WARN", "bad")[i % 3])
+    assert probe.widgets_added == 0
+    assert cell["text"] == f"status {REFRESHES - 1}"
+
+
+def test_pooled_rows_add_no_widgets(root):
+    from modules.roi_tolerance import CUHRTToleranceMatrix
+    from roi_lock_time_main import ROILockTimeRow
+
+    reference = make_rois(40)
+    approvals = [make_rois(60, offset) for offset in (0.0, 0.05, 1.0)]
+
+    def bind_row(row, roi, index):
+        row.bind_roi(
+            roi, reference, tolerance_matrix = state['matrix'], 
+            matrix_row = index
+        )
+
+    state = {'matrix': None}
+    table = CUHVirtualList(
+        root, 0, 0, row_factory = lambda parent, i: ROILockTimeRow(parent, i),
+        bind_row = bind_row, visible_rows = 8
+    )
+    widgets = count_widgets(root)
+
+    with CUHLayoutProbe(root) as probe:
+        for i in range(REFRESHES):
+            rois = approvals[i % len(approvals)]
+            state['matrix'] = CUHRTToleranceMatrix(rois, reference)
+            table.set_items(rois)
+            table.scroll_to(i)
+
+    assert probe.widgets_before == widgets
+    assert probe.widgets_added == 0
+    assert probe.layout_time >= 0
@@ -8,6 +8,12 @@ RT Physicist, Cambridge University Hospitals NHS Foundation Trust
 
 import tkinter as tk 
 import tkinter.ttk as ttk
+from os import makedirs, path
+from queue import Queue, Empty
+from shutil import copyfile
+from threading import Thread, Event
+from time import perf_counter
+from tkinter import messagebox as mb
 
 BLACK = "#000000"
 RED = "#EC4E20"
@@ -20,6 +26,30 @@ PADY = 5
 
 WIDTH = 30
 
+ICON_PATH = (
+    "//MOSAIQAPP-20/mosaiq_app/TOOLS/RayStation"
+    "/microscope_io/microscope.ico"
+)
+# Local copy of the icon, made the first time it is read from ICON_PATH
+LOCAL_ICON_PATH = path.join(
+    path.expanduser("~"), "ROILockTime", "microscope.ico"
+)
+
+def disp_colour(disp: str) -> str:
+    '''
+        Colour for a disp string: "good", "bad", "warn" or "info".
+    '''
+    disp = disp.lower()
+
+    if "warn" in disp:
+        return ORANGE
+    elif "good" in disp:
+        return GREEN
+    elif "bad" in disp:
+        return RED
+    else:
+        return BLUE
+
 class CUHLabelText(tk.Label):
     '''
         Display strings as formatted text. 
@@ -37,16 +67,7 @@ class CUHLabelText(tk.Label):
             parent, width = WIDTH, text = text, background=BLACK,
             justify = tk.CENTER, font = ("Calibri 12"), )
 
-        disp = disp.lower()
-
-        if "warn" in disp:
-            self["foreground"] = ORANGE
-        elif "good" in disp:
-            self["foreground"] = GREEN
-        elif "bad" in disp:
-            self["foreground"] = RED
-        else:
-            self["foreground"] = BLUE
+        self["foreground"] = disp_colour(disp)
         
 
         self.grid(
@@ -54,6 +75,22 @@ class CUHLabelText(tk.Label):
             rowspan=rowspan, padx = PADX, pady = PADY
         )
 
+class CUHStatusCell(CUHLabelText):
+    '''
+        CUHLabelText whose text and colour are updated in place with 
+        set_status, rather than by stacking a new label on top. 
+    '''
+
+    def set_status(self, text: str, disp: str = "info"):
+        '''
+            Update the text and the disp colour, only if changed. 
+        '''
+        colour = disp_colour(disp)
+        if self["text"] != text:
+            self["text"] = text
+        if self["foreground"] != colour:
+            self["foreground"] = colour
+
 class CUHTitleText(tk.Label):
     '''
     Similar to CUHLabelText but bold formatting. 
@@ -205,6 +242,276 @@ class CUHScrollableFrame(tk.Frame):
         self.canvas.configure(scrollregion=self.canvas.bbox("all"))
 
 
+class CUHVirtualList(tk.Frame):
+    ''' 
+        Virtualised list with a RHS vertical scroll bar. 
+
+        Only visible_rows row widgets are ever created. As the user 
+        scrolls, the same pool of widgets is re-bound to the visible items, 
+        so long lists cost no more to show or refresh than short ones. 
+
+        Args: 
+            - parent: root widget
+            - row, col: for grid
+            - row_factory: function(parent, pool_index) -> widget 
+                must grid itself at row pool_index of parent 
+            - bind_row: function(widget, item, index) 
+                updates widget in place to show items[index]
+
+        Kwargs: 
+            - visible_rows: int (default 15)
+            - columnspan: int (default 1)
+
+        Attributes: 
+            - frame 
+            - vsb 
+            - pool: list of row widgets 
+            - items 
+
+        Methods: 
+            - set_items 
+            - refresh 
+            - scroll_to 
+            - yview 
+
+    '''
+    def __init__(self, parent, row: int, col: int, row_factory, bind_row, 
+    visible_rows: int = 15, columnspan: int = 1):
+        super().__init__(
+            parent, background=BLACK, padx = 0, pady = 0, 
+            )
+
+        self.frame = tk.Frame(self, background=BLACK,)
+        self.frame.columnconfigure(0, weight = 1)
+        self.vsb = tk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.vsb.pack(side="right", fill="y")
+        self.frame.pack(side="left", fill="both", expand=True)
+
+        self.bind_row = bind_row
+        self.items = []
+        self.first = 0
+        self.pool = [
+            row_factory(self.frame, i) for i in range(visible_rows)
+        ]
+
+        # Only scroll with the mouse wheel while the pointer is over the list
+        self.bind("<Enter>", self._bind_mousewheel)
+        self.bind("<Leave>", self._unbind_mousewheel)
+
+        self.grid(
+            row = row, column = col, columnspan=columnspan, sticky='NSEW'
+        )
+        self.refresh()
+
+    def set_items(self, items: list, keep_position: bool = True):
+        '''Show items, re-binding the row widgets in place'''
+        self.items = list(items)
+        if not keep_position:
+            self.first = 0
+        self.scroll_to(self.first)
+
+    def scroll_to(self, index: int):
+        '''Make items[index] the first visible row'''
+        last_first = max(len(self.items) - len(self.pool), 0)
+        self.first = min(max(int(index), 0), last_first)
+        self.refresh()
+
+    def refresh(self):
+        '''Re-bind every visible row widget and update the scroll bar'''
+        for i, widget in enumerate(self.pool):
+            index = self.first + i
+            if index < len(self.items):
+                self.bind_row(widget, self.items[index], index)
+                widget.grid()
+            else:
+                widget.grid_remove()
+
+        if self.items:
+            self.vsb.set(
+                self.first / len(self.items),
+                min(self.first + len(self.pool), len(self.items))
+                / len(self.items)
+            )
+        else:
+            self.vsb.set(0, 1)
+
+    def yview(self, *args):
+        '''Scroll bar command: moveto fraction or scroll n units/pages'''
+        if not args:
+            return
+        if args[0] == "moveto":
+            self.scroll_to(round(float(args[1]) * len(self.items)))
+        elif args[0] == "scroll":
+            step = len(self.pool) if args[2] == "pages" else 1
+            self.scroll_to(self.first + int(args[1]) * step)
+
+    def _bind_mousewheel(self, event):
+        self.bind_all("<MouseWheel>", self._on_mousewheel)
+        self.bind_all("<Button-4>", self._on_mousewheel)
+        self.bind_all("<Button-5>", self._on_mousewheel)
+
+    def _unbind_mousewheel(self, event):
+        self.unbind_all("<MouseWheel>")
+        self.unbind_all("<Button-4>")
+        self.unbind_all("<Button-5>")
+
+    def _on_mousewheel(self, event):
+        if getattr(event, "num", None) == 4 or event.delta > 0:
+            self.scroll_to(self.first - 1)
+        else:
+            self.scroll_to(self.first + 1)
+
+
+class CUHProgressBar(ttk.Progressbar):
+    '''
+        Horizontal progress bar with formatting. 
+        update_progress(done, total) sets the bar, total of None or 0 
+        shows an indeterminate bar. 
+    '''
+    def __init__(self, parent, row: int, col: int, columnspan: int = 1, 
+    length: int = WIDTH*8):
+        s = ttk.Style()
+        s.configure(
+            'CUH.Horizontal.TProgressbar', background = ORANGE, 
+            troughcolor = BLACK
+        )
+        super().__init__(
+            parent, orient = tk.HORIZONTAL, mode = "determinate", 
+            length = length, style = 'CUH.Horizontal.TProgressbar'
+        )
+
+        self.grid(
+            row = row, column = col, columnspan=columnspan, sticky = "EW",
+            padx = PADX, pady = PADY
+        )
+
+    def update_progress(self, done: int, total: int = None):
+        if not total:
+            if str(self["mode"]) != "indeterminate":
+                self.configure(mode = "indeterminate")
+                self.start(20)
+            return
+        if str(self["mode"]) != "determinate":
+            self.stop()
+            self.configure(mode = "determinate")
+        self.configure(maximum = total, value = done)
+
+    def reset(self):
+        self.stop()
+        self.configure(mode = "determinate", value = 0)
+
+
+class CUHBackgroundTask():
+    '''
+        Runs func on a worker thread so the GUI stays responsive. Progress, 
+        the result and any exception are passed back through a queue and 
+        handled on the Tk main thread, polled with after(). 
+
+        Args: 
+            - root: any Tk widget, used for after() 
+            - func: function(report) 
+                report(done, total, text = "") -> bool 
+                returns False once cancel() has been called, func should 
+                then stop as soon as possible 
+
+        Kwargs (all called on the main thread): 
+            - on_done: function(result) 
+            - on_error: function(exception) 
+            - on_progress: function(done, total, text) 
+            - threaded: bool (default True) 
+                if False, func runs synchronously on the main thread 
+            - poll_ms: int (default 50) 
+
+        Methods: 
+            - start 
+            - cancel 
+            - running (property) 
+    '''
+    def __init__(self, root, func, on_done = None, on_error = None, 
+    on_progress = None, threaded: bool = True, poll_ms: int = 50):
+        self.root = root 
+        self.func = func 
+        self.on_done = on_done 
+        self.on_error = on_error 
+        self.on_progress = on_progress 
+        self.threaded = threaded 
+        self.poll_ms = poll_ms 
+        self._queue = Queue()
+        self._cancel = Event()
+        self._thread = None 
+        self._running = False 
+
+    @property
+    def running(self) -> bool:
+        return self._running 
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        '''Ask func to stop, at its next report'''
+        self._cancel.set()
+
+    def report(self, done: int, total: int = None, text: str = "") -> bool:
+        '''Passed to func. Safe to call from the worker thread'''
+        self._queue.put(("progress", (done, total, text)))
+        if not self.threaded:
+            self._poll()
+            self.root.update()
+        return not self._cancel.is_set()
+
+    def start(self):
+        self._running = True 
+        if not self.threaded:
+            self._run()
+            self._poll()
+            return self
+        self._thread = Thread(target = self._run, daemon = True)
+        self._thread.start()
+        self.root.after(self.poll_ms, self._poll)
+        return self
+
+    def _run(self):
+        try:
+            self._queue.put(("done", self.func(self.report)))
+        except BaseException as err:
+            # SystemExit too, so that nothing is swallowed by the thread
+            self._queue.put(("error", err))
+
+    def _poll(self):
+        progress = None 
+        finished = None 
+        while True:
+            try:
+                kind, payload = self._queue.get_nowait()
+            except Empty:
+                break
+            if kind == "progress":
+                # Only the latest progress report is worth drawing
+                progress = payload
+            else:
+                finished = (kind, payload)
+
+        if progress is not None and self.on_progress is not None:
+            self.on_progress(*progress)
+
+        if finished is None:
+            if self.threaded:
+                self.root.after(self.poll_ms, self._poll)
+            return
+
+        self._running = False 
+        kind, payload = finished
+        if kind == "done":
+            if self.on_done is not None:
+                self.on_done(payload)
+        elif self.on_error is not None:
+            self.on_error(payload)
+        else:
+            raise payload
+
+
 class CUHHorizontalRule(ttk.Separator):
     '''
         Simple horizontal rule 
@@ -217,4 +524,191 @@ class CUHHorizontalRule(ttk.Separator):
         )
        
 
-        self.grid(row=row, column=col, columnspan = columnspan, sticky = "EW")
\ No newline at end of file
+        self.grid(row=row, column=col, columnspan = columnspan, sticky = "EW")
+
+
+def count_widgets(widget) -> int:
+    '''
+        Number of widgets in the tree below widget, inclusive. 
+    '''
+    return 1 + sum(count_widgets(child) for child in widget.winfo_children())
+
+
+class CUHLayoutProbe():
+    '''
+        Context manager measuring the widget count and the layout time of a 
+        GUI update, so that leaks and slow redraws can be caught in tests. 
+
+        Args: 
+            - root: widget whose tree is counted 
+
+        Attributes (set on exit): 
+            - widgets_before, widgets_after, widgets_added: int 
+            - layout_time: float [s], including update_idletasks 
+
+        with CUHLayoutProbe(root) as probe:
+            row.cf_centroid_and_volume()
+        assert probe.widgets_added == 0
+    '''
+
+    def __init__(self, root):
+        self.root = root 
+        self.widgets_before = None 
+        self.widgets_after = None 
+        self.widgets_added = None 
+        self.layout_time = None 
+
+    def __enter__(self):
+        self.widgets_before = count_widgets(self.root)
+        self._start = perf_counter()
+        return self 
+
+    def __exit__(self, *exc_info):
+        self.root.update_idletasks()
+        self.layout_time = perf_counter() - self._start
+        self.widgets_after = count_widgets(self.root)
+        self.widgets_added = self.widgets_after - self.widgets_before
+        return False
+
+
+class CUHDialogService():
+    '''
+        Message boxes shown over one shared Tk root, rather than a new 
+        Tk() per message. 
+
+        The root is the app window, once registered, else a hidden root 
+        created on first use and kept. The icon is resolved once: the 
+        local copy if there is one, else ICON_PATH, which is then copied 
+        locally, else no icon. 
+
+        Kwargs: 
+            - icon_path: str (optional, ICON_PATH) 
+            - local_icon_path: str (optional, LOCAL_ICON_PATH) 
+
+        Methods: 
+            - register_root(root) 
+                show dialogs over root, e.g. the app window 
+            - root 
+                the registered root, or the hidden root 
+            - apply_icon(window) 
+            - askokcancel(title, message, icon = mb.WARNING) 
+            - showerror(title, message) 
+
+        Dialogs must be shown from the Tk main thread. 
+    '''
+
+    def __init__(self, icon_path: str = ICON_PATH, 
+        local_icon_path: str = LOCAL_ICON_PATH):
+        self.icon_path = icon_path 
+        self.local_icon_path = local_icon_path 
+        self._icon = None 
+        self._icon_resolved = False 
+        self._root = None 
+        self._hidden_root = None 
+
+    def icon(self) -> str:
+        '''
+            Path of the icon to use, or None. Resolved on first call only. 
+        '''
+        if self._icon_resolved:
+            return self._icon 
+        self._icon_resolved = True 
+
+        if path.isfile(self.local_icon_path):
+            self._icon = self.local_icon_path 
+        elif path.isfile(self.icon_path):
+            self._icon = self.icon_path 
+            try:
+                makedirs(path.dirname(self.local_icon_path), exist_ok = True)
+                copyfile(self.icon_path, self.local_icon_path)
+                self._icon = self.local_icon_path 
+            except OSError:
+                pass 
+        return self._icon 
+
+    def apply_icon(self, window):
+        icon = self.icon()
+        if icon is None:
+            return 
+        try:
+            window.iconbitmap(icon)
+        except tk.TclError:
+            pass 
+
+    def register_root(self, root):
+        '''
+            Show dialogs over root from now on, and drop the hidden root. 
+        '''
+        self._root = root 
+        self.apply_icon(root)
+        if self._hidden_root is not None:
+            self._hidden_root.destroy()
+            self._hidden_root = None 
+
+    @staticmethod
+    def _exists(window) -> bool:
+        try:
+            return bool(window.winfo_exists())
+        except tk.TclError:
+            return False 
+
+    def root(self):
+        if self._root is not None and self._exists(self._root):
+            return self._root 
+        self._root = None 
+        if self._hidden_root is None or not self._exists(self._hidden_root):
+            self._hidden_root = tk.Tk()
+            self._hidden_root.withdraw()
+            self.apply_icon(self._hidden_root)
+        return self._hidden_root 
+
+    def askokcancel(self, title: str, message: str, 
+        icon: str = mb.WARNING) -> bool:
+        return mb.askokcancel(
+            title = title, message = message, icon = icon, 
+            parent = self.root()
+        )
+
+    def showerror(self, title: str, message: str):
+        mb.showerror(title = title, message = message, parent = self.root())
+
+
+DIALOGS = CUHDialogService()
+
+
+class CUHStartupProbe():
+    '''
+        Measures the time from launch to the first paint of a window: its 
+        first <Map>, once the idle redraws queued with it have run. 
+
+        Args: 
+            - window: Tk or Toplevel 
+            - launch_time: float, perf_counter() at launch 
+
+        Kwargs: 
+            - on_paint: function(probe) (optional) 
+
+        Attributes: 
+            - first_paint_time: float [s], None until painted 
+    '''
+
+    def __init__(self, window, launch_time: float, on_paint = None):
+        self.window = window 
+        self.launch_time = launch_time 
+        self.on_paint = on_paint 
+        self.first_paint_time = None 
+        self._mapped_once = False 
+        # Not unbound later, as unbind would drop any other <Map> bindings
+        window.bind("<Map>", self._mapped, add = "+")
+
+    def _mapped(self, event = None):
+        if self._mapped_once or (
+            event is not None and event.widget is not self.window):
+            return 
+        self._mapped_once = True 
+        self.window.after_idle(self._painted)
+
+    def _painted(self):
+        self.first_paint_time = perf_counter() - self.launch_time 
+        if self.on_paint is not None:
+            self.on_paint(self)